@@ -0,0 +1,188 @@
+import frappe
+
+# Activity counters (emails, comments, tasks, notes) shown on list rows.
+#
+# Counts for a whole page of records are taken with one grouped query per source table.
+# Optionally, `__crm_activity_counts` keeps them denormalized per record, so a page of counts
+# is a single primary key lookup. It is kept current by the `after_insert` / `on_update` /
+# `on_trash` doc events of the source doctypes and can be rebuilt at any time with
+# `bench --site <site> execute crm.api.activity_counts.rebuild_activity_counts`.
+
+COUNTS_TABLE = "__crm_activity_counts"
+COUNTS_READY_KEY = "crm_activity_counts_ready"
+
+# counter -> (source doctype, field holding the record name, extra filters)
+COUNTERS = {
+	"_email_count": (
+		"Communication",
+		"reference_name",
+		{"communication_type": ("in", ["Communication", "Automated Message"])},
+	),
+	"_comment_count": ("Comment", "reference_name", {"comment_type": "Comment"}),
+	"_task_count": ("CRM Task", "reference_docname", {}),
+	"_note_count": ("FCRM Note", "reference_docname", {}),
+}
+
+
+def setup_activity_counts_table():
+	columns = ",\n".join(f"`{counter}` INT NOT NULL DEFAULT 0" for counter in COUNTERS)
+	frappe.db.sql(
+		f"""
+		CREATE TABLE IF NOT EXISTS `{COUNTS_TABLE}` (
+			`reference_doctype` VARCHAR(140) NOT NULL,
+			`reference_name` VARCHAR(140) NOT NULL,
+			{columns},
+			PRIMARY KEY (`reference_doctype`, `reference_name`)
+		) ENGINE=InnoDB ROW_FORMAT=DYNAMIC CHARACTER SET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+		"""
+	)
+
+
+def is_activity_counts_table_ready():
+	return bool(frappe.db.get_default(COUNTS_READY_KEY))
+
+
+@frappe.whitelist()
+def rebuild_activity_counts():
+	"""
+	Rebuild the denormalized activity counters from their source tables.
+	"""
+	frappe.only_for("System Manager", True)
+
+	setup_activity_counts_table()
+	frappe.db.sql(f"DELETE FROM `{COUNTS_TABLE}`")
+
+	for counter, (doctype, name_field, filters) in COUNTERS.items():
+		frappe.db.sql(
+			f"""
+			INSERT INTO `{COUNTS_TABLE}` (`reference_doctype`, `reference_name`, `{counter}`)
+			SELECT reference_doctype, `{name_field}`, COUNT(*)
+			FROM `tab{doctype}`
+			WHERE reference_doctype IS NOT NULL AND `{name_field}` IS NOT NULL
+				{get_filter_conditions(filters)}
+			GROUP BY reference_doctype, `{name_field}`
+			ON DUPLICATE KEY UPDATE `{counter}` = VALUES(`{counter}`)
+			"""
+		)
+
+	frappe.db.set_default(COUNTS_READY_KEY, 1)
+	frappe.db.commit()
+
+
+def get_filter_conditions(filters):
+	conditions = ""
+	for fieldname, value in filters.items():
+		if isinstance(value, tuple):
+			conditions += f" AND `{fieldname}` IN ({', '.join(frappe.db.escape(v) for v in value[1])})"
+		else:
+			conditions += f" AND `{fieldname}` = {frappe.db.escape(value)}"
+	return conditions
+
+
+def get_activity_counts(doctype, names):
+	"""
+	Get {name: {counter: count}} of every record in `names`, with one query per source table or
+	a single lookup when the counters are denormalized.
+	"""
+	counts = {name: dict.fromkeys(COUNTERS, 0) for name in names}
+	if not names:
+		return counts
+
+	if is_activity_counts_table_ready():
+		for row in frappe.db.sql(
+			f"""
+			SELECT *
+			FROM `{COUNTS_TABLE}`
+			WHERE `reference_doctype` = %(doctype)s AND `reference_name` IN %(names)s
+			""",
+			{"doctype": doctype, "names": names},
+			as_dict=True,
+		):
+			if row.reference_name in counts:
+				counts[row.reference_name].update({counter: row[counter] for counter in COUNTERS})
+		return counts
+
+	for counter, (source, name_field, filters) in COUNTERS.items():
+		for row in frappe.db.sql(
+			f"""
+			SELECT `{name_field}` AS name, COUNT(*) AS count
+			FROM `tab{source}`
+			WHERE reference_doctype = %(doctype)s AND `{name_field}` IN %(names)s
+				{get_filter_conditions(filters)}
+			GROUP BY `{name_field}`
+			""",
+			{"doctype": doctype, "names": names},
+			as_dict=True,
+		):
+			if row.name in counts:
+				counts[row.name][counter] = row.count
+
+	return counts
+
+
+def add_activity_counts(data, doctype):
+	"""
+	Set the activity counters on every row of a list page, and keep them for getCounts calls
+	made for the same rows later in the request.
+	"""
+	counts = get_activity_counts(doctype, [row.get("name") for row in data if row.get("name")])
+	for row in data:
+		row.update(counts.get(row.get("name")) or dict.fromkeys(COUNTERS, 0))
+
+	if frappe.flags.activity_counts is None:
+		frappe.flags.activity_counts = {}
+	frappe.flags.activity_counts.update({(doctype, name): value for name, value in counts.items()})
+	return data
+
+
+def on_change(doc, method):
+	if not is_activity_counts_table_ready():
+		return
+
+	if method == "on_trash":
+		old, new = get_counter_key(doc), None
+	elif method == "after_insert":
+		old, new = None, get_counter_key(doc)
+	else:
+		doc_before_save = doc.get_doc_before_save()
+		if not doc_before_save:
+			return
+		old, new = get_counter_key(doc_before_save), get_counter_key(doc)
+
+	if old == new:
+		return
+
+	if old:
+		update_counter(*old, -1)
+	if new:
+		update_counter(*new, 1)
+
+
+def get_counter_key(doc):
+	"""
+	Get (reference doctype, reference name, counter) a source record counts towards, or None.
+	"""
+	for counter, (doctype, name_field, filters) in COUNTERS.items():
+		if doctype != doc.doctype:
+			continue
+
+		if not doc.get("reference_doctype") or not doc.get(name_field):
+			return None
+
+		for fieldname, value in filters.items():
+			allowed = value[1] if isinstance(value, tuple) else [value]
+			if doc.get(fieldname) not in allowed:
+				return None
+
+		return doc.reference_doctype, doc.get(name_field), counter
+
+
+def update_counter(reference_doctype, reference_name, counter, delta):
+	frappe.db.sql(
+		f"""
+		INSERT INTO `{COUNTS_TABLE}` (`reference_doctype`, `reference_name`, `{counter}`)
+		VALUES (%(doctype)s, %(name)s, GREATEST(%(delta)s, 0))
+		ON DUPLICATE KEY UPDATE `{counter}` = GREATEST(`{counter}` + %(delta)s, 0)
+		""",
+		{"doctype": reference_doctype, "name": reference_name, "delta": delta},
+	)
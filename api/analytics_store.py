@@ -0,0 +1,387 @@
+import csv
+import json
+import os
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, get_datetime, get_first_day, getdate, now_datetime
+
+from crm.api.deal_status import get_statuses
+
+try:
+	import duckdb
+except ImportError:
+	duckdb = None
+
+# Columnar copy of CRM Deal, CRM Lead and CRM Status Change Log for historical dashboard ranges.
+#
+# Every table is exported nightly to a Parquet file under private/crm_analytics. In between,
+# `sync_analytics_store` writes a small delta file per table holding the rows changed or
+# deleted since the export. Queries read the export with the delta applied on top through an
+# in-memory DuckDB connection, and files are replaced atomically, so workers never lock each other.
+#
+# Dashboard charts read days before the current month (the open period, where writes land)
+# from the store and only the current period from MariaDB.
+#
+# Site config:
+# - `crm_analytics_store`: turn the store on (needs the duckdb package)
+# - `crm_analytics_store_max_age`: seconds after the last sync the store is still used (default 3600)
+#
+# Scheduler (crm/hooks.py): `export_analytics_store` daily, `sync_analytics_store` every 15 minutes.
+
+DEFAULT_MAX_AGE = 60 * 60
+
+STORE_TABLES = {
+	"deals": {
+		"doctype": "CRM Deal",
+		"key": "name",
+		"columns": {
+			"name": "VARCHAR",
+			"creation": "TIMESTAMP",
+			"deal_owner": "VARCHAR",
+			"status": "VARCHAR",
+			"expected_closure_date": "DATE",
+			"expected_deal_value": "DOUBLE",
+			"deal_value": "DOUBLE",
+			"probability": "DOUBLE",
+			"exchange_rate": "DOUBLE",
+		},
+	},
+	"leads": {
+		"doctype": "CRM Lead",
+		"key": "name",
+		"columns": {
+			"name": "VARCHAR",
+			"creation": "TIMESTAMP",
+			"lead_owner": "VARCHAR",
+			"status": "VARCHAR",
+			"source": "VARCHAR",
+			"territory": "VARCHAR",
+		},
+	},
+	# child rows are replaced per parent deal, the log of a changed deal is exported again as a whole
+	"status_changes": {
+		"doctype": "CRM Status Change Log",
+		"key": "parent",
+		"parent_doctype": "CRM Deal",
+		"columns": {
+			"name": "VARCHAR",
+			"parent": "VARCHAR",
+			"creation": "TIMESTAMP",
+			"from_status": "VARCHAR",
+			"to_status": "VARCHAR",
+		},
+	},
+}
+
+# columns whose names differ from the doctype's fields
+SOURCE_COLUMNS = {"from_status": "`from`", "to_status": "`to`"}
+
+
+def is_analytics_store_enabled():
+	return duckdb is not None and bool(frappe.conf.get("crm_analytics_store"))
+
+
+def is_analytics_store_ready():
+	"""
+	Check that the store is enabled, exported and synced recently enough to be used.
+	"""
+	if not is_analytics_store_enabled():
+		return False
+
+	state = get_store_state()
+	if not state.get("synced_at"):
+		return False
+
+	max_age = frappe.utils.cint(frappe.conf.get("crm_analytics_store_max_age", DEFAULT_MAX_AGE))
+	return (now_datetime() - get_datetime(state["synced_at"])).total_seconds() <= max_age
+
+
+def get_store_path(*parts):
+	return frappe.get_site_path("private", "crm_analytics", *parts)
+
+
+def get_store_state():
+	try:
+		with open(get_store_path("state.json")) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+
+def set_store_state(**state):
+	write_atomically(get_store_path("state.json"), lambda path: write_json(path, {**get_store_state(), **state}))
+
+
+def write_json(path, data):
+	with open(path, "w") as f:
+		json.dump(data, f)
+
+
+@frappe.whitelist()
+def export_analytics_store():
+	"""
+	Export every store table in full and clear the deltas.
+
+	bench --site <site> execute crm.api.analytics_store.export_analytics_store
+	"""
+	frappe.only_for("System Manager", True)
+
+	if not is_analytics_store_enabled():
+		frappe.throw(_("The analytics store is disabled or the duckdb package is not installed"))
+
+	os.makedirs(get_store_path(), exist_ok=True)
+
+	# rows changed while the export runs are picked up by the next sync
+	exported_at = str(now_datetime())
+
+	for table, meta in STORE_TABLES.items():
+		export_table(get_store_path(f"{table}.parquet"), meta)
+		export_table(get_store_path(f"{table}_delta.parquet"), meta, delta=True, rows=[])
+
+	set_store_state(exported_at=exported_at, synced_at=exported_at)
+
+
+def sync_analytics_store():
+	"""
+	Rewrite the delta of every store table with the rows changed or deleted since the last export.
+	"""
+	if not is_analytics_store_enabled():
+		return
+
+	state = get_store_state()
+	if not state.get("exported_at"):
+		export_analytics_store()
+		return
+
+	since, synced_at = state["exported_at"], str(now_datetime())
+
+	for table, meta in STORE_TABLES.items():
+		doctype = meta.get("parent_doctype") or meta["doctype"]
+		deleted = frappe.get_all(
+			"Deleted Document",
+			filters={"deleted_doctype": doctype, "creation": (">=", since)},
+			pluck="deleted_name",
+		)
+		export_table(
+			get_store_path(f"{table}_delta.parquet"),
+			meta,
+			delta=True,
+			since=since,
+			deleted=deleted,
+		)
+
+	set_store_state(synced_at=synced_at)
+
+
+def export_table(path, meta, delta=False, since=None, rows=None, deleted=None):
+	"""
+	Write the rows of a store table to a Parquet file, going through a CSV file so no dataframe
+	library is needed. Delta files get a `deleted` column and a tombstone row per deleted key.
+	"""
+	columns = dict(meta["columns"])
+	if delta:
+		columns["deleted"] = "BOOLEAN"
+
+	csv_path = f"{path}.csv"
+	with open(csv_path, "w", newline="") as f:
+		writer = csv.writer(f)
+		writer.writerow(columns)
+
+		if rows is None:
+			with frappe.db.unbuffered_cursor():
+				for row in frappe.db.sql(*get_export_query(meta, since), as_iterator=True):
+					writer.writerow([*row, "false"] if delta else row)
+		else:
+			writer.writerows(rows)
+
+		for key in deleted or []:
+			writer.writerow([key if column == meta["key"] else None for column in meta["columns"]] + ["true"])
+
+	column_types = ", ".join(f"'{column}': '{column_type}'" for column, column_type in columns.items())
+	try:
+		write_atomically(
+			path,
+			lambda tmp_path: duckdb.connect().execute(
+				f"""
+				COPY (
+					SELECT * FROM read_csv({quote(csv_path)}, header = true, nullstr = '', columns = {{{column_types}}})
+				) TO {quote(tmp_path)} (FORMAT PARQUET)
+				"""
+			),
+		)
+	finally:
+		os.remove(csv_path)
+
+
+def get_export_query(meta, since=None):
+	fields = ", ".join(SOURCE_COLUMNS.get(column, f"`{column}`") for column in meta["columns"])
+	conds, values = "", {}
+
+	if meta.get("parent_doctype"):
+		conds += " AND parenttype = %(parent_doctype)s"
+		values["parent_doctype"] = meta["parent_doctype"]
+		if since:
+			conds += f" AND parent IN (SELECT name FROM `tab{meta['parent_doctype']}` WHERE modified >= %(since)s)"
+	elif since:
+		conds += " AND modified >= %(since)s"
+
+	if since:
+		values["since"] = since
+
+	return f"SELECT {fields} FROM `tab{meta['doctype']}` WHERE 1 = 1 {conds}", values
+
+
+def write_atomically(path, write):
+	tmp_path = f"{path}.tmp"
+	write(tmp_path)
+	os.replace(tmp_path, path)
+
+
+def get_table_sql(table):
+	"""
+	Get a query for the current rows of a store table: the export minus every key in the delta,
+	plus the delta rows that are not tombstones.
+	"""
+	meta = STORE_TABLES[table]
+	columns = ", ".join(f'"{column}"' for column in meta["columns"])
+	base, delta = get_store_path(f"{table}.parquet"), get_store_path(f"{table}_delta.parquet")
+
+	return f"""
+		SELECT {columns} FROM read_parquet({quote(base)})
+		WHERE "{meta['key']}" NOT IN (SELECT "{meta['key']}" FROM read_parquet({quote(delta)}))
+		UNION ALL
+		SELECT {columns} FROM read_parquet({quote(delta)}) WHERE NOT deleted
+	"""
+
+
+def quote(path):
+	return "'" + path.replace("'", "''") + "'"
+
+
+def query(sql, params=None):
+	"""
+	Run `sql` over the store, with every store table available by name.
+	"""
+	tables = ",\n".join(f"{table} AS ({get_table_sql(table)})" for table in STORE_TABLES)
+	result = duckdb.connect().execute(f"WITH {tables}\n{sql}", params or {})
+	columns = [column[0] for column in result.description]
+	return [frappe._dict(zip(columns, row)) for row in result.fetchall()]
+
+
+def split_historical_range(from_date, to_date=None):
+	"""
+	Split a date range at the start of the current month. Returns the end of the part to read
+	from the store and the start of the part to read from MariaDB, either of them None when that
+	part is empty. Without a ready store the whole range goes to MariaDB.
+	"""
+	if not is_analytics_store_ready():
+		return None, from_date
+
+	current_from = get_first_day(frappe.utils.nowdate())
+	if getdate(from_date) >= current_from:
+		return None, from_date
+
+	if to_date and getdate(to_date) < current_from:
+		return to_date, None
+
+	return add_days(current_from, -1), current_from
+
+
+def get_status_params():
+	return {
+		"statuses": get_statuses(),
+		"won": get_statuses(types=["Won"]),
+		"lost": get_statuses(types=["Lost"]),
+	}
+
+
+def get_store_trend(from_date, to_date, user=""):
+	"""
+	Get daily lead, deal and won deal counts from the store, like get_sales_trend.
+	"""
+	# DuckDB rejects named parameters the query does not use
+	status_params = get_status_params()
+	params = {
+		"from": getdate(from_date),
+		"to": getdate(to_date),
+		"statuses": status_params["statuses"],
+		"won": status_params["won"],
+	}
+	lead_conds = deal_conds = ""
+
+	if user:
+		lead_conds += " AND lead_owner = $user"
+		deal_conds += " AND deal_owner = $user"
+		params["user"] = user
+
+	return query(
+		f"""
+		SELECT
+			strftime(date, '%Y-%m-%d') AS date,
+			SUM(leads) AS leads,
+			SUM(deals) AS deals,
+			SUM(won_deals) AS won_deals
+		FROM (
+			SELECT CAST(creation AS DATE) AS date, COUNT(*) AS leads, 0 AS deals, 0 AS won_deals
+			FROM leads
+			WHERE creation >= $from AND creation < $to + INTERVAL 1 DAY
+			{lead_conds}
+			GROUP BY 1
+
+			UNION ALL
+
+			SELECT
+				CAST(creation AS DATE) AS date,
+				0 AS leads,
+				COUNT(*) AS deals,
+				SUM(CASE WHEN list_contains(CAST($won AS VARCHAR[]), status) THEN 1 ELSE 0 END) AS won_deals
+			FROM deals
+			WHERE creation >= $from AND creation < $to + INTERVAL 1 DAY
+				AND list_contains(CAST($statuses AS VARCHAR[]), status)
+			{deal_conds}
+			GROUP BY 1
+		) AS daily
+		GROUP BY date
+		ORDER BY date
+		""",
+		params,
+	)
+
+
+def get_store_forecast(from_date, to_date, user=""):
+	"""
+	Get forecasted and actual revenue per expected closure month from the store, like get_forecasted_revenue.
+	"""
+	params = {"from": getdate(from_date), "to": getdate(to_date), **get_status_params()}
+	deal_conds = ""
+
+	if user:
+		deal_conds += " AND deal_owner = $user"
+		params["user"] = user
+
+	return query(
+		f"""
+		SELECT
+			strftime(expected_closure_date, '%Y-%m') AS month,
+			SUM(
+				CASE
+					WHEN list_contains(CAST($lost AS VARCHAR[]), status) THEN expected_deal_value * IFNULL(exchange_rate, 1)
+					ELSE expected_deal_value * IFNULL(probability, 0) / 100 * IFNULL(exchange_rate, 1)
+				END
+			) AS forecasted,
+			SUM(
+				CASE
+					WHEN list_contains(CAST($won AS VARCHAR[]), status) THEN deal_value * IFNULL(exchange_rate, 1)
+					ELSE 0
+				END
+			) AS actual
+		FROM deals
+		WHERE expected_closure_date BETWEEN $from AND $to
+			AND list_contains(CAST($statuses AS VARCHAR[]), status)
+			{deal_conds}
+		GROUP BY 1
+		ORDER BY 1
+		""",
+		params,
+	)
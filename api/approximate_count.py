@@ -0,0 +1,99 @@
+import frappe
+
+# Approximate counts for very large lead and deal tables.
+#
+# Counting tens of millions of rows for a list's total or a number card is expensive and the
+# exact figure rarely matters at that size. With `crm_approximate_counts` set in site config,
+# counts over tables whose estimated size is at least `crm_approximate_count_threshold` rows
+# (default 1,000,000) are taken exactly only up to `crm_exact_count_limit` rows (default 10,000).
+# Beyond that the optimizer's row estimate for the same query is returned instead, flagged as
+# `lower_bound_only`: the exact limit, returned as `lower_bound`, is the only bound that holds.
+# The estimate has no error range, it can be well off either way depending on how current the
+# table statistics are, so callers must present it as "at least `lower_bound`, about `value`".
+
+DEFAULT_THRESHOLD = 1_000_000
+DEFAULT_EXACT_LIMIT = 10_000
+TABLE_ROWS_CACHE_TTL = 10 * 60
+
+
+def is_approximate_count_enabled(doctype):
+	if not frappe.conf.get("crm_approximate_counts"):
+		return False
+
+	threshold = frappe.utils.cint(frappe.conf.get("crm_approximate_count_threshold")) or DEFAULT_THRESHOLD
+	return get_table_row_estimate(doctype) >= threshold
+
+
+def get_exact_limit():
+	return frappe.utils.cint(frappe.conf.get("crm_exact_count_limit")) or DEFAULT_EXACT_LIMIT
+
+
+def get_table_row_estimate(doctype):
+	"""
+	Get the number of rows of a doctype's table from the table statistics, cached for a few minutes.
+	"""
+	key = f"crm_table_rows::{doctype}"
+	rows = frappe.cache.get_value(key)
+	if rows is None:
+		result = frappe.db.sql(
+			"""
+			SELECT TABLE_ROWS
+			FROM information_schema.TABLES
+			WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+			""",
+			f"tab{doctype}",
+		)
+		rows = frappe.utils.cint(result[0][0]) if result else 0
+		frappe.cache.set_value(key, rows, expires_in_sec=TABLE_ROWS_CACHE_TTL)
+	return rows
+
+
+def estimate_count(query, values=None):
+	"""
+	Count the rows selected by `query`, exactly up to the exact count limit and from the
+	optimizer's estimate beyond it.
+
+	Returns {"value": ..., "lower_bound_only": bool, "lower_bound": ...}, `lower_bound` being set
+	for estimated counts only. Without a usable estimate the capped count is returned.
+	"""
+	count = count_capped(query, get_exact_limit(), values)
+	if not count.lower_bound_only:
+		return count
+
+	estimate = explain_rows(query, values)
+	if estimate is None:
+		return count
+
+	return frappe._dict(
+		value=max(estimate, count.value), lower_bound_only=True, lower_bound=count.lower_bound
+	)
+
+
+def count_capped(query, cap, values=None):
+	"""
+	Count the rows selected by `query`, stopping past `cap` rows. Counts over the cap come back
+	as `cap`, flagged as `lower_bound_only` with `cap` as their lower bound ("10,000+").
+	"""
+	count = frappe.db.sql(f"SELECT COUNT(*) FROM ({query} LIMIT {cap + 1}) AS counted", values)[0][0]
+	if count <= cap:
+		return frappe._dict(value=count, lower_bound_only=False, lower_bound=None)
+	return frappe._dict(value=cap, lower_bound_only=True, lower_bound=cap)
+
+
+def explain_rows(query, values=None):
+	"""
+	Get the optimizer's estimate of the rows `query` returns from its first table: the rows it
+	reads, scaled by the share of them its conditions are expected to keep.
+
+	Returns None when the plan has no such share for a full table scan, the rows read being the
+	size of the table then rather than of the result.
+	"""
+	plan = frappe.db.sql(f"EXPLAIN EXTENDED {query}", values, as_dict=True)
+	if not plan:
+		return None
+
+	rows, filtered = frappe.utils.cint(plan[0].get("rows")), plan[0].get("filtered")
+	if filtered is None:
+		return None if plan[0].get("type") == "ALL" else rows
+	return int(rows * frappe.utils.flt(filtered) / 100)
+
@@ -0,0 +1,358 @@
+import math
+from datetime import timedelta
+
+import frappe
+from frappe import _
+from frappe.utils import get_datetime, getdate
+
+from crm.api.dashboard import get_dashboard_context
+from crm.api.deal_status import get_status_condition, get_status_type
+from crm.api.replica import replica_read
+from crm.utils import sales_user_only
+
+# Lead cohorts and their conversion lag.
+#
+# Leads are bucketed by the week (starting on Monday) they were created in. `__crm_lead_cohort`
+# holds, per cohort and owner, a histogram of the days it took the cohort to reach each
+# milestone:
+# - `lead`: the lead was created (always lag 0, the size of the cohort)
+# - `deal`: the lead was converted to a deal
+# - `stage`: the deal first moved to the deal status in `stage`, at the `to_date` of the change
+# - `won`: the deal was closed with a Won status, at its closed date
+#
+# A deal without a lead starts its own journey at its creation, counting as a lead of its
+# week, like the time to close cards do with COALESCE(l.creation, d.creation). Lead rows are
+# owned by the lead owner and deal rows by the deal owner. Lags are whole days (as
+# TIMESTAMPDIFF(DAY, ...) counts them), with everything past MAX_LAG days counted at MAX_LAG.
+#
+# The table is kept current by the `on_update` / `on_trash` doc events of CRM Lead and CRM Deal
+# and the `on_update` event of CRM Deal Status (a changed type adds or removes won deals), and
+# can be rebuilt at any time with
+# `bench --site <site> execute crm.api.cohort.rebuild_cohort_table`.
+
+COHORT_TABLE = "__crm_lead_cohort"
+COHORT_READY_KEY = "crm_lead_cohort_ready"
+MAX_LAG = 365
+
+MILESTONES = ("lead", "deal", "stage", "won")
+
+
+def setup_cohort_table():
+	frappe.db.sql(
+		f"""
+		CREATE TABLE IF NOT EXISTS `{COHORT_TABLE}` (
+			`cohort` DATE NOT NULL,
+			`owner` VARCHAR(140) NOT NULL DEFAULT '',
+			`milestone` VARCHAR(20) NOT NULL,
+			`stage` VARCHAR(140) NOT NULL DEFAULT '',
+			`lag` SMALLINT NOT NULL DEFAULT 0,
+			`count` INT NOT NULL DEFAULT 0,
+			PRIMARY KEY (`cohort`, `milestone`, `stage`, `owner`, `lag`)
+		) ENGINE=InnoDB ROW_FORMAT=DYNAMIC CHARACTER SET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+		"""
+	)
+
+
+def is_cohort_table_ready():
+	return bool(frappe.db.get_default(COHORT_READY_KEY))
+
+
+@frappe.whitelist()
+def rebuild_cohort_table():
+	"""
+	Rebuild the cohort histograms from CRM Lead, CRM Deal and their status change logs.
+	"""
+	frappe.only_for("System Manager", True)
+	_rebuild_cohort_table()
+
+
+def _rebuild_cohort_table():
+	setup_cohort_table()
+	frappe.db.sql(f"DELETE FROM `{COHORT_TABLE}`")
+
+	start = "COALESCE(l.creation, d.creation)"
+	deals = "`tabCRM Deal` d LEFT JOIN `tabCRM Lead` l ON l.name = d.lead"
+
+	insert_cohort_rows(
+		"""
+		SELECT creation AS start, IFNULL(lead_owner, '') AS owner, 'lead' AS milestone, '' AS stage, creation AS reached_at
+		FROM `tabCRM Lead`
+		"""
+	)
+	insert_cohort_rows(
+		f"""
+		SELECT {start} AS start, IFNULL(d.deal_owner, '') AS owner, 'lead' AS milestone, '' AS stage, d.creation AS reached_at
+		FROM {deals}
+		WHERE l.name IS NULL
+		"""
+	)
+	insert_cohort_rows(
+		f"""
+		SELECT {start} AS start, IFNULL(d.deal_owner, '') AS owner, 'deal' AS milestone, '' AS stage, d.creation AS reached_at
+		FROM {deals}
+		"""
+	)
+	insert_cohort_rows(
+		f"""
+		SELECT {start} AS start, IFNULL(d.deal_owner, '') AS owner, 'won' AS milestone, '' AS stage, d.closed_date AS reached_at
+		FROM {deals}
+		WHERE d.closed_date IS NOT NULL AND {get_status_condition("d.status", types=["Won"])}
+		"""
+	)
+	insert_cohort_rows(
+		f"""
+		SELECT {start} AS start, IFNULL(d.deal_owner, '') AS owner, 'stage' AS milestone, scl.to AS stage,
+			MIN(COALESCE(scl.to_date, scl.creation)) AS reached_at
+		FROM {deals}
+		JOIN `tabCRM Status Change Log` scl ON scl.parent = d.name AND scl.parenttype = 'CRM Deal'
+		WHERE scl.to IS NOT NULL AND scl.to != ''
+		GROUP BY d.name, scl.to
+		"""
+	)
+
+	frappe.db.set_default(COHORT_READY_KEY, 1)
+	frappe.db.commit()
+
+
+def insert_cohort_rows(journeys, values=None, sign=1):
+	"""
+	Add the rows of `journeys` (start, owner, milestone, stage, reached_at) to the histograms,
+	or take them out with `sign` -1.
+	"""
+	frappe.db.sql(
+		f"""
+		INSERT INTO `{COHORT_TABLE}` (`cohort`, `owner`, `milestone`, `stage`, `lag`, `count`)
+		SELECT
+			DATE_SUB(DATE(j.start), INTERVAL WEEKDAY(j.start) DAY),
+			j.owner,
+			j.milestone,
+			j.stage,
+			LEAST(GREATEST(TIMESTAMPDIFF(DAY, j.start, j.reached_at), 0), {MAX_LAG}) AS lag,
+			COUNT(*) * {sign}
+		FROM ({journeys}) j
+		GROUP BY 1, 2, 3, 4, 5
+		ON DUPLICATE KEY UPDATE `count` = `count` + VALUES(`count`)
+		""",
+		values,
+	)
+
+	if sign < 0:
+		frappe.db.sql(f"DELETE FROM `{COHORT_TABLE}` WHERE `count` <= 0")
+
+
+def on_update(doc, method):
+	if doc.doctype not in ("CRM Lead", "CRM Deal") or not is_cohort_table_ready():
+		return
+
+	doc_before_save = doc.get_doc_before_save()
+	update_cohort_table(get_cohort_counts(doc_before_save) if doc_before_save else {}, get_cohort_counts(doc))
+
+
+def on_trash(doc, method):
+	if doc.doctype not in ("CRM Lead", "CRM Deal") or not is_cohort_table_ready():
+		return
+
+	update_cohort_table(get_cohort_counts(doc), {})
+
+
+def on_deal_status_update(doc, method):
+	# whether a deal counts as won depends on the type of its status
+	if not doc.has_value_changed("type") or not is_cohort_table_ready():
+		return
+
+	doc_before_save = doc.get_doc_before_save()
+	was_won = bool(doc_before_save) and doc_before_save.type == "Won"
+	if was_won == (doc.type == "Won"):
+		return
+
+	insert_cohort_rows(
+		"""
+		SELECT COALESCE(l.creation, d.creation) AS start, IFNULL(d.deal_owner, '') AS owner,
+			'won' AS milestone, '' AS stage, d.closed_date AS reached_at
+		FROM `tabCRM Deal` d LEFT JOIN `tabCRM Lead` l ON l.name = d.lead
+		WHERE d.closed_date IS NOT NULL AND d.status = %(status)s
+		""",
+		{"status": doc.name},
+		sign=-1 if was_won else 1,
+	)
+
+
+def get_cohort_counts(doc):
+	"""
+	Get the histogram rows a lead or deal contributes to, as {(cohort, owner, milestone, stage, lag): count}.
+	"""
+	if doc.doctype == "CRM Lead":
+		return {get_cohort_key(doc.creation, doc.get("lead_owner"), "lead", "", doc.creation): 1}
+
+	lead_creation = frappe.db.get_value("CRM Lead", doc.lead, "creation") if doc.get("lead") else None
+	start, owner = lead_creation or doc.creation, doc.get("deal_owner")
+
+	reached = [("deal", "", doc.creation)]
+	if not lead_creation:
+		reached.append(("lead", "", doc.creation))
+	if doc.get("closed_date") and get_status_type(doc.status) == "Won":
+		reached.append(("won", "", doc.closed_date))
+
+	first_reached = {}
+	for row in doc.get("status_change_log") or []:
+		reached_at = row.get("to_date") or row.creation
+		if row.get("to") and reached_at:
+			first_reached[row.to] = min(first_reached.get(row.to, reached_at), reached_at, key=get_datetime)
+	reached += [("stage", stage, reached_at) for stage, reached_at in first_reached.items()]
+
+	counts = {}
+	for milestone, stage, reached_at in reached:
+		key = get_cohort_key(start, owner, milestone, stage, reached_at)
+		counts[key] = counts.get(key, 0) + 1
+	return counts
+
+
+def get_cohort_key(start, owner, milestone, stage, reached_at):
+	start = get_datetime(start)
+	cohort = start.date() - timedelta(days=start.weekday())
+	# TIMESTAMPDIFF(DAY, start, reached_at) counts whole days, truncated towards zero
+	lag = int((get_datetime(reached_at) - start).total_seconds() / 86400)
+	return (cohort, owner or "", milestone, stage, min(max(lag, 0), MAX_LAG))
+
+
+def update_cohort_table(old_counts, new_counts):
+	for key in set(old_counts) | set(new_counts):
+		delta = new_counts.get(key, 0) - old_counts.get(key, 0)
+		if not delta:
+			continue
+
+		params = dict(zip(("cohort", "owner", "milestone", "stage", "lag"), key))
+		params["count"] = delta
+
+		frappe.db.sql(
+			f"""
+			INSERT INTO `{COHORT_TABLE}` (`cohort`, `owner`, `milestone`, `stage`, `lag`, `count`)
+			VALUES (%(cohort)s, %(owner)s, %(milestone)s, %(stage)s, %(lag)s, %(count)s)
+			ON DUPLICATE KEY UPDATE `count` = `count` + VALUES(`count`)
+			""",
+			params,
+		)
+
+		if delta < 0:
+			frappe.db.sql(
+				f"""
+				DELETE FROM `{COHORT_TABLE}`
+				WHERE `cohort` = %(cohort)s AND `owner` = %(owner)s AND `milestone` = %(milestone)s
+					AND `stage` = %(stage)s AND `lag` = %(lag)s AND `count` <= 0
+				""",
+				params,
+			)
+
+
+@frappe.whitelist()
+@sales_user_only
+@replica_read
+def get_conversion_lag(from_date="", to_date="", user="", milestone="won", stage=""):
+	"""
+	Get the median, 90th percentile and average days the leads created in the range took to
+	reach `milestone` (`stage` for the stage milestone), and how many of them reached it.
+	"""
+	context = get_cohort_context(from_date, to_date, user, milestone)
+	histogram = {}
+	for row in get_histogram_rows(context, milestone, stage):
+		histogram[row.lag] = histogram.get(row.lag, 0) + row.count
+
+	count = sum(histogram.values())
+	return {
+		"count": count,
+		"median": histogram_percentile(histogram, 50),
+		"p90": histogram_percentile(histogram, 90),
+		"average": sum(lag * lag_count for lag, lag_count in histogram.items()) / count if count else None,
+	}
+
+
+@frappe.whitelist()
+@sales_user_only
+@replica_read
+def get_cohort_conversion(from_date="", to_date="", user="", milestone="won", stage="", weeks=12):
+	"""
+	Get the conversion curve of every weekly cohort created in the range: the share of its leads
+	(in %) that reached `milestone` within 1, 2, ... `weeks` weeks of their creation.
+	[
+		{ cohort: '2024-05-06', leads: 120, reached: 30, curve: [2.5, 6.7, ...] },
+		...
+	]
+	"""
+	context = get_cohort_context(from_date, to_date, user, milestone)
+	weeks = min(max(frappe.utils.cint(weeks), 1), math.ceil(MAX_LAG / 7))
+
+	cohorts = {}
+	for row in get_histogram_rows(context, "lead"):
+		cohorts.setdefault(row.cohort, {"leads": 0, "reached": [0] * weeks})["leads"] += row.count
+
+	for row in get_histogram_rows(context, milestone, stage):
+		cohort = cohorts.setdefault(row.cohort, {"leads": 0, "reached": [0] * weeks})
+		if row.lag // 7 < weeks:
+			cohort["reached"][row.lag // 7] += row.count
+
+	result = []
+	for cohort, counts in sorted(cohorts.items()):
+		reached, curve = 0, []
+		for week_count in counts["reached"]:
+			reached += week_count
+			curve.append(reached / counts["leads"] * 100 if counts["leads"] else 0)
+		result.append({"cohort": str(cohort), "leads": counts["leads"], "reached": reached, "curve": curve})
+
+	return result
+
+
+def get_cohort_context(from_date, to_date, user, milestone):
+	if milestone not in MILESTONES:
+		frappe.throw(_("Invalid milestone {0}").format(milestone))
+
+	if not is_cohort_table_ready():
+		frappe.throw(_("Cohort analytics are not set up yet, ask your System Manager to rebuild them"))
+
+	return get_dashboard_context(from_date, to_date, user)
+
+
+def get_histogram_rows(context, milestone, stage=""):
+	"""
+	Get the (cohort, lag, count) rows of a milestone for the cohorts starting in the context's range.
+	"""
+	conds = ""
+	params = {
+		# the week a lead was created in starts on or before its creation date
+		"from": getdate(context.from_date) - timedelta(days=getdate(context.from_date).weekday()),
+		"to": context.to_date,
+		"milestone": milestone,
+		"stage": stage if milestone == "stage" else "",
+	}
+
+	if context.user:
+		conds += " AND c.owner = %(user)s"
+		params["user"] = context.user
+
+	return frappe.db.sql(
+		f"""
+		SELECT c.cohort, c.lag, CAST(SUM(c.count) AS SIGNED) AS count
+		FROM `{COHORT_TABLE}` c
+		WHERE c.cohort BETWEEN %(from)s AND %(to)s
+			AND c.milestone = %(milestone)s
+			AND c.stage = %(stage)s
+			{conds}
+		GROUP BY c.cohort, c.lag
+		""",
+		params,
+		as_dict=True,
+	)
+
+
+def histogram_percentile(histogram, p):
+	"""
+	Get the smallest lag at or below which `p` % of the histogram's counts fall.
+	"""
+	total = sum(histogram.values())
+	if not total:
+		return None
+
+	rank, seen = max(1, math.ceil(p / 100 * total)), 0
+	for lag in sorted(histogram):
+		seen += histogram[lag]
+		if seen >= rank:
+			return lag
@@ -2,7 +2,25 @@ import json
 
 import frappe
 from frappe import _
-
+from frappe.utils.caching import request_cache
+
+from crm.api.analytics_store import get_store_forecast, get_store_trend, split_historical_range
+from crm.api.approximate_count import estimate_count, is_approximate_count_enabled
+from crm.api.dashboard_cache import get_cached_chart, set_cached_chart
+from crm.api.dashboard_charts import CHARTS, is_chart, takes_filter
+from crm.api.dashboard_executor import get_dashboard_workers, run_charts_concurrently
+from crm.api.dashboard_profiler import profile_chart
+from crm.api.deal_status import get_deal_status_map, get_status_condition
+from crm.api.dashboard_rollup import (
+	get_rollup_breakdown,
+	get_rollup_count,
+	get_rollup_stage_counts,
+	get_rollup_trend,
+	is_dashboard_rollup_ready,
+)
+from crm.api.forecast import get_monthly_forecast, is_forecast_engine_available
+from crm.api.leaderboard import get_top_salespeople
+from crm.api.replica import on_primary, replica_read
 from crm.fcrm.doctype.crm_dashboard.crm_dashboard import create_default_manager_dashboard
 from crm.utils import sales_user_only
 
@@ -15,49 +33,89 @@ def reset_to_default():
 
 @frappe.whitelist()
 @sales_user_only
-def get_dashboard(from_date="", to_date="", user=""):
+@replica_read
+def get_dashboard(from_date="", to_date="", user="", debug=False, grain=""):
 	"""
 	Get the dashboard data for the CRM dashboard.
-	"""
 
-	if not from_date or not to_date:
-		from_date = frappe.utils.get_first_day(from_date or frappe.utils.nowdate())
-		to_date = frappe.utils.get_last_day(to_date or frappe.utils.nowdate())
+	Time series charts are aggregated per `grain` (day, week, month or quarter), picked from the
+	length of the range if not given.
 
-	roles = frappe.get_roles(frappe.session.user)
-	is_sales_manager = "Sales Manager" in roles or "System Manager" in roles
-	is_sales_user = "Sales User" in roles and not is_sales_manager
+	With `debug` (System Manager only) the cache is skipped and every item gets a `debug` key
+	with its wall time, SQL time, query count and rows scanned.
+	"""
+	context = get_dashboard_context(from_date, to_date, user, grain, debug)
+	return evaluate_charts(get_manager_dashboard_layout(), context)
 
-	if is_sales_user:
-		user = frappe.session.user
 
-	dashboard = frappe.db.exists("CRM Dashboard", "Manager Dashboard")
+def get_manager_dashboard_layout():
+	"""
+	Get the layout items of the Manager Dashboard, creating the default one if there is none.
+	"""
+	if not frappe.db.exists("CRM Dashboard", "Manager Dashboard"):
+		with on_primary():
+			layout = json.loads(create_default_manager_dashboard())
+			frappe.db.commit()
+		return layout
 
-	layout = []
+	return json.loads(frappe.db.get_value("CRM Dashboard", "Manager Dashboard", "layout") or "[]")
 
-	if not dashboard:
-		layout = json.loads(create_default_manager_dashboard())
-		frappe.db.commit()
-	else:
-		layout = json.loads(frappe.db.get_value("CRM Dashboard", "Manager Dashboard", "layout") or "[]")
 
-	for l in layout:
-		method_name = f"get_{l['name']}"
-		if hasattr(frappe.get_attr("crm.api.dashboard"), method_name):
-			method = getattr(frappe.get_attr("crm.api.dashboard"), method_name)
-			l["data"] = method(from_date, to_date, user)
-		else:
-			l["data"] = None
+@frappe.whitelist()
+@sales_user_only
+@replica_read
+def get_charts(names, from_date="", to_date="", user="", debug=False, grain=""):
+	"""
+	Get the data of several dashboard charts at once, keyed by chart name. The date range,
+	user scope and base currency are resolved once for all of them.
+	"""
+	context = get_dashboard_context(from_date, to_date, user, grain, debug)
+	items = evaluate_charts([{"name": name} for name in frappe.parse_json(names)], context)
 
-	return layout
+	charts = {}
+	for item in items:
+		name = item.pop("name")
+		if name not in CHART_METHODS:
+			item = {"error": _("Invalid chart name")}
+		elif item["data"] is None and not item.get("timed_out"):
+			item = {"error": _("Chart failed")}
+		charts[name] = item
+	return charts
 
 
 @frappe.whitelist()
 @sales_user_only
-def get_chart(name, type, from_date="", to_date="", user=""):
+@replica_read
+def get_chart(name, type, from_date="", to_date="", user="", debug=False, grain=""):
 	"""
 	Get number chart data for the dashboard.
 	"""
+	context = get_dashboard_context(from_date, to_date, user, grain, debug)
+	from_date, to_date, user = context.from_date, context.to_date, context.user
+	grain = get_chart_grain(name, context.grain)
+
+	if not is_chart(name):
+		return {"error": _("Invalid chart name")}
+
+	if not context.debug and (cached := get_cached_chart(name, from_date, to_date, user, grain)):
+		data, age = cached
+		return {**data, "cache": {"hit": True, "age": age}}
+
+	if context.debug:
+		data, stats = profile_chart(name, lambda: get_chart_data(name, from_date, to_date, user, grain))
+		set_cached_chart(name, from_date, to_date, user, data, grain)
+		return {**data, "cache": {"hit": False, "age": 0}, "debug": stats}
+	data = get_chart_data(name, from_date, to_date, user, grain)
+	set_cached_chart(name, from_date, to_date, user, data, grain)
+	return {**data, "cache": {"hit": False, "age": 0}}
+
+
+def get_dashboard_context(from_date="", to_date="", user="", grain="", debug=False):
+	"""
+	Resolve what every chart of a request shares: the date range, the user scope (sales users
+	only see their own records), the time grain and whether to profile. The base currency
+	symbol is resolved once per request as well, see get_base_currency_symbol.
+	"""
 	if not from_date or not to_date:
 		from_date = frappe.utils.get_first_day(from_date or frappe.utils.nowdate())
 		to_date = frappe.utils.get_last_day(to_date or frappe.utils.nowdate())
@@ -69,63 +127,117 @@ def get_chart(name, type, from_date="", to_date="", user=""):
 	if is_sales_user:
 		user = frappe.session.user
 
-	method_name = f"get_{name}"
-	if hasattr(frappe.get_attr("crm.api.dashboard"), method_name):
-		method = getattr(frappe.get_attr("crm.api.dashboard"), method_name)
-		return method(from_date, to_date, user)
-	else:
-		return {"error": _("Invalid chart name")}
+	return frappe._dict(
+		from_date=from_date,
+		to_date=to_date,
+		user=user,
+		grain=resolve_grain(from_date, to_date, grain),
+		debug=bool(frappe.utils.cint(debug)) and "System Manager" in roles,
+	)
 
 
-def get_total_leads(from_date, to_date, user=""):
+def evaluate_charts(items, context):
 	"""
-	Get lead count for the dashboard.
+	Fill in `data` of every item ({"name": ...}) from the cache, the number card prefetch,
+	the worker pool or by evaluating the chart in this request.
+
+	With `refresh` in the context every chart is evaluated again and cached for `cache_ttl`
+	seconds (the configured TTL if not set).
 	"""
-	conds = ""
+	from_date, to_date, user, grain, debug = (
+		context.from_date,
+		context.to_date,
+		context.user,
+		context.grain,
+		context.debug,
+	)
+	ttl = context.get("cache_ttl")
+	use_cache = not debug and not context.get("refresh")
+
+	for l in items:
+		chart_grain = get_chart_grain(l["name"], grain)
+		if use_cache and (cached := get_cached_chart(l["name"], from_date, to_date, user, chart_grain)):
+			l["data"], age = cached
+			l["cache"] = {"hit": True, "age": age}
+
+	pending = [l["name"] for l in items if "data" not in l]
+	prefetch_stats = None
+	if debug:
+		_, prefetch_stats = profile_chart(
+			"number_cards", lambda: prefetch_number_cards(pending, from_date, to_date, user)
+		)
+	else:
+		prefetch_number_cards(pending, from_date, to_date, user)
+
+	results = {}
+	if get_dashboard_workers() > 1:
+		# number cards are already prefetched, run the remaining charts side by side
+		charts = [name for name in pending if is_chart(name) and CHARTS[name]["type"] != "number_card"]
+		results = run_charts_concurrently(charts, from_date, to_date, user, profile=debug, grain=grain)
+
+	for l in items:
+		if "data" in l:
+			continue
+
+		if l["name"] in results:
+			l["data"] = results[l["name"]]["data"]
+			if debug:
+				l["debug"] = results[l["name"]]["profile"]
+			if results[l["name"]]["timed_out"]:
+				l["timed_out"] = True
+			elif l["data"] is not None:
+				l["cache"] = {"hit": False, "age": 0}
+				set_cached_chart(
+					l["name"], from_date, to_date, user, l["data"], get_chart_grain(l["name"], grain), ttl
+				)
+		elif is_chart(l["name"]):
+			name = l["name"]
+			try:
+				if debug:
+					l["data"], l["debug"] = profile_chart(
+						name, lambda: get_chart_data(name, from_date, to_date, user, grain)
+					)
+					if CHARTS[name]["type"] == "number_card":
+						# the card's own queries ran in the shared prefetch
+						l["debug"]["prefetch"] = prefetch_stats
+				else:
+					l["data"] = get_chart_data(name, from_date, to_date, user, grain)
+			except Exception:
+				# fail this chart only, like the worker pool does
+				with on_primary():
+					frappe.log_error(title=f"Dashboard chart {name} failed")
+				l["data"] = None
+				continue
+
+			l["cache"] = {"hit": False, "age": 0}
+			set_cached_chart(name, from_date, to_date, user, l["data"], get_chart_grain(name, grain), ttl)
+		else:
+			l["data"] = None
 
-	diff = frappe.utils.date_diff(to_date, from_date)
-	if diff == 0:
-		diff = 1
-	params = {
-		"from_date": from_date,
-		"to_date": to_date,
-		"prev_from_date": frappe.utils.add_days(from_date, -diff),
-	}
+	return items
 
-	if user:
-		conds += " AND lead_owner = %(user)s"
-		params["user"] = user
 
-	result = frappe.db.sql(
-		f"""
-		SELECT
-            COUNT(CASE
-                WHEN creation >= %(from_date)s AND creation < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-                {conds}
-                THEN name
-                ELSE NULL
-            END) as current_month_leads,
-
-            COUNT(CASE
-                WHEN creation >= %(prev_from_date)s AND creation < %(from_date)s
-                {conds}
-                THEN name
-                ELSE NULL
-            END) as prev_month_leads
-		FROM `tabCRM Lead`
-	""",
-		params,
-		as_dict=1,
-	)
+def get_chart_data(name, from_date, to_date, user="", grain=""):
+	"""
+	Evaluate chart `name`, passing `grain` on to the charts that take one.
+	"""
+	method = CHART_METHODS[name]
+	if takes_filter(name, "grain"):
+		return method(from_date, to_date, user, grain=grain)
+	return method(from_date, to_date, user)
 
-	current_month_leads = result[0].current_month_leads or 0
-	prev_month_leads = result[0].prev_month_leads or 0
+
+def get_total_leads(from_date, to_date, user=""):
+	"""
+	Get lead count for the dashboard.
+	"""
+	current_month_leads, prev_month_leads = get_number_card_value("total_leads", from_date, to_date, user)
 
 	delta_in_percentage = (
 		(current_month_leads - prev_month_leads) / prev_month_leads * 100 if prev_month_leads else 0
 	)
 
-	return {
+	card = {
 		"title": _("Total leads"),
 		"tooltip": _("Total number of leads"),
 		"value": current_month_leads,
@@ -133,54 +245,25 @@ def get_total_leads(from_date, to_date, user=""):
 		"deltaSuffix": "%",
 	}
 
+	estimated = (frappe.flags.estimated_number_cards or {}).get(
+		("total_leads", str(from_date), str(to_date), user or "")
+	)
+	if estimated:
+		current, prev = estimated
+		if current.lower_bound_only:
+			card.update({"lower_bound_only": True, "lower_bound": current.lower_bound})
+		# a delta from an estimate on either side is an estimate too
+		if current.lower_bound_only or prev.lower_bound_only:
+			card["delta_approximate"] = True
+
+	return card
+
 
 def get_ongoing_deals(from_date, to_date, user=""):
 	"""
 	Get ongoing deal count for the dashboard, and also calculate average deal value for ongoing deals.
 	"""
-	conds = ""
-
-	diff = frappe.utils.date_diff(to_date, from_date)
-	if diff == 0:
-		diff = 1
-
-	params = {
-		"from_date": from_date,
-		"to_date": to_date,
-		"prev_from_date": frappe.utils.add_days(from_date, -diff),
-	}
-
-	if user:
-		conds += " AND d.deal_owner = %(user)s"
-		params["user"] = user
-
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			COUNT(CASE
-				WHEN d.creation >= %(from_date)s AND d.creation < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-					AND s.type NOT IN ('Won', 'Lost')
-					{conds}
-				THEN d.name
-				ELSE NULL
-			END) as current_month_deals,
-
-			COUNT(CASE
-				WHEN d.creation >= %(prev_from_date)s AND d.creation < %(from_date)s
-					AND s.type NOT IN ('Won', 'Lost')
-					{conds}
-				THEN d.name
-				ELSE NULL
-			END) as prev_month_deals
-		FROM `tabCRM Deal` d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-	""",
-		params,
-		as_dict=1,
-	)
-
-	current_month_deals = result[0].current_month_deals or 0
-	prev_month_deals = result[0].prev_month_deals or 0
+	current_month_deals, prev_month_deals = get_number_card_value("ongoing_deals", from_date, to_date, user)
 
 	delta_in_percentage = (
 		(current_month_deals - prev_month_deals) / prev_month_deals * 100 if prev_month_deals else 0
@@ -199,50 +282,10 @@ def get_average_ongoing_deal_value(from_date, to_date, user=""):
 	"""
 	Get ongoing deal count for the dashboard, and also calculate average deal value for ongoing deals.
 	"""
-	conds = ""
-
-	diff = frappe.utils.date_diff(to_date, from_date)
-	if diff == 0:
-		diff = 1
-
-	params = {
-		"from_date": from_date,
-		"to_date": to_date,
-		"prev_from_date": frappe.utils.add_days(from_date, -diff),
-	}
-
-	if user:
-		conds += " AND d.deal_owner = %(user)s"
-		params["user"] = user
-
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			AVG(CASE
-				WHEN d.creation >= %(from_date)s AND d.creation < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-					AND s.type NOT IN ('Won', 'Lost')
-					{conds}
-				THEN d.deal_value * IFNULL(d.exchange_rate, 1)
-				ELSE NULL
-			END) as current_month_avg_value,
-
-			AVG(CASE
-				WHEN d.creation >= %(prev_from_date)s AND d.creation < %(from_date)s
-					AND s.type NOT IN ('Won', 'Lost')
-					{conds}
-				THEN d.deal_value * IFNULL(d.exchange_rate, 1)
-				ELSE NULL
-			END) as prev_month_avg_value
-		FROM `tabCRM Deal` d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-    """,
-		params,
-		as_dict=1,
+	current_month_avg_value, prev_month_avg_value = get_number_card_value(
+		"average_ongoing_deal_value", from_date, to_date, user
 	)
 
-	current_month_avg_value = result[0].current_month_avg_value or 0
-	prev_month_avg_value = result[0].prev_month_avg_value or 0
-
 	avg_value_delta = current_month_avg_value - prev_month_avg_value if prev_month_avg_value else 0
 
 	return {
@@ -258,49 +301,7 @@ def get_won_deals(from_date, to_date, user=""):
 	"""
 	Get won deal count for the dashboard, and also calculate average deal value for won deals.
 	"""
-
-	diff = frappe.utils.date_diff(to_date, from_date)
-	if diff == 0:
-		diff = 1
-
-	conds = ""
-	params = {
-		"from_date": from_date,
-		"to_date": to_date,
-		"prev_from_date": frappe.utils.add_days(from_date, -diff),
-	}
-
-	if user:
-		conds += " AND d.deal_owner = %(user)s"
-		params["user"] = user
-
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			COUNT(CASE
-				WHEN d.closed_date >= %(from_date)s AND d.closed_date < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-					AND s.type = 'Won'
-					{conds}
-				THEN d.name
-				ELSE NULL
-			END) as current_month_deals,
-
-			COUNT(CASE
-				WHEN d.closed_date >= %(prev_from_date)s AND d.closed_date < %(from_date)s
-					AND s.type = 'Won'
-					{conds}
-				THEN d.name
-				ELSE NULL
-			END) as prev_month_deals
-		FROM `tabCRM Deal` d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		""",
-		params,
-		as_dict=1,
-	)
-
-	current_month_deals = result[0].current_month_deals or 0
-	prev_month_deals = result[0].prev_month_deals or 0
+	current_month_deals, prev_month_deals = get_number_card_value("won_deals", from_date, to_date, user)
 
 	delta_in_percentage = (
 		(current_month_deals - prev_month_deals) / prev_month_deals * 100 if prev_month_deals else 0
@@ -319,50 +320,10 @@ def get_average_won_deal_value(from_date, to_date, user=""):
 	"""
 	Get won deal count for the dashboard, and also calculate average deal value for won deals.
 	"""
-
-	diff = frappe.utils.date_diff(to_date, from_date)
-	if diff == 0:
-		diff = 1
-
-	conds = ""
-	params = {
-		"from_date": from_date,
-		"to_date": to_date,
-		"prev_from_date": frappe.utils.add_days(from_date, -diff),
-	}
-
-	if user:
-		conds += " AND d.deal_owner = %(user)s"
-		params["user"] = user
-
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			AVG(CASE
-				WHEN d.closed_date >= %(from_date)s AND d.closed_date < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-					AND s.type = 'Won'
-					{conds}
-				THEN d.deal_value * IFNULL(d.exchange_rate, 1)
-				ELSE NULL
-			END) as current_month_avg_value,
-
-			AVG(CASE
-				WHEN d.closed_date >= %(prev_from_date)s AND d.closed_date < %(from_date)s
-					AND s.type = 'Won'
-					{conds}
-				THEN d.deal_value * IFNULL(d.exchange_rate, 1)
-				ELSE NULL
-			END) as prev_month_avg_value
-		FROM `tabCRM Deal` d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		""",
-		params,
-		as_dict=1,
+	current_month_avg_value, prev_month_avg_value = get_number_card_value(
+		"average_won_deal_value", from_date, to_date, user
 	)
 
-	current_month_avg_value = result[0].current_month_avg_value or 0
-	prev_month_avg_value = result[0].prev_month_avg_value or 0
-
 	avg_value_delta = current_month_avg_value - prev_month_avg_value if prev_month_avg_value else 0
 
 	return {
@@ -378,50 +339,10 @@ def get_average_deal_value(from_date, to_date, user=""):
 	"""
 	Get average deal value for the dashboard.
 	"""
-
-	diff = frappe.utils.date_diff(to_date, from_date)
-	if diff == 0:
-		diff = 1
-
-	conds = ""
-	params = {
-		"from_date": from_date,
-		"to_date": to_date,
-		"prev_from_date": frappe.utils.add_days(from_date, -diff),
-	}
-
-	if user:
-		conds += " AND d.deal_owner = %(user)s"
-		params["user"] = user
-
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			AVG(CASE
-				WHEN d.creation >= %(from_date)s AND d.creation < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-					AND s.type != 'Lost'
-					{conds}
-				THEN d.deal_value * IFNULL(d.exchange_rate, 1)
-				ELSE NULL
-			END) as current_month_avg,
-
-			AVG(CASE
-				WHEN d.creation >= %(prev_from_date)s AND d.creation < %(from_date)s
-					AND s.type != 'Lost'
-					{conds}
-				THEN d.deal_value * IFNULL(d.exchange_rate, 1)
-				ELSE NULL
-			END) as prev_month_avg
-		FROM `tabCRM Deal` AS d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		""",
-		params,
-		as_dict=1,
+	current_month_avg, prev_month_avg = get_number_card_value(
+		"average_deal_value", from_date, to_date, user
 	)
 
-	current_month_avg = result[0].current_month_avg or 0
-	prev_month_avg = result[0].prev_month_avg or 0
-
 	delta = current_month_avg - prev_month_avg if prev_month_avg else 0
 
 	return {
@@ -438,42 +359,9 @@ def get_average_time_to_close_a_lead(from_date, to_date, user=""):
 	"""
 	Get average time to close deals for the dashboard.
 	"""
-
-	diff = frappe.utils.date_diff(to_date, from_date)
-	if diff == 0:
-		diff = 1
-
-	conds = ""
-	params = {
-		"from_date": from_date,
-		"to_date": to_date,
-		"prev_from_date": frappe.utils.add_days(from_date, -diff),
-		"prev_to_date": from_date,
-	}
-
-	if user:
-		conds += " AND d.deal_owner = %(user)s"
-		params["user"] = user
-
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			AVG(CASE WHEN d.closed_date >= %(from_date)s AND d.closed_date < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-				THEN TIMESTAMPDIFF(DAY, COALESCE(l.creation, d.creation), d.closed_date) END) as current_avg_lead,
-			AVG(CASE WHEN d.closed_date >= %(prev_from_date)s AND d.closed_date < %(prev_to_date)s
-				THEN TIMESTAMPDIFF(DAY, COALESCE(l.creation, d.creation), d.closed_date) END) as prev_avg_lead
-		FROM `tabCRM Deal` AS d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		LEFT JOIN `tabCRM Lead` l ON d.lead = l.name
-		WHERE d.closed_date IS NOT NULL AND s.type = 'Won'
-			{conds}
-		""",
-		params,
-		as_dict=1,
+	current_avg_lead, prev_avg_lead = get_number_card_value(
+		"average_time_to_close_a_lead", from_date, to_date, user
 	)
-
-	current_avg_lead = result[0].current_avg_lead or 0
-	prev_avg_lead = result[0].prev_avg_lead or 0
 	delta_lead = current_avg_lead - prev_avg_lead if prev_avg_lead else 0
 
 	return {
@@ -491,42 +379,9 @@ def get_average_time_to_close_a_deal(from_date, to_date, user=""):
 	"""
 	Get average time to close deals for the dashboard.
 	"""
-
-	diff = frappe.utils.date_diff(to_date, from_date)
-	if diff == 0:
-		diff = 1
-
-	conds = ""
-	params = {
-		"from_date": from_date,
-		"to_date": to_date,
-		"prev_from_date": frappe.utils.add_days(from_date, -diff),
-		"prev_to_date": from_date,
-	}
-
-	if user:
-		conds += " AND d.deal_owner = %(user)s"
-		params["user"] = user
-
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			AVG(CASE WHEN d.closed_date >= %(from_date)s AND d.closed_date < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-				THEN TIMESTAMPDIFF(DAY, d.creation, d.closed_date) END) as current_avg_deal,
-			AVG(CASE WHEN d.closed_date >= %(prev_from_date)s AND d.closed_date < %(prev_to_date)s
-				THEN TIMESTAMPDIFF(DAY, d.creation, d.closed_date) END) as prev_avg_deal
-		FROM `tabCRM Deal` AS d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		LEFT JOIN `tabCRM Lead` l ON d.lead = l.name
-		WHERE d.closed_date IS NOT NULL AND s.type = 'Won'
-			{conds}
-		""",
-		params,
-		as_dict=1,
+	current_avg_deal, prev_avg_deal = get_number_card_value(
+		"average_time_to_close_a_deal", from_date, to_date, user
 	)
-
-	current_avg_deal = result[0].current_avg_deal or 0
-	prev_avg_deal = result[0].prev_avg_deal or 0
 	delta_deal = current_avg_deal - prev_avg_deal if prev_avg_deal else 0
 
 	return {
@@ -540,9 +395,9 @@ def get_average_time_to_close_a_deal(from_date, to_date, user=""):
 	}
 
 
-def get_sales_trend(from_date="", to_date="", user=""):
+def get_sales_trend(from_date="", to_date="", user="", grain=""):
 	"""
-	Get sales trend data for the dashboard.
+	Get sales trend data for the dashboard, one row per day, week, month or quarter (`grain`).
 	[
 		{ date: new Date('2024-05-01'), leads: 45, deals: 23, won_deals: 12 },
 		{ date: new Date('2024-05-02'), leads: 50, deals: 30, won_deals: 15 },
@@ -557,6 +412,7 @@ def get_sales_trend(from_date="", to_date="", user=""):
 		from_date = frappe.utils.get_first_day(from_date or frappe.utils.nowdate())
 		to_date = frappe.utils.get_last_day(to_date or frappe.utils.nowdate())
 
+	grain = resolve_grain(from_date, to_date, grain)
 	params = {"from": from_date, "to": to_date}
 
 	if user:
@@ -564,43 +420,52 @@ def get_sales_trend(from_date="", to_date="", user=""):
 		deal_conds += " AND deal_owner = %(user)s"
 		params["user"] = user
 
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			DATE_FORMAT(date, '%%Y-%%m-%%d') AS date,
-			SUM(leads) AS leads,
-			SUM(deals) AS deals,
-			SUM(won_deals) AS won_deals
-		FROM (
-			SELECT
-				DATE(creation) AS date,
-				COUNT(*) AS leads,
-				0 AS deals,
-				0 AS won_deals
-			FROM `tabCRM Lead`
-			WHERE DATE(creation) BETWEEN %(from)s AND %(to)s
-			{lead_conds}
-			GROUP BY DATE(creation)
-
-			UNION ALL
-
-			SELECT
-				DATE(d.creation) AS date,
-				0 AS leads,
-				COUNT(*) AS deals,
-				SUM(CASE WHEN s.type = 'Won' THEN 1 ELSE 0 END) AS won_deals
-			FROM `tabCRM Deal` d
-			JOIN `tabCRM Deal Status` s ON d.status = s.name
-			WHERE DATE(d.creation) BETWEEN %(from)s AND %(to)s
-			{deal_conds}
-			GROUP BY DATE(d.creation)
-		) AS daily
-		GROUP BY date
-		ORDER BY date
-		""",
-		params,
-		as_dict=True,
-	)
+	if is_dashboard_rollup_ready():
+		result = get_rollup_trend(from_date, to_date, user)
+	else:
+		# days before the current month come from the analytics store when it is in use
+		historical_to, current_from = split_historical_range(from_date, to_date)
+		result = get_store_trend(from_date, historical_to, user) if historical_to else []
+
+		if current_from:
+			params["from"] = current_from
+			result += frappe.db.sql(
+				f"""
+				SELECT
+					DATE_FORMAT(date, '%%Y-%%m-%%d') AS date,
+					SUM(leads) AS leads,
+					SUM(deals) AS deals,
+					SUM(won_deals) AS won_deals
+				FROM (
+					SELECT
+						DATE(creation) AS date,
+						COUNT(*) AS leads,
+						0 AS deals,
+						0 AS won_deals
+					FROM `tabCRM Lead`
+					WHERE creation >= %(from)s AND creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+					{lead_conds}
+					GROUP BY DATE(creation)
+
+					UNION ALL
+
+					SELECT
+						DATE(d.creation) AS date,
+						0 AS leads,
+						COUNT(*) AS deals,
+						SUM(CASE WHEN {get_status_condition("d.status", types=["Won"])} THEN 1 ELSE 0 END) AS won_deals
+					FROM `tabCRM Deal` d
+					WHERE d.creation >= %(from)s AND d.creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+						AND {get_status_condition("d.status")}
+					{deal_conds}
+					GROUP BY DATE(d.creation)
+				) AS daily
+				GROUP BY date
+				ORDER BY date
+				""",
+				params,
+				as_dict=True,
+			)
 
 	sales_trend = [
 		{
@@ -611,16 +476,24 @@ def get_sales_trend(from_date="", to_date="", user=""):
 		}
 		for row in result
 	]
+	sales_trend = aggregate_by_grain(sales_trend, grain, ["leads", "deals", "won_deals"])
+
+	subtitles = {
+		"day": _("Daily performance of leads, deals, and wins"),
+		"week": _("Weekly performance of leads, deals, and wins"),
+		"month": _("Monthly performance of leads, deals, and wins"),
+		"quarter": _("Quarterly performance of leads, deals, and wins"),
+	}
 
 	return {
 		"data": sales_trend,
 		"title": _("Sales trend"),
-		"subtitle": _("Daily performance of leads, deals, and wins"),
+		"subtitle": subtitles[grain],
 		"xAxis": {
 			"title": _("Date"),
 			"key": "date",
 			"type": "time",
-			"timeGrain": "day",
+			"timeGrain": grain,
 		},
 		"yAxis": {
 			"title": _("Count"),
@@ -651,32 +524,40 @@ def get_forecasted_revenue(from_date="", to_date="", user=""):
 		deal_conds += " AND d.deal_owner = %(user)s"
 		params["user"] = user
 
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			DATE_FORMAT(d.expected_closure_date, '%%Y-%%m')                        AS month,
-			SUM(
-				CASE
-					WHEN s.type = 'Lost' THEN d.expected_deal_value * IFNULL(d.exchange_rate, 1)
-					ELSE d.expected_deal_value * IFNULL(d.probability, 0) / 100 * IFNULL(d.exchange_rate, 1)  -- forecasted
-				END
-			)                                                       AS forecasted,
-			SUM(
-				CASE
-					WHEN s.type = 'Won' THEN d.deal_value * IFNULL(d.exchange_rate, 1)            -- actual
-					ELSE 0
-				END
-			)                                                       AS actual
-		FROM `tabCRM Deal` AS d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		WHERE d.expected_closure_date >= DATE_SUB(CURDATE(), INTERVAL 12 MONTH)
-		{deal_conds}
-		GROUP BY DATE_FORMAT(d.expected_closure_date, '%%Y-%%m')
-		ORDER BY month
-		""",
-		params,
-		as_dict=True,
-	)
+	if is_forecast_engine_available():
+		result = get_monthly_forecast(user)
+	else:
+		# months before the current one come from the analytics store when it is in use
+		from_date = frappe.utils.add_months(frappe.utils.nowdate(), -12)
+		historical_to, params["from"] = split_historical_range(from_date)
+		result = get_store_forecast(from_date, historical_to, user) if historical_to else []
+
+		result += frappe.db.sql(
+			f"""
+			SELECT
+				DATE_FORMAT(d.expected_closure_date, '%%Y-%%m')                        AS month,
+				SUM(
+					CASE
+						WHEN {get_status_condition("d.status", types=["Lost"])} THEN d.expected_deal_value * IFNULL(d.exchange_rate, 1)
+						ELSE d.expected_deal_value * IFNULL(d.probability, 0) / 100 * IFNULL(d.exchange_rate, 1)  -- forecasted
+					END
+				)                                                       AS forecasted,
+				SUM(
+					CASE
+						WHEN {get_status_condition("d.status", types=["Won"])} THEN d.deal_value * IFNULL(d.exchange_rate, 1)  -- actual
+						ELSE 0
+					END
+				)                                                       AS actual
+			FROM `tabCRM Deal` AS d
+			WHERE d.expected_closure_date >= %(from)s
+				AND {get_status_condition("d.status")}
+			{deal_conds}
+			GROUP BY DATE_FORMAT(d.expected_closure_date, '%%Y-%%m')
+			ORDER BY month
+			""",
+			params,
+			as_dict=True,
+		)
 
 	for row in result:
 		row["month"] = frappe.utils.get_datetime(row["month"]).strftime("%Y-%m-01")
@@ -733,22 +614,26 @@ def get_funnel_conversion(from_date="", to_date="", user=""):
 
 	result = []
 
-	# Get total leads
-	total_leads = frappe.db.sql(
-		f"""
-			SELECT COUNT(*) AS count
-			FROM `tabCRM Lead`
-			WHERE DATE(creation) BETWEEN %(from)s AND %(to)s
-			{lead_conds}
-		""",
-		lead_filters,
-		as_dict=True,
-	)
-	total_leads_count = total_leads[0].count if total_leads else 0
-
-	result.append({"stage": "Leads", "count": total_leads_count})
-
-	result += get_deal_status_change_counts(from_date, to_date, deal_conds, deal_filters)
+	if is_dashboard_rollup_ready():
+		result.append({"stage": "Leads", "count": get_rollup_count("CRM Lead", from_date, to_date, user)})
+		result += get_rollup_stage_counts(from_date, to_date, user)
+	else:
+		# Get total leads
+		total_leads = frappe.db.sql(
+			f"""
+				SELECT COUNT(*) AS count
+				FROM `tabCRM Lead`
+				WHERE creation >= %(from)s AND creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+				{lead_conds}
+			""",
+			lead_filters,
+			as_dict=True,
+		)
+		total_leads_count = total_leads[0].count if total_leads else 0
+
+		result.append({"stage": "Leads", "count": total_leads_count})
+
+		result += get_deal_status_change_counts(from_date, to_date, deal_conds, deal_filters)
 
 	return {
 		"data": result or [],
@@ -800,11 +685,10 @@ def get_deals_by_stage_axis(from_date="", to_date="", user=""):
 		f"""
 		SELECT
 			d.status AS stage,
-			COUNT(*) AS count,
-			s.type AS status_type
+			COUNT(*) AS count
 		FROM `tabCRM Deal` AS d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		WHERE DATE(d.creation) BETWEEN %(from)s AND %(to)s AND s.type NOT IN ('Lost')
+		WHERE d.creation >= %(from)s AND d.creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+			AND {get_status_condition("d.status", exclude_types=["Lost"])}
 		{deal_conds}
 		GROUP BY d.status
 		ORDER BY count DESC
@@ -812,6 +696,7 @@ def get_deals_by_stage_axis(from_date="", to_date="", user=""):
 		params,
 		as_dict=True,
 	)
+	add_status_types(result)
 
 	return {
 		"data": result or [],
@@ -853,11 +738,10 @@ def get_deals_by_stage_donut(from_date="", to_date="", user=""):
 		f"""
 		SELECT
 			d.status AS stage,
-			COUNT(*) AS count,
-			s.type AS status_type
+			COUNT(*) AS count
 		FROM `tabCRM Deal` AS d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		WHERE DATE(d.creation) BETWEEN %(from)s AND %(to)s
+		WHERE d.creation >= %(from)s AND d.creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+			AND {get_status_condition("d.status")}
 		{deal_conds}
 		GROUP BY d.status
 		ORDER BY count DESC
@@ -865,6 +749,7 @@ def get_deals_by_stage_donut(from_date="", to_date="", user=""):
 		params,
 		as_dict=True,
 	)
+	add_status_types(result)
 
 	return {
 		"data": result or [],
@@ -903,8 +788,8 @@ def get_lost_deal_reasons(from_date="", to_date="", user=""):
 			d.lost_reason AS reason,
 			COUNT(*) AS count
 		FROM `tabCRM Deal` AS d
-		JOIN `tabCRM Deal Status` s ON d.status = s.name
-		WHERE DATE(d.creation) BETWEEN %(from)s AND %(to)s AND s.type = 'Lost'
+		WHERE d.creation >= %(from)s AND d.creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+			AND {get_status_condition("d.status", types=["Lost"])}
 		{deal_conds}
 		GROUP BY d.lost_reason
 		HAVING reason IS NOT NULL AND reason != ''
@@ -953,20 +838,26 @@ def get_leads_by_source(from_date="", to_date="", user=""):
 		lead_conds += " AND lead_owner = %(user)s"
 		params["user"] = user
 
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			IFNULL(source, 'Empty') AS source,
-			COUNT(*) AS count
-		FROM `tabCRM Lead`
-		WHERE DATE(creation) BETWEEN %(from)s AND %(to)s
-		{lead_conds}
-		GROUP BY source
-		ORDER BY count DESC
-		""",
-		params,
-		as_dict=True,
-	)
+	if is_dashboard_rollup_ready():
+		result = [
+			{"source": row.source or "Empty", "count": row.count}
+			for row in get_rollup_breakdown("CRM Lead", "source", from_date, to_date, user)
+		]
+	else:
+		result = frappe.db.sql(
+			f"""
+			SELECT
+				IFNULL(source, 'Empty') AS source,
+				COUNT(*) AS count
+			FROM `tabCRM Lead`
+			WHERE creation >= %(from)s AND creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+			{lead_conds}
+			GROUP BY source
+			ORDER BY count DESC
+			""",
+			params,
+			as_dict=True,
+		)
 
 	return {
 		"data": result or [],
@@ -998,20 +889,26 @@ def get_deals_by_source(from_date="", to_date="", user=""):
 		deal_conds += " AND deal_owner = %(user)s"
 		params["user"] = user
 
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			IFNULL(source, 'Empty') AS source,
-			COUNT(*) AS count
-		FROM `tabCRM Deal`
-		WHERE DATE(creation) BETWEEN %(from)s AND %(to)s
-		{deal_conds}
-		GROUP BY source
-		ORDER BY count DESC
-		""",
-		params,
-		as_dict=True,
-	)
+	if is_dashboard_rollup_ready():
+		result = [
+			{"source": row.source or "Empty", "count": row.count}
+			for row in get_rollup_breakdown("CRM Deal", "source", from_date, to_date, user)
+		]
+	else:
+		result = frappe.db.sql(
+			f"""
+			SELECT
+				IFNULL(source, 'Empty') AS source,
+				COUNT(*) AS count
+			FROM `tabCRM Deal`
+			WHERE creation >= %(from)s AND creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+			{deal_conds}
+			GROUP BY source
+			ORDER BY count DESC
+			""",
+			params,
+			as_dict=True,
+		)
 
 	return {
 		"data": result or [],
@@ -1043,21 +940,27 @@ def get_deals_by_territory(from_date="", to_date="", user=""):
 		deal_conds += " AND d.deal_owner = %(user)s"
 		params["user"] = user
 
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			IFNULL(d.territory, 'Empty') AS territory,
-			COUNT(*) AS deals,
-			SUM(COALESCE(d.deal_value, 0) * IFNULL(d.exchange_rate, 1)) AS value
-		FROM `tabCRM Deal` AS d
-		WHERE DATE(d.creation) BETWEEN %(from)s AND %(to)s
-		{deal_conds}
-		GROUP BY d.territory
-		ORDER BY deals DESC, value DESC
-		""",
-		params,
-		as_dict=True,
-	)
+	if is_dashboard_rollup_ready():
+		result = [
+			{"territory": row.territory or "Empty", "deals": row.count, "value": row.value}
+			for row in get_rollup_breakdown("CRM Deal", "territory", from_date, to_date, user)
+		]
+	else:
+		result = frappe.db.sql(
+			f"""
+			SELECT
+				IFNULL(d.territory, 'Empty') AS territory,
+				COUNT(*) AS deals,
+				SUM(COALESCE(d.deal_value, 0) * IFNULL(d.exchange_rate, 1)) AS value
+			FROM `tabCRM Deal` AS d
+			WHERE d.creation >= %(from)s AND d.creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+			{deal_conds}
+			GROUP BY d.territory
+			ORDER BY deals DESC, value DESC
+			""",
+			params,
+			as_dict=True,
+		)
 
 	return {
 		"data": result or [],
@@ -1090,34 +993,14 @@ def get_deals_by_salesperson(from_date="", to_date="", user=""):
 		...
 	]
 	"""
-	deal_conds = ""
-
 	if not from_date or not to_date:
 		from_date = frappe.utils.get_first_day(from_date or frappe.utils.nowdate())
 		to_date = frappe.utils.get_last_day(to_date or frappe.utils.nowdate())
 
-	params = {"from": from_date, "to": to_date}
-
-	if user:
-		deal_conds += " AND d.deal_owner = %(user)s"
-		params["user"] = user
-
-	result = frappe.db.sql(
-		f"""
-		SELECT
-			IFNULL(u.full_name, d.deal_owner) AS salesperson,
-			COUNT(*)                           AS deals,
-			SUM(COALESCE(d.deal_value, 0) * IFNULL(d.exchange_rate, 1)) AS value
-		FROM `tabCRM Deal` AS d
-		LEFT JOIN `tabUser` AS u ON u.name = d.deal_owner
-		WHERE DATE(d.creation) BETWEEN %(from)s AND %(to)s
-		{deal_conds}
-		GROUP BY d.deal_owner
-		ORDER BY deals DESC, value DESC
-		""",
-		params,
-		as_dict=True,
-	)
+	result = [
+		{"salesperson": row["salesperson"], "deals": row["deals"], "value": row["value"]}
+		for row in get_top_salespeople(from_date, to_date, user)
+	]
 
 	return {
 		"data": result or [],
@@ -1141,6 +1024,7 @@ def get_deals_by_salesperson(from_date="", to_date="", user=""):
 	}
 
 
+@request_cache
 def get_base_currency_symbol():
 	"""
 	Get the base currency symbol from the system settings.
@@ -1173,22 +1057,350 @@ def get_deal_status_change_counts(from_date, to_date, deal_conds="", filters=Non
 			`tabCRM Status Change Log` scl
 		JOIN
 			`tabCRM Deal` d ON scl.parent = d.name
-		JOIN
-			`tabCRM Deal Status` s ON d.status = s.name
-		JOIN
-			`tabCRM Deal Status` st ON scl.to = st.name
 		WHERE
-			scl.to IS NOT NULL
-			AND scl.to != ''
-			AND s.type != 'Lost'
-			AND DATE(d.creation) BETWEEN %(from)s AND %(to)s
+			{get_status_condition("scl.to")}
+			AND {get_status_condition("d.status", exclude_types=["Lost"])}
+			AND d.creation >= %(from)s AND d.creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
 			{deal_conds}
 		GROUP BY
-			scl.to, st.position
-		ORDER BY
-			st.position ASC
+			scl.to
 		""",
 		params,
 		as_dict=True,
 	)
-	return result or []
+
+	statuses = get_deal_status_map()
+	return sorted(result or [], key=lambda row: statuses[row.stage].position)
+
+
+def add_status_types(rows):
+	"""
+	Set `status_type` of rows grouped by deal status (`stage`).
+	"""
+	statuses = get_deal_status_map()
+	for row in rows:
+		row["status_type"] = statuses[row.stage].type if row.stage in statuses else None
+
+
+# Number cards are plain aggregates over a date window, so every card that reads the same source
+# table is folded into a single query (see `prefetch_number_cards`).
+NUMBER_CARD_SOURCES = {
+	"CRM Lead": {
+		"table": "`tabCRM Lead` l",
+		"owner_field": "l.lead_owner",
+	},
+	"CRM Deal": {
+		"table": "`tabCRM Deal` d",
+		"owner_field": "d.deal_owner",
+		"status_field": "d.status",
+		"lead_join": "LEFT JOIN `tabCRM Lead` l ON d.lead = l.name",
+	},
+}
+
+DEAL_VALUE = "d.deal_value * IFNULL(d.exchange_rate, 1)"
+
+NUMBER_CARDS = {
+	"total_leads": {
+		"source": "CRM Lead",
+		"aggregate": "COUNT",
+		"date_field": "l.creation",
+		"value": "l.name",
+	},
+	"ongoing_deals": {
+		"source": "CRM Deal",
+		"aggregate": "COUNT",
+		"date_field": "d.creation",
+		"exclude_status_types": ["Won", "Lost"],
+		"value": "d.name",
+	},
+	"average_ongoing_deal_value": {
+		"source": "CRM Deal",
+		"aggregate": "AVG",
+		"date_field": "d.creation",
+		"exclude_status_types": ["Won", "Lost"],
+		"value": DEAL_VALUE,
+	},
+	"won_deals": {
+		"source": "CRM Deal",
+		"aggregate": "COUNT",
+		"date_field": "d.closed_date",
+		"status_types": ["Won"],
+		"value": "d.name",
+	},
+	"average_won_deal_value": {
+		"source": "CRM Deal",
+		"aggregate": "AVG",
+		"date_field": "d.closed_date",
+		"status_types": ["Won"],
+		"value": DEAL_VALUE,
+	},
+	"average_deal_value": {
+		"source": "CRM Deal",
+		"aggregate": "AVG",
+		"date_field": "d.creation",
+		"exclude_status_types": ["Lost"],
+		"value": DEAL_VALUE,
+	},
+	"average_time_to_close_a_lead": {
+		"source": "CRM Deal",
+		"aggregate": "AVG",
+		"date_field": "d.closed_date",
+		"condition": "d.closed_date IS NOT NULL",
+		"status_types": ["Won"],
+		"value": "TIMESTAMPDIFF(DAY, COALESCE(l.creation, d.creation), d.closed_date)",
+		"needs_lead": True,
+	},
+	"average_time_to_close_a_deal": {
+		"source": "CRM Deal",
+		"aggregate": "AVG",
+		"date_field": "d.closed_date",
+		"condition": "d.closed_date IS NOT NULL",
+		"status_types": ["Won"],
+		"value": "TIMESTAMPDIFF(DAY, d.creation, d.closed_date)",
+	},
+}
+
+
+def prefetch_number_cards(names, from_date, to_date, user=""):
+	"""
+	Compute all number cards in `names` upfront so that the `get_<name>` calls
+	made later in the same request do not hit the database again.
+	"""
+	names = [name for name in names if name in NUMBER_CARDS]
+	if not names:
+		return
+
+	values = compute_number_cards(names, from_date, to_date, user)
+
+	if frappe.flags.number_card_values is None:
+		frappe.flags.number_card_values = {}
+
+	for name, value in values.items():
+		frappe.flags.number_card_values[(name, str(from_date), str(to_date), user or "")] = value
+
+
+def get_number_card_value(name, from_date, to_date, user=""):
+	"""
+	Get (current, previous) values of a number card, using the prefetched values if available.
+	"""
+	key = (name, str(from_date), str(to_date), user or "")
+	prefetched = frappe.flags.number_card_values or {}
+	if key in prefetched:
+		return prefetched.pop(key)
+
+	return compute_number_cards([name], from_date, to_date, user)[name]
+
+
+def compute_number_cards(names, from_date, to_date, user="", aggregate=None):
+	"""
+	Compute (current, previous) values of the given number cards with one query per source table.
+	`aggregate` (COUNT, SUM) replaces the aggregate of every card.
+	"""
+	diff = frappe.utils.date_diff(to_date, from_date)
+	if diff == 0:
+		diff = 1
+
+	params = {
+		"from_date": from_date,
+		"to_date": to_date,
+		"prev_from_date": frappe.utils.add_days(from_date, -diff),
+	}
+
+	if user:
+		params["user"] = user
+
+	values = {}
+	if not aggregate and "total_leads" in names and (lead_counts := get_total_lead_counts(params, user)):
+		values["total_leads"] = lead_counts
+		names = [name for name in names if name != "total_leads"]
+
+	cards_by_source = {}
+	for name in names:
+		cards_by_source.setdefault(NUMBER_CARDS[name]["source"], []).append(name)
+
+	for source, cards in cards_by_source.items():
+		values.update(get_number_card_values_from_source(source, cards, params, aggregate))
+
+	return values
+
+
+def get_total_lead_counts(params, user=""):
+	"""
+	Get (current, previous) lead counts without scanning CRM Lead: exactly from the rollup when it
+	is ready, else estimated when approximate counts are on for the lead table. Estimated counts
+	are recorded in `frappe.flags.estimated_number_cards` as (current, previous) counts with
+	`lower_bound_only` and `lower_bound`. Returns None when the leads have to be counted.
+	"""
+	windows = [
+		(params["from_date"], params["to_date"]),
+		(params["prev_from_date"], frappe.utils.add_days(params["from_date"], -1)),
+	]
+
+	if is_dashboard_rollup_ready():
+		return tuple(get_rollup_count("CRM Lead", start, end, user) for start, end in windows)
+
+	if not is_approximate_count_enabled("CRM Lead"):
+		return None
+
+	conds = " AND lead_owner = %(user)s" if user else ""
+	counts = [
+		estimate_count(
+			f"""
+			SELECT name
+			FROM `tabCRM Lead`
+			WHERE creation >= %(from)s AND creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+			{conds}
+			""",
+			{"from": start, "to": end, "user": user},
+		)
+		for start, end in windows
+	]
+
+	if any(count.lower_bound_only for count in counts):
+		if frappe.flags.estimated_number_cards is None:
+			frappe.flags.estimated_number_cards = {}
+		key = ("total_leads", str(params["from_date"]), str(params["to_date"]), user or "")
+		frappe.flags.estimated_number_cards[key] = tuple(counts)
+
+	return tuple(count.value for count in counts)
+
+
+def get_number_card_values_from_source(source, cards, params, aggregate=None):
+	source_meta = NUMBER_CARD_SOURCES[source]
+	to_date_end = "DATE_ADD(%(to_date)s, INTERVAL 1 DAY)"
+
+	columns = []
+	date_fields = []
+	joins = ""
+
+	for name in cards:
+		card = NUMBER_CARDS[name]
+		date_field = card["date_field"]
+		conditions = [card["condition"]] if card.get("condition") else []
+		if card.get("status_types") or card.get("exclude_status_types"):
+			conditions.append(
+				get_status_condition(
+					source_meta["status_field"], card.get("status_types"), card.get("exclude_status_types")
+				)
+			)
+		condition = "".join(f" AND {condition}" for condition in conditions)
+
+		if date_field not in date_fields:
+			date_fields.append(date_field)
+
+		if card.get("needs_lead"):
+			joins = source_meta["lead_join"]
+
+		columns.append(
+			f"""{aggregate or card["aggregate"]}(CASE
+				WHEN {date_field} >= %(from_date)s AND {date_field} < {to_date_end}{condition}
+				THEN {card["value"]}
+				ELSE NULL
+			END) AS `{name}_current`"""
+		)
+		columns.append(
+			f"""{aggregate or card["aggregate"]}(CASE
+				WHEN {date_field} >= %(prev_from_date)s AND {date_field} < %(from_date)s{condition}
+				THEN {card["value"]}
+				ELSE NULL
+			END) AS `{name}_prev`"""
+		)
+
+	# only rows falling in either window can contribute to any card
+	conds = " OR ".join(
+		f"({date_field} >= %(prev_from_date)s AND {date_field} < {to_date_end})"
+		for date_field in date_fields
+	)
+	conds = f"({conds})"
+
+	if params.get("user"):
+		conds += f" AND {source_meta['owner_field']} = %(user)s"
+
+	columns = ",\n\t\t\t".join(columns)
+
+	result = frappe.db.sql(
+		f"""
+		SELECT
+			{columns}
+		FROM {source_meta["table"]}
+		{joins}
+		WHERE {conds}
+		""",
+		params,
+		as_dict=1,
+	)
+
+	return {name: (result[0][f"{name}_current"] or 0, result[0][f"{name}_prev"] or 0) for name in cards}
+
+
+# Charts that return a time series take a `grain` (see dashboard_charts). Rows are aggregated on the
+# server so long ranges come back as at most `crm_dashboard_max_points` points (site config, default 90).
+TIME_GRAINS = {"day": 1, "week": 7, "month": 30, "quarter": 91}
+DEFAULT_MAX_POINTS = 90
+
+
+def get_chart_grain(name, grain):
+	return grain if takes_filter(name, "grain") else ""
+
+
+def resolve_grain(from_date, to_date, grain=""):
+	"""
+	Get the given grain, or the finest grain that keeps the range within the maximum number of points.
+	"""
+	if grain in TIME_GRAINS:
+		return grain
+	if grain and grain != "auto":
+		frappe.throw(_("Invalid time grain: {0}").format(grain))
+
+	max_points = frappe.utils.cint(frappe.conf.get("crm_dashboard_max_points")) or DEFAULT_MAX_POINTS
+	days = frappe.utils.date_diff(to_date, from_date) + 1
+
+	for candidate, days_per_point in TIME_GRAINS.items():
+		if days / days_per_point <= max_points:
+			return candidate
+	return "quarter"
+
+
+def get_period_start(date, grain):
+	date = frappe.utils.getdate(date)
+	if grain == "week":
+		return frappe.utils.get_first_day_of_week(date)
+	if grain == "month":
+		return frappe.utils.get_first_day(date)
+	if grain == "quarter":
+		return frappe.utils.get_quarter_start(date)
+	return date
+
+
+def aggregate_by_grain(rows, grain, fields, key="date"):
+	"""
+	Sum the `fields` of date ordered daily rows per period of `grain`, keyed by the period's first day.
+	"""
+	if grain == "day":
+		return rows
+
+	periods = {}
+	for row in rows:
+		period = str(get_period_start(row[key], grain))
+		if period not in periods:
+			periods[period] = {key: period, **{field: 0 for field in fields}}
+		for field in fields:
+			periods[period][field] += row[field] or 0
+
+	return list(periods.values())
+
+
+def bind_chart_methods():
+	"""
+	Get the `get_<name>` method of every registered chart, failing if one is missing.
+	"""
+	methods = {}
+	for name in CHARTS:
+		method = globals().get(f"get_{name}")
+		if not callable(method):
+			raise ImportError(f"Dashboard chart {name} has no get_{name} method")
+		methods[name] = method
+	return methods
+
+
+CHART_METHODS = bind_chart_methods()
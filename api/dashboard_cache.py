@@ -0,0 +1,124 @@
+import time
+
+import frappe
+from frappe.utils.caching import request_cache
+
+from crm.api.dashboard_charts import get_charts_reading, is_cacheable
+from crm.api.replica import is_on_replica
+
+# Dashboard chart results are cached in redis per
+# (chart, from_date, to_date, user, time grain, currency, language).
+#
+# Entries expire after `crm_dashboard_cache_ttl` seconds (site config, default 300,
+# 0 disables the cache) unless they were cached with a TTL of their own, and at most
+# `crm_dashboard_cache_size` entries are kept, least recently used first out. Committed
+# writes to the doctypes a chart reads from (its `sources` in dashboard_charts) drop the
+# cached entries of that chart. Charts registered as not cacheable are never cached.
+#
+# Charts read from the replica are served but not cached: a lagging replica can still return
+# the rows a committed write has just dropped from the cache, which would be cached again.
+
+CACHE_KEY = "crm_dashboard_cache"
+ACCESS_KEY = "crm_dashboard_cache_access"
+
+DEFAULT_TTL = 300
+DEFAULT_SIZE = 500
+
+
+def get_cache_ttl():
+	return frappe.utils.cint(frappe.conf.get("crm_dashboard_cache_ttl", DEFAULT_TTL))
+
+
+def get_cache_size():
+	return frappe.utils.cint(frappe.conf.get("crm_dashboard_cache_size", DEFAULT_SIZE))
+
+
+def get_cache_key(name, from_date, to_date, user="", grain=""):
+	return "|".join(
+		[name, str(from_date), str(to_date), user or "", grain or "", get_currency(), frappe.local.lang or ""]
+	)
+
+
+@request_cache
+def get_currency():
+	return frappe.db.get_single_value("FCRM Settings", "currency") or "USD"
+
+
+def get_cached_chart(name, from_date, to_date, user="", grain=""):
+	"""
+	Get cached chart data along with its age in seconds, or None if it is not cached or has expired.
+	"""
+	ttl = get_cache_ttl()
+	if not ttl or not is_cacheable(name):
+		return None
+
+	key = get_cache_key(name, from_date, to_date, user, grain)
+	entry = frappe.cache.hget(CACHE_KEY, key)
+	if not entry:
+		return None
+
+	now = time.time()
+	age = now - entry["cached_at"]
+	if age > entry.get("ttl", ttl):
+		frappe.cache.hdel(CACHE_KEY, key)
+		frappe.cache.hdel(ACCESS_KEY, key)
+		return None
+
+	frappe.cache.hset(ACCESS_KEY, key, now)
+	return entry["data"], int(age)
+
+
+def set_cached_chart(name, from_date, to_date, user, data, grain="", ttl=None):
+	"""
+	Cache chart data, for `ttl` seconds instead of the configured TTL if given.
+	"""
+	if not get_cache_ttl() or not is_cacheable(name) or is_on_replica():
+		return
+
+	now = time.time()
+	key = get_cache_key(name, from_date, to_date, user, grain)
+	entry = {"data": data, "cached_at": now}
+	if ttl:
+		entry["ttl"] = ttl
+	frappe.cache.hset(CACHE_KEY, key, entry)
+	frappe.cache.hset(ACCESS_KEY, key, now)
+
+	evict_least_recently_used()
+
+
+def evict_least_recently_used():
+	access = frappe.cache.hgetall(ACCESS_KEY)
+	overflow = len(access) - get_cache_size()
+	if overflow <= 0:
+		return
+
+	keys = sorted(access, key=access.get)[:overflow]
+	keys = [frappe.safe_decode(key) for key in keys]
+	frappe.cache.hdel(CACHE_KEY, keys)
+	frappe.cache.hdel(ACCESS_KEY, keys)
+
+
+def invalidate_dashboard_cache(doctype=None):
+	"""
+	Drop cached charts that read from `doctype`, or every cached chart if no doctype is given.
+	"""
+	keys = [frappe.safe_decode(key) for key in frappe.cache.hkeys(CACHE_KEY)]
+
+	if doctype:
+		affected = set(get_charts_reading(doctype))
+		keys = [key for key in keys if key.split("|", 1)[0] in affected]
+
+	if keys:
+		frappe.cache.hdel(CACHE_KEY, keys)
+		frappe.cache.hdel(ACCESS_KEY, keys)
+
+
+def on_change(doc, method):
+	# drop after commit, a chart computed in between would be cached without the change
+	doctype = doc.doctype
+	frappe.db.after_commit.add(lambda: invalidate_dashboard_cache(doctype))
+
+
+def on_settings_update(doc, method):
+	if doc.has_value_changed("currency"):
+		frappe.db.after_commit.add(invalidate_dashboard_cache)
@@ -0,0 +1,74 @@
+# Registry of the dashboard charts.
+#
+# Every chart served by crm.api.dashboard is declared here with:
+# - `type`: "number_card" for the cards computed together by the shared number card query,
+#   "chart" for everything else
+# - `sources`: the doctypes it reads from, writes to them drop its cached data
+# - `filters`: the arguments its method takes besides from_date, to_date and user
+#   ("grain" for time series aggregated per day, week, month or quarter)
+# - `cacheable`: whether its data may be served from the dashboard cache
+# - `cost`: "light", "medium" or "heavy", how expensive it is to compute without a warm cache.
+#   Light charts are cheap lookups (a shared query, redis), medium ones group the raw tables only
+#   when the dashboard rollup is not set up, heavy ones always scan or join the raw tables.
+#
+# crm.api.dashboard binds every chart to its `get_<name>` method when it is imported and fails
+# to import if one is missing. The cache, the concurrent executor and the pre-warm job plan
+# their work from this registry.
+
+LEAD = "CRM Lead"
+DEAL = ["CRM Deal", "CRM Deal Status"]
+
+COSTS = ["light", "medium", "heavy"]
+
+
+def number_card(sources):
+	return {"type": "number_card", "sources": sources, "filters": [], "cacheable": True, "cost": "light"}
+
+
+def chart(sources, cost, filters=None, cacheable=True):
+	return {"type": "chart", "sources": sources, "filters": filters or [], "cacheable": cacheable, "cost": cost}
+
+
+CHARTS = {
+	"total_leads": number_card([LEAD]),
+	"ongoing_deals": number_card(DEAL),
+	"average_ongoing_deal_value": number_card(DEAL),
+	"won_deals": number_card(DEAL),
+	"average_won_deal_value": number_card(DEAL),
+	"average_deal_value": number_card(DEAL),
+	"average_time_to_close_a_lead": number_card([*DEAL, LEAD]),
+	"average_time_to_close_a_deal": number_card(DEAL),
+	"sales_trend": chart([*DEAL, LEAD], "medium", filters=["grain"]),
+	"forecasted_revenue": chart(DEAL, "heavy"),
+	"funnel_conversion": chart([*DEAL, LEAD], "medium"),
+	"deals_by_stage_axis": chart(DEAL, "heavy"),
+	"deals_by_stage_donut": chart(DEAL, "heavy"),
+	"lost_deal_reasons": chart(DEAL, "heavy"),
+	"leads_by_source": chart([LEAD], "medium"),
+	"deals_by_source": chart(DEAL, "medium"),
+	"deals_by_territory": chart(DEAL, "medium"),
+	"deals_by_salesperson": chart(DEAL, "light"),
+}
+
+
+def is_chart(name):
+	return name in CHARTS
+
+
+def is_cacheable(name):
+	return name in CHARTS and CHARTS[name]["cacheable"]
+
+
+def takes_filter(name, filter):
+	return name in CHARTS and filter in CHARTS[name]["filters"]
+
+
+def get_charts_reading(doctype):
+	return [name for name, spec in CHARTS.items() if doctype in spec["sources"]]
+
+
+def by_cost(names):
+	"""
+	Order chart names from the most to the least expensive, so the slowest charts start first.
+	"""
+	return sorted(names, key=lambda name: COSTS.index(CHARTS[name]["cost"]), reverse=True)
@@ -0,0 +1,108 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import frappe
+
+from crm.api.dashboard_charts import by_cost
+from crm.api.dashboard_profiler import profile_chart
+from crm.api.replica import connect_replica, disconnect_replica, on_primary
+
+# Runs dashboard chart methods on a bounded thread pool. Every worker opens its own
+# site context and database connection, so independent chart queries run side by side.
+#
+# Site config:
+# - `crm_dashboard_workers`: pool size, concurrency is off unless this is more than 1
+# - `crm_dashboard_chart_timeout`: seconds a chart may run before it is given up on (default 10)
+
+DEFAULT_CHART_TIMEOUT = 10
+
+
+def get_dashboard_workers():
+	return frappe.utils.cint(frappe.conf.get("crm_dashboard_workers"))
+
+
+def get_chart_timeout():
+	return frappe.utils.flt(frappe.conf.get("crm_dashboard_chart_timeout")) or DEFAULT_CHART_TIMEOUT
+
+
+def run_charts_concurrently(names, from_date, to_date, user="", profile=False, grain=""):
+	"""
+	Evaluate every chart name on the worker pool, passing `grain` to the charts that take one.
+	The most expensive charts are started first, so they do not queue behind cheap ones.
+
+	Returns a dict of name -> {"data": ..., "timed_out": bool, "profile": ...}. Charts that did not
+	finish within the timeout, or failed, come back with `data` set to None. `profile` is only
+	filled in when profiling is requested.
+	"""
+	timeout = get_chart_timeout()
+	context = {
+		"site": frappe.local.site,
+		"sites_path": frappe.local.sites_path,
+		"session_user": frappe.session.user,
+		"lang": frappe.local.lang,
+		"timeout": timeout,
+		"profile": profile,
+		"grain": grain,
+		# charts run on the replica if the request that started them does
+		"replica": bool(getattr(frappe.local, "primary_db", None)),
+	}
+
+	started_at = {}
+	results = {}
+
+	executor = ThreadPoolExecutor(max_workers=get_dashboard_workers(), thread_name_prefix="crm-dashboard")
+	try:
+		futures = {
+			executor.submit(run_chart, context, started_at, name, from_date, to_date, user): name
+			for name in by_cost(names)
+		}
+
+		pending = set(futures)
+		while pending:
+			done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+
+			for future in done:
+				name = futures[future]
+				try:
+					data, stats = future.result()
+					results[name] = {"data": data, "timed_out": False, "profile": stats}
+				except Exception:
+					with on_primary():
+						frappe.log_error(title=f"Dashboard chart {name} failed")
+					results[name] = {"data": None, "timed_out": False, "profile": None}
+
+			now = time.monotonic()
+			for future in list(pending):
+				name = futures[future]
+				if name in started_at and now - started_at[name] > timeout:
+					pending.discard(future)
+					results[name] = {"data": None, "timed_out": True, "profile": None}
+	finally:
+		executor.shutdown(wait=False, cancel_futures=True)
+
+	return results
+
+
+def run_chart(context, started_at, name, from_date, to_date, user):
+	started_at[name] = time.monotonic()
+
+	frappe.init(site=context["site"], sites_path=context["sites_path"])
+	try:
+		frappe.connect()
+		frappe.set_user(context["session_user"])
+		frappe.local.lang = context["lang"]
+		if context["replica"]:
+			connect_replica()
+
+		# let the database abort queries of a chart that has already been given up on
+		frappe.db.sql("SET SESSION max_statement_time = %s", context["timeout"])
+
+		get_chart_data = frappe.get_attr("crm.api.dashboard.get_chart_data")
+		if context["profile"]:
+			return profile_chart(
+				name, lambda: get_chart_data(name, from_date, to_date, user, context["grain"])
+			)
+		return get_chart_data(name, from_date, to_date, user, context["grain"]), None
+	finally:
+		disconnect_replica()
+		frappe.destroy()
@@ -0,0 +1,94 @@
+import frappe
+
+from crm.api.dashboard import get_chart_data
+from crm.api.dashboard_charts import CHARTS
+from crm.api.dashboard_profiler import QueryRecorder
+
+# Indexes the dashboard queries rely on. Every chart filters on a date column,
+# optionally scoped to one owner, and the deal charts also filter on status.
+DASHBOARD_INDEXES = {
+	"CRM Lead": [
+		["creation"],
+		["lead_owner", "creation"],
+	],
+	"CRM Deal": [
+		["creation"],
+		["deal_owner", "creation"],
+		["status", "creation"],
+		["closed_date"],
+		["deal_owner", "closed_date"],
+		["status", "closed_date"],
+		["expected_closure_date"],
+		["deal_owner", "expected_closure_date"],
+	],
+}
+
+
+@frappe.whitelist()
+def advise_dashboard_indexes(from_date=None, to_date=None, user="", apply=False):
+	"""
+	Run EXPLAIN on every query of every dashboard chart and report full table scans,
+	along with the dashboard indexes that are missing. Missing indexes are created if `apply` is set.
+
+	bench --site <site> execute crm.api.dashboard_indexes.advise_dashboard_indexes --kwargs "{'apply': 1}"
+	"""
+	frappe.only_for("System Manager", True)
+
+	from_date = from_date or frappe.utils.get_first_day(frappe.utils.nowdate())
+	to_date = to_date or frappe.utils.get_last_day(frappe.utils.nowdate())
+
+	charts = []
+	for name in CHARTS:
+		with QueryRecorder() as recorder:
+			get_chart_data(name, from_date, to_date, user)
+
+		queries = [q for q in recorder.queries if q.query.lstrip().upper().startswith("SELECT")]
+		charts.append(
+			{
+				"chart": name,
+				"queries": len(queries),
+				"full_scans": [scan for q in queries for scan in get_full_scans(q.query, q.values)],
+			}
+		)
+
+	missing_indexes = get_missing_indexes()
+
+	if frappe.utils.cint(apply):
+		for index in missing_indexes:
+			frappe.db.add_index(index["doctype"], index["fields"], index["index_name"])
+		frappe.db.commit()
+
+	return {"charts": charts, "missing_indexes": missing_indexes, "applied": bool(frappe.utils.cint(apply))}
+
+
+def get_full_scans(query, values):
+	plan = frappe.db.sql(f"EXPLAIN {query}", values, as_dict=True)
+	return [
+		{
+			"table": row.get("table"),
+			"rows": row.get("rows"),
+			"possible_keys": row.get("possible_keys"),
+			"extra": row.get("Extra"),
+		}
+		for row in plan
+		if row.get("type") == "ALL" and not (row.get("table") or "").startswith("<")
+	]
+
+
+def get_missing_indexes():
+	missing = []
+	for doctype, indexes in DASHBOARD_INDEXES.items():
+		existing = get_index_columns(f"tab{doctype}")
+		for fields in indexes:
+			# an index is covered by any existing index that starts with the same columns
+			if any(columns[: len(fields)] == fields for columns in existing):
+				continue
+			missing.append({"doctype": doctype, "fields": fields, "index_name": "_".join(fields) + "_index"})
+	return missing
+
+
+def get_index_columns(table):
+	indexes = {}
+	for row in frappe.db.sql(f"SHOW INDEX FROM `{table}`", as_dict=True):
+		indexes.setdefault(row.Key_name, []).append((row.Seq_in_index, row.Column_name))
+	return [[column for _seq, column in sorted(columns)] for columns in indexes.values()]
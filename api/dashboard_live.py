@@ -0,0 +1,305 @@
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, date_diff, flt, get_datetime, getdate
+from redis.exceptions import LockError
+
+from crm.api.dashboard import NUMBER_CARDS, compute_number_cards, get_chart_data
+from crm.api.deal_status import get_statuses
+from crm.utils import sales_user_only
+
+# Live number cards for open dashboards.
+#
+# A client subscribes to a dashboard (date range and user scope) and gets the number cards
+# pushed to it over realtime when they change, instead of polling get_dashboard. Every
+# subscription keeps the count and sum behind each card for the current and previous period.
+# CRM Lead and CRM Deal writes apply the difference between the record's old and new
+# contribution to those aggregates in a background job once they are committed, without
+# querying the cards again, and publish only the cards whose output changed as
+# `crm_dashboard_update`:
+#
+#	{"subscription": "...", "cards": {"won_deals": {...}, ...}}
+#
+# Subscriptions expire after SUBSCRIPTION_TTL seconds. Clients renew them by subscribing again
+# with their subscription id, which also recounts the aggregates from the database.
+#
+# Subscriptions are read and written back under a redis lock, so concurrent writes never lose
+# each other's changes. An update that cannot get the lock in LOCK_TIMEOUT seconds is skipped,
+# its cards are corrected at the next renewal. Subscribing or unsubscribing while the lock is
+# busy fails with an error the client can retry.
+
+SUBSCRIPTIONS_KEY = "crm_dashboard_subscriptions"
+SUBSCRIPTION_TTL = 10 * 60
+LOCK_TIMEOUT = 5
+
+# Python counterparts of the NUMBER_CARDS values in crm.api.dashboard, their status types are
+# matched with get_statuses like the SQL conditions are: name -> (doctype, date field, value(doc))
+LIVE_CARDS = {
+	"total_leads": ("CRM Lead", "creation", lambda doc: 1),
+	"ongoing_deals": ("CRM Deal", "creation", lambda doc: 1),
+	"average_ongoing_deal_value": ("CRM Deal", "creation", lambda doc: get_deal_value(doc)),
+	"won_deals": ("CRM Deal", "closed_date", lambda doc: 1),
+	"average_won_deal_value": ("CRM Deal", "closed_date", lambda doc: get_deal_value(doc)),
+	"average_deal_value": ("CRM Deal", "creation", lambda doc: get_deal_value(doc)),
+	"average_time_to_close_a_lead": (
+		"CRM Deal",
+		"closed_date",
+		lambda doc: get_days_between(get_lead_creation(doc) or doc.creation, doc.closed_date),
+	),
+	"average_time_to_close_a_deal": (
+		"CRM Deal",
+		"closed_date",
+		lambda doc: get_days_between(doc.creation, doc.closed_date),
+	),
+}
+
+OWNER_FIELDS = {"CRM Lead": "lead_owner", "CRM Deal": "deal_owner"}
+
+
+@frappe.whitelist()
+@sales_user_only
+def subscribe_dashboard(from_date="", to_date="", user="", subscription=None):
+	"""
+	Subscribe to live number card updates of a dashboard, or renew `subscription`.
+	Returns the subscription id and the current cards.
+	"""
+	if not from_date or not to_date:
+		from_date = frappe.utils.get_first_day(from_date or frappe.utils.nowdate())
+		to_date = frappe.utils.get_last_day(to_date or frappe.utils.nowdate())
+
+	roles = frappe.get_roles(frappe.session.user)
+	if "Sales User" in roles and not ("Sales Manager" in roles or "System Manager" in roles):
+		user = frappe.session.user
+
+	if subscription:
+		existing = frappe.cache.hget(SUBSCRIPTIONS_KEY, subscription)
+		if not existing or existing["session_user"] != frappe.session.user:
+			subscription = None
+
+	names = list(LIVE_CARDS)
+	counts = compute_number_cards(names, from_date, to_date, user, aggregate="COUNT")
+	# every record adds 1 to a count card, so only the averages need their sums
+	sums = compute_number_cards(
+		[name for name in names if NUMBER_CARDS[name]["aggregate"] == "AVG"],
+		from_date,
+		to_date,
+		user,
+		aggregate="SUM",
+	)
+	sums = {name: sums.get(name, counts[name]) for name in names}
+
+	entry = {
+		"session_user": frappe.session.user,
+		"from_date": str(getdate(from_date)),
+		"to_date": str(getdate(to_date)),
+		"user": user or "",
+		"expires_at": time.time() + SUBSCRIPTION_TTL,
+		"state": {
+			name: {
+				"current": [counts[name][0], flt(sums[name][0])],
+				"prev": [counts[name][1], flt(sums[name][1])],
+			}
+			for name in names
+		},
+	}
+	entry["cards"] = {name: get_card_output(name, entry) for name in names}
+
+	subscription = subscription or frappe.generate_hash(length=12)
+	with get_subscriptions_lock():
+		frappe.cache.hset(SUBSCRIPTIONS_KEY, subscription, entry)
+
+	return {"subscription": subscription, "cards": entry["cards"], "expires_in": SUBSCRIPTION_TTL}
+
+
+@frappe.whitelist()
+def unsubscribe_dashboard(subscription):
+	entry = frappe.cache.hget(SUBSCRIPTIONS_KEY, subscription)
+	if entry and entry["session_user"] == frappe.session.user:
+		with get_subscriptions_lock():
+			frappe.cache.hdel(SUBSCRIPTIONS_KEY, subscription)
+
+
+@contextmanager
+def get_subscriptions_lock():
+	"""
+	Hold the subscriptions lock, throwing a retryable error if it is busy for LOCK_TIMEOUT seconds.
+	"""
+	lock = frappe.cache.lock(
+		frappe.cache.make_key(f"{SUBSCRIPTIONS_KEY}::lock"), timeout=LOCK_TIMEOUT, blocking_timeout=LOCK_TIMEOUT
+	)
+	if not lock.acquire():
+		frappe.throw(_("Live dashboard updates are busy, please try again"), frappe.TooManyRequestsError)
+
+	try:
+		yield
+	finally:
+		try:
+			lock.release()
+		except LockError:
+			# held longer than its timeout, another process may have taken it since
+			pass
+
+
+def on_change(doc, method):
+	if doc.doctype not in OWNER_FIELDS or not frappe.cache.hlen(frappe.cache.make_key(SUBSCRIPTIONS_KEY)):
+		return
+
+	if method == "on_trash":
+		old, new = get_contributions(doc), {}
+	else:
+		doc_before_save = doc.get_doc_before_save()
+		old = get_contributions(doc_before_save) if doc_before_save else {}
+		new = get_contributions(doc)
+
+	if old == new:
+		return
+
+	# a rolled back write must not change the cards, and the write must not wait for them
+	frappe.enqueue(
+		"crm.api.dashboard_live.update_subscriptions",
+		queue="short",
+		enqueue_after_commit=True,
+		old=old,
+		new=new,
+	)
+
+
+def update_subscriptions(old, new):
+	try:
+		with get_subscriptions_lock():
+			updates = apply_to_subscriptions(old, new)
+	except frappe.TooManyRequestsError:
+		return
+
+	for subscription, session_user, cards in updates:
+		frappe.publish_realtime(
+			"crm_dashboard_update", {"subscription": subscription, "cards": cards}, user=session_user
+		)
+
+
+def apply_to_subscriptions(old, new):
+	"""
+	Replace the `old` contributions of a record with the `new` ones in every subscription.
+	Returns (subscription, session user, cards) of the subscriptions whose cards changed.
+	"""
+	updates = []
+	now = time.time()
+	for subscription, entry in frappe.cache.hgetall(SUBSCRIPTIONS_KEY).items():
+		subscription = frappe.safe_decode(subscription)
+		if entry["expires_at"] < now:
+			frappe.cache.hdel(SUBSCRIPTIONS_KEY, subscription)
+			continue
+
+		changed = apply_contributions(entry, old, -1) | apply_contributions(entry, new, 1)
+		if not changed:
+			continue
+
+		cards = {}
+		for name in changed:
+			output = get_card_output(name, entry)
+			if output != entry["cards"].get(name):
+				entry["cards"][name] = cards[name] = output
+
+		frappe.cache.hset(SUBSCRIPTIONS_KEY, subscription, entry)
+		if cards:
+			updates.append((subscription, entry["session_user"], cards))
+
+	return updates
+
+
+def get_contributions(doc):
+	"""
+	Get what a record adds to every live card it counts towards, as {name: (owner, date, value)}.
+	"""
+	contributions = {}
+	for name, (doctype, date_field, value) in LIVE_CARDS.items():
+		if doctype != doc.doctype or not doc.get(date_field) or not has_card_status(name, doc):
+			continue
+
+		card_value = value(doc)
+		if card_value is not None:
+			contributions[name] = (
+				doc.get(OWNER_FIELDS[doctype]) or "",
+				str(getdate(doc.get(date_field))),
+				flt(card_value),
+			)
+
+	return contributions
+
+
+def has_card_status(name, doc):
+	"""
+	Check that a record's status is one the card counts, like its SQL status condition does.
+	"""
+	card = NUMBER_CARDS[name]
+	types, exclude_types = card.get("status_types"), card.get("exclude_status_types")
+	if not types and not exclude_types:
+		return True
+	return doc.status in get_statuses(types, exclude_types)
+
+
+def apply_contributions(entry, contributions, sign):
+	"""
+	Add (or with a negative sign, remove) contributions to the aggregates of a subscription
+	and return the names of the cards that changed.
+	"""
+	from_date, to_date = entry["from_date"], entry["to_date"]
+	diff = date_diff(to_date, from_date) or 1
+	prev_from_date = str(add_days(from_date, -diff))
+
+	changed = set()
+	for name, (owner, date, value) in contributions.items():
+		if entry["user"] and owner != entry["user"]:
+			continue
+
+		if from_date <= date <= to_date:
+			window = "current"
+		elif prev_from_date <= date < from_date:
+			window = "prev"
+		else:
+			continue
+
+		aggregate = entry["state"][name][window]
+		aggregate[0] += sign
+		aggregate[1] += sign * value
+		changed.add(name)
+
+	return changed
+
+
+def get_card_output(name, entry):
+	"""
+	Build the card the dashboard would return for the aggregates of a subscription.
+	"""
+	values = []
+	for window in ("current", "prev"):
+		count, total = entry["state"][name][window]
+		if NUMBER_CARDS[name]["aggregate"] == "COUNT":
+			values.append(count)
+		else:
+			values.append(total / count if count else 0)
+
+	key = (name, entry["from_date"], entry["to_date"], entry["user"])
+	if frappe.flags.number_card_values is None:
+		frappe.flags.number_card_values = {}
+	frappe.flags.number_card_values[key] = tuple(values)
+
+	return get_chart_data(name, entry["from_date"], entry["to_date"], entry["user"])
+
+
+def get_deal_value(doc):
+	if doc.deal_value is None:
+		return None
+	return flt(doc.deal_value) * (1 if doc.exchange_rate is None else flt(doc.exchange_rate))
+
+
+def get_lead_creation(doc):
+	return frappe.db.get_value("CRM Lead", doc.lead, "creation") if doc.lead else None
+
+
+def get_days_between(start, end):
+	# TIMESTAMPDIFF(DAY, start, end) counts whole days, truncated towards zero
+	seconds = (get_datetime(end) - get_datetime(start)).total_seconds()
+	return int(seconds / 86400)
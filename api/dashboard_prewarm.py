@@ -0,0 +1,156 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.utils import add_months, get_first_day, get_last_day, nowdate
+
+from crm.api.dashboard import evaluate_charts, get_dashboard_context, get_manager_dashboard_layout
+from crm.api.dashboard_cache import get_cache_size
+from crm.api.dashboard_charts import is_cacheable
+
+# Pre-warms the dashboard cache, so the first manager opening the dashboard in the morning
+# does not wait for every chart to be computed.
+#
+# Every chart of the Manager Dashboard layout is computed for the current and the last month,
+# for the whole team and for every enabled sales user, and cached until the next run. Each view
+# is computed in the language its user reads it in (the system language for the whole team),
+# as cached charts are keyed by language. Views are computed side by side, each with its own
+# site context and database connection.
+#
+# Only as many views as fit in the cache are warmed, the whole team's first, then the current
+# month of every user before the last. The rest are reported as skipped, warming them would
+# only evict the views warmed before them.
+#
+# Site config:
+# - `crm_dashboard_prewarm_workers`: number of views computed at once (default 2)
+# - `crm_dashboard_prewarm_ttl`: seconds the warmed charts stay cached (default 24 hours),
+#   writes still drop them as usual. Raise `crm_dashboard_cache_size` to warm every view.
+#
+# Scheduler (crm/hooks.py): `prewarm_dashboard` daily, before office hours, e.g. "0 5 * * *".
+
+DEFAULT_WORKERS = 2
+DEFAULT_TTL = 24 * 60 * 60
+REPORT_KEY = "crm_dashboard_prewarm_report"
+
+
+def prewarm_dashboard():
+	"""
+	Compute every common dashboard view into the cache. Returns, and keeps for
+	get_prewarm_report, the time each view took.
+	"""
+	# charts that may not be cached would be computed for nothing
+	names = [item["name"] for item in get_manager_dashboard_layout() if is_cacheable(item["name"])]
+
+	context = {
+		"site": frappe.local.site,
+		"sites_path": frappe.local.sites_path,
+		"ttl": frappe.utils.cint(frappe.conf.get("crm_dashboard_prewarm_ttl")) or DEFAULT_TTL,
+	}
+	views = get_prewarm_views()
+	max_views = get_cache_size() // len(names) if names else 0
+	views, skipped = views[:max_views], views[max_views:]
+	workers = frappe.utils.cint(frappe.conf.get("crm_dashboard_prewarm_workers")) or DEFAULT_WORKERS
+
+	started_at = time.monotonic()
+	with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crm-dashboard-prewarm") as executor:
+		timings = list(executor.map(lambda view: prewarm_view(context, names, *view), views))
+
+	report = {
+		"started_at": str(frappe.utils.now_datetime()),
+		"charts": len(names),
+		"workers": workers,
+		"seconds": round(time.monotonic() - started_at, 3),
+		"views": timings,
+		"skipped": [
+			{"from_date": str(from_date), "to_date": str(to_date), "user": user}
+			for from_date, to_date, user, _lang in skipped
+		],
+	}
+	frappe.cache.set_value(REPORT_KEY, report)
+	return report
+
+
+@frappe.whitelist()
+def get_prewarm_report():
+	"""
+	Get the timings of the last pre-warm run.
+	"""
+	frappe.only_for("System Manager", True)
+	return frappe.cache.get_value(REPORT_KEY)
+
+
+def get_prewarm_views():
+	"""
+	Get (from_date, to_date, user, language) of every view to warm, most used first: the current
+	and last month for everyone, then the current and last month of every enabled sales user.
+	"""
+	today = nowdate()
+	months = [(get_first_day(month), get_last_day(month)) for month in (today, add_months(today, -1))]
+	system_lang = frappe.db.get_single_value("System Settings", "language") or "en"
+	users = get_sales_users()
+	user_langs = dict(
+		frappe.get_all("User", filters={"name": ("in", users)}, fields=["name", "language"], as_list=True)
+		if users
+		else []
+	)
+
+	views = [(from_date, to_date, "", system_lang) for from_date, to_date in months]
+	for from_date, to_date in months:
+		views += [(from_date, to_date, user, user_langs.get(user) or system_lang) for user in users]
+	return views
+
+
+def get_sales_users():
+	"""
+	Get the enabled users who see only their own records on the dashboard.
+	"""
+
+	def get_users_with_role(*roles):
+		return set(
+			frappe.get_all(
+				"Has Role", filters={"role": ("in", roles), "parenttype": "User"}, pluck="parent"
+			)
+		)
+
+	sales_users = get_users_with_role("Sales User") - get_users_with_role("Sales Manager", "System Manager")
+	if not sales_users:
+		return []
+
+	return frappe.get_all(
+		"User", filters={"enabled": 1, "name": ("in", list(sales_users))}, pluck="name", order_by="name"
+	)
+
+
+def prewarm_view(context, names, from_date, to_date, user, lang):
+	started_at = time.monotonic()
+	status = "ok"
+
+	frappe.init(site=context["site"], sites_path=context["sites_path"])
+	try:
+		frappe.connect()
+		# warm the view as its user sees it, a manager's view as the Administrator
+		frappe.set_user(user or "Administrator")
+		frappe.local.lang = lang
+		# views already run side by side, compute the charts of each one in turn
+		frappe.local.conf.crm_dashboard_workers = 0
+
+		view = get_dashboard_context(from_date, to_date, user)
+		view.update(refresh=True, cache_ttl=context["ttl"])
+		items = evaluate_charts([{"name": name} for name in names], view)
+
+		failed = [item["name"] for item in items if item.get("data") is None]
+		if failed:
+			status = f"failed: {', '.join(failed)}"
+	except Exception:
+		frappe.log_error(title=f"Dashboard pre-warm of {user or 'everyone'} {from_date} failed")
+		status = "error"
+	finally:
+		frappe.destroy()
+
+	return {
+		"from_date": str(from_date),
+		"to_date": str(to_date),
+		"user": user,
+		"status": status,
+		"seconds": round(time.monotonic() - started_at, 3),
+	}
@@ -0,0 +1,122 @@
+import math
+import time
+from collections import defaultdict, deque
+
+import frappe
+
+
+class QueryRecorder:
+	"""
+	Record every query run through `frappe.db.sql` while the context is active.
+
+	with QueryRecorder() as recorder:
+		get_sales_trend(from_date, to_date)
+
+	recorder.queries -> [{"query": ..., "values": ..., "duration": ..., "rows": ...}, ...]
+	"""
+
+	def __init__(self):
+		self.queries = []
+		self._sql = None
+
+	def __enter__(self):
+		self._sql = frappe.db.sql
+
+		def sql(query, values=(), *args, **kwargs):
+			start = time.monotonic()
+			result = self._sql(query, values, *args, **kwargs)
+			self.queries.append(
+				frappe._dict(
+					query=query,
+					values=values,
+					duration=time.monotonic() - start,
+					rows=len(result) if isinstance(result, list | tuple) else 0,
+				)
+			)
+			return result
+
+		frappe.db.sql = sql
+		return self
+
+	def __exit__(self, *args):
+		frappe.db.sql = self._sql
+
+	@property
+	def duration(self):
+		return sum(query.duration for query in self.queries)
+
+
+# Rolling, in-process record of recent chart timings collected while profiling. Every worker
+# process keeps its own samples, `get_dashboard_profile` reports those of the serving worker.
+PROFILE_SAMPLES = 500
+PROFILE_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+_samples = defaultdict(lambda: deque(maxlen=PROFILE_SAMPLES))
+
+
+def profile_chart(name, fn):
+	"""
+	Run `fn` and return its result along with the wall time, SQL time (both in ms),
+	number of queries and rows read by the database.
+	"""
+	rows_before = get_rows_read()
+	start = time.monotonic()
+	with QueryRecorder() as recorder:
+		result = fn()
+	wall_time = time.monotonic() - start
+
+	stats = {
+		"wall_time": round(wall_time * 1000, 3),
+		"sql_time": round(recorder.duration * 1000, 3),
+		"queries": len(recorder.queries),
+		"rows_scanned": get_rows_read() - rows_before,
+	}
+	_samples[name].append((time.time(), stats))
+	return result, stats
+
+
+def get_rows_read():
+	rows = frappe.db.sql("SHOW SESSION STATUS LIKE 'Handler_read%'")
+	return sum(frappe.utils.cint(value) for _variable, value in rows)
+
+
+@frappe.whitelist()
+def get_dashboard_profile(window=3600):
+	"""
+	Get a latency histogram (ms buckets), percentiles and average query counts per chart
+	from the samples recorded by this worker in the last `window` seconds.
+	"""
+	frappe.only_for("System Manager", True)
+
+	since = time.time() - frappe.utils.cint(window)
+	profile = {}
+
+	for name, samples in list(_samples.items()):
+		samples = [stats for recorded_at, stats in list(samples) if recorded_at >= since]
+		if not samples:
+			continue
+
+		timings = sorted(stats["wall_time"] for stats in samples)
+		histogram = {f"<={bucket}": 0 for bucket in PROFILE_BUCKETS}
+		histogram[f">{PROFILE_BUCKETS[-1]}"] = 0
+		for timing in timings:
+			bucket = next((b for b in PROFILE_BUCKETS if timing <= b), None)
+			histogram[f"<={bucket}" if bucket else f">{PROFILE_BUCKETS[-1]}"] += 1
+
+		profile[name] = {
+			"count": len(timings),
+			"p50": percentile(timings, 50),
+			"p95": percentile(timings, 95),
+			"p99": percentile(timings, 99),
+			"avg_sql_time": sum(stats["sql_time"] for stats in samples) / len(samples),
+			"avg_queries": sum(stats["queries"] for stats in samples) / len(samples),
+			"avg_rows_scanned": sum(stats["rows_scanned"] for stats in samples) / len(samples),
+			"histogram": histogram,
+		}
+
+	return profile
+
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
@@ -0,0 +1,381 @@
+from collections import Counter
+
+import frappe
+from frappe.utils import flt, getdate
+
+from crm.api.deal_status import get_deal_status_map, get_status_condition, get_status_type
+
+# Daily pre-aggregated counts of leads and deals, used by the dashboard charts
+# instead of grouping the raw tables on every request.
+#
+# `__crm_dashboard_rollup` holds lead/deal counts and deal value per creation date,
+# owner, source, territory and status. `__crm_deal_stage_rollup` holds the number of
+# status changes into each stage per deal creation date and owner, split by whether
+# the deal is currently counted in the funnel (its status type is known and not Lost).
+#
+# Both tables are kept current by the `on_update` / `on_trash` doc events of
+# CRM Lead and CRM Deal and can be rebuilt at any time with
+# `bench --site <site> execute crm.api.dashboard_rollup.rebuild_dashboard_rollup`.
+#
+# Empty owner, source, territory and status values are stored as "".
+
+ROLLUP_TABLE = "__crm_dashboard_rollup"
+STAGE_ROLLUP_TABLE = "__crm_deal_stage_rollup"
+ROLLUP_READY_KEY = "crm_dashboard_rollup_ready"
+
+ROLLUP_DOCTYPES = {
+	"CRM Lead": {"owner_field": "lead_owner", "value": None},
+	"CRM Deal": {"owner_field": "deal_owner", "value": "deal_value"},
+}
+
+
+def setup_dashboard_rollup_table():
+	frappe.db.sql(
+		f"""
+		CREATE TABLE IF NOT EXISTS `{ROLLUP_TABLE}` (
+			`reference_doctype` VARCHAR(140) NOT NULL,
+			`date` DATE NOT NULL,
+			`owner` VARCHAR(140) NOT NULL DEFAULT '',
+			`source` VARCHAR(140) NOT NULL DEFAULT '',
+			`territory` VARCHAR(140) NOT NULL DEFAULT '',
+			`status` VARCHAR(140) NOT NULL DEFAULT '',
+			`count` INT NOT NULL DEFAULT 0,
+			`value` DECIMAL(21, 9) NOT NULL DEFAULT 0,
+			PRIMARY KEY (`reference_doctype`, `date`, `owner`, `source`, `territory`, `status`),
+			KEY `date_owner` (`date`, `owner`)
+		) ENGINE=InnoDB ROW_FORMAT=DYNAMIC CHARACTER SET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+		"""
+	)
+	frappe.db.sql(
+		f"""
+		CREATE TABLE IF NOT EXISTS `{STAGE_ROLLUP_TABLE}` (
+			`date` DATE NOT NULL,
+			`owner` VARCHAR(140) NOT NULL DEFAULT '',
+			`stage` VARCHAR(140) NOT NULL,
+			`counted` TINYINT NOT NULL DEFAULT 0,
+			`count` INT NOT NULL DEFAULT 0,
+			PRIMARY KEY (`date`, `owner`, `stage`, `counted`)
+		) ENGINE=InnoDB ROW_FORMAT=DYNAMIC CHARACTER SET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+		"""
+	)
+
+
+def is_dashboard_rollup_ready():
+	return bool(frappe.db.get_default(ROLLUP_READY_KEY))
+
+
+@frappe.whitelist()
+def rebuild_dashboard_rollup():
+	"""
+	Rebuild the dashboard rollup from CRM Lead and CRM Deal.
+	"""
+	frappe.only_for("System Manager", True)
+
+	setup_dashboard_rollup_table()
+	frappe.db.sql(f"DELETE FROM `{ROLLUP_TABLE}`")
+
+	for doctype, meta in ROLLUP_DOCTYPES.items():
+		value = (
+			f"SUM(COALESCE(`{meta['value']}`, 0) * IFNULL(exchange_rate, 1))" if meta["value"] else "0"
+		)
+		frappe.db.sql(
+			f"""
+			INSERT INTO `{ROLLUP_TABLE}`
+				(`reference_doctype`, `date`, `owner`, `source`, `territory`, `status`, `count`, `value`)
+			SELECT
+				%(doctype)s,
+				DATE(creation),
+				IFNULL(`{meta['owner_field']}`, ''),
+				IFNULL(source, ''),
+				IFNULL(territory, ''),
+				IFNULL(status, ''),
+				COUNT(*),
+				{value}
+			FROM `tab{doctype}`
+			GROUP BY
+				DATE(creation),
+				IFNULL(`{meta['owner_field']}`, ''),
+				IFNULL(source, ''),
+				IFNULL(territory, ''),
+				IFNULL(status, '')
+			""",
+			{"doctype": doctype},
+		)
+
+	rebuild_stage_rollup()
+
+	frappe.db.set_default(ROLLUP_READY_KEY, 1)
+	frappe.db.commit()
+
+
+def rebuild_stage_rollup():
+	counted = get_status_condition("d.status", exclude_types=["Lost"])
+
+	frappe.db.sql(f"DELETE FROM `{STAGE_ROLLUP_TABLE}`")
+	frappe.db.sql(
+		f"""
+		INSERT INTO `{STAGE_ROLLUP_TABLE}` (`date`, `owner`, `stage`, `counted`, `count`)
+		SELECT
+			DATE(d.creation),
+			IFNULL(d.deal_owner, ''),
+			scl.to,
+			IF({counted}, 1, 0),
+			COUNT(*)
+		FROM `tabCRM Status Change Log` scl
+		JOIN `tabCRM Deal` d ON scl.parent = d.name
+		WHERE scl.to IS NOT NULL AND scl.to != ''
+		GROUP BY
+			DATE(d.creation),
+			IFNULL(d.deal_owner, ''),
+			scl.to,
+			IF({counted}, 1, 0)
+		"""
+	)
+
+
+def on_update(doc, method):
+	if doc.doctype not in ROLLUP_DOCTYPES or not is_dashboard_rollup_ready():
+		return
+
+	doc_before_save = doc.get_doc_before_save()
+
+	if doc.doctype == "CRM Deal":
+		update_stage_rollup(get_stage_counts(doc_before_save) if doc_before_save else {}, get_stage_counts(doc))
+
+	if doc_before_save:
+		old_key, new_key = get_rollup_key(doc_before_save), get_rollup_key(doc)
+		old_value, new_value = get_rollup_value(doc_before_save), get_rollup_value(doc)
+		if old_key == new_key and old_value == new_value:
+			return
+		update_rollup(old_key, -1, -old_value)
+
+	update_rollup(get_rollup_key(doc), 1, get_rollup_value(doc))
+
+
+def on_trash(doc, method):
+	if doc.doctype not in ROLLUP_DOCTYPES or not is_dashboard_rollup_ready():
+		return
+
+	if doc.doctype == "CRM Deal":
+		update_stage_rollup(get_stage_counts(doc), {})
+
+	update_rollup(get_rollup_key(doc), -1, -get_rollup_value(doc))
+
+
+def on_deal_status_update(doc, method):
+	# whether a deal is counted in the funnel depends on the type of its status
+	if doc.has_value_changed("type") and is_dashboard_rollup_ready():
+		frappe.enqueue("crm.api.dashboard_rollup.rebuild_stage_rollup", enqueue_after_commit=True)
+
+
+def get_rollup_key(doc):
+	return (
+		doc.doctype,
+		getdate(doc.creation),
+		doc.get(ROLLUP_DOCTYPES[doc.doctype]["owner_field"]) or "",
+		doc.get("source") or "",
+		doc.get("territory") or "",
+		doc.get("status") or "",
+	)
+
+
+def get_rollup_value(doc):
+	fieldname = ROLLUP_DOCTYPES[doc.doctype]["value"]
+	if not fieldname:
+		return 0
+
+	exchange_rate = doc.get("exchange_rate")
+	return flt(doc.get(fieldname)) * (1 if exchange_rate is None else flt(exchange_rate))
+
+
+def update_rollup(key, count, value):
+	params = dict(zip(("doctype", "date", "owner", "source", "territory", "status"), key))
+	params.update({"count": count, "value": value})
+
+	frappe.db.sql(
+		f"""
+		INSERT INTO `{ROLLUP_TABLE}`
+			(`reference_doctype`, `date`, `owner`, `source`, `territory`, `status`, `count`, `value`)
+		VALUES
+			(%(doctype)s, %(date)s, %(owner)s, %(source)s, %(territory)s, %(status)s, %(count)s, %(value)s)
+		ON DUPLICATE KEY UPDATE
+			`count` = `count` + VALUES(`count`),
+			`value` = `value` + VALUES(`value`)
+		""",
+		params,
+	)
+
+	if count < 0:
+		frappe.db.sql(
+			f"""
+			DELETE FROM `{ROLLUP_TABLE}`
+			WHERE `reference_doctype` = %(doctype)s AND `date` = %(date)s AND `owner` = %(owner)s
+				AND `source` = %(source)s AND `territory` = %(territory)s AND `status` = %(status)s
+				AND `count` <= 0
+			""",
+			params,
+		)
+
+
+def get_stage_counts(doc):
+	"""
+	Get the stage rollup rows a deal contributes to, as {(date, owner, stage, counted): count}.
+	"""
+	status_type = get_status_type(doc.status)
+	counted = int(status_type is not None and status_type != "Lost")
+	date, owner = getdate(doc.creation), doc.get("deal_owner") or ""
+
+	stages = Counter(row.to for row in doc.get("status_change_log") or [] if row.get("to"))
+	return {(date, owner, stage, counted): count for stage, count in stages.items()}
+
+
+def update_stage_rollup(old_counts, new_counts):
+	for key in set(old_counts) | set(new_counts):
+		delta = new_counts.get(key, 0) - old_counts.get(key, 0)
+		if not delta:
+			continue
+
+		params = dict(zip(("date", "owner", "stage", "counted"), key))
+		params["count"] = delta
+
+		frappe.db.sql(
+			f"""
+			INSERT INTO `{STAGE_ROLLUP_TABLE}` (`date`, `owner`, `stage`, `counted`, `count`)
+			VALUES (%(date)s, %(owner)s, %(stage)s, %(counted)s, %(count)s)
+			ON DUPLICATE KEY UPDATE `count` = `count` + VALUES(`count`)
+			""",
+			params,
+		)
+
+		if delta < 0:
+			frappe.db.sql(
+				f"""
+				DELETE FROM `{STAGE_ROLLUP_TABLE}`
+				WHERE `date` = %(date)s AND `owner` = %(owner)s AND `stage` = %(stage)s
+					AND `counted` = %(counted)s AND `count` <= 0
+				""",
+				params,
+			)
+
+
+def get_rollup_trend(from_date, to_date, user=""):
+	"""
+	Get daily lead, deal and won deal counts from the rollup.
+	"""
+	conds = ""
+	params = {"from": from_date, "to": to_date}
+
+	if user:
+		conds += " AND r.owner = %(user)s"
+		params["user"] = user
+
+	won = get_status_condition("r.status", types=["Won"])
+	known = get_status_condition("r.status")
+
+	return frappe.db.sql(
+		f"""
+		SELECT
+			DATE_FORMAT(r.date, '%%Y-%%m-%%d') AS date,
+			CAST(SUM(CASE WHEN r.reference_doctype = 'CRM Lead' THEN r.count ELSE 0 END) AS SIGNED) AS leads,
+			CAST(SUM(CASE WHEN r.reference_doctype = 'CRM Deal' THEN r.count ELSE 0 END) AS SIGNED) AS deals,
+			CAST(
+				SUM(CASE WHEN r.reference_doctype = 'CRM Deal' AND {won} THEN r.count ELSE 0 END) AS SIGNED
+			) AS won_deals
+		FROM `{ROLLUP_TABLE}` r
+		WHERE r.date BETWEEN %(from)s AND %(to)s
+			AND (r.reference_doctype = 'CRM Lead' OR {known})
+			{conds}
+		GROUP BY r.date
+		ORDER BY r.date
+		""",
+		params,
+		as_dict=True,
+	)
+
+
+def get_rollup_breakdown(doctype, group_by, from_date, to_date, user=""):
+	"""
+	Get count and value of `doctype` grouped by one of the rollup key columns
+	(owner, source, territory or status), highest count first.
+	"""
+	conds = ""
+	params = {"doctype": doctype, "from": from_date, "to": to_date}
+
+	if user:
+		conds += " AND r.owner = %(user)s"
+		params["user"] = user
+
+	return frappe.db.sql(
+		f"""
+		SELECT
+			r.`{group_by}` AS `{group_by}`,
+			CAST(SUM(r.count) AS SIGNED) AS count,
+			SUM(r.value) AS value
+		FROM `{ROLLUP_TABLE}` r
+		WHERE r.reference_doctype = %(doctype)s
+			AND r.date BETWEEN %(from)s AND %(to)s
+			{conds}
+		GROUP BY r.`{group_by}`
+		ORDER BY count DESC, value DESC
+		""",
+		params,
+		as_dict=True,
+	)
+
+
+def get_rollup_count(doctype, from_date, to_date, user=""):
+	"""
+	Get the number of `doctype` records created in the range from the rollup.
+	"""
+	conds = ""
+	params = {"doctype": doctype, "from": from_date, "to": to_date}
+
+	if user:
+		conds += " AND r.owner = %(user)s"
+		params["user"] = user
+
+	result = frappe.db.sql(
+		f"""
+		SELECT CAST(IFNULL(SUM(r.count), 0) AS SIGNED) AS count
+		FROM `{ROLLUP_TABLE}` r
+		WHERE r.reference_doctype = %(doctype)s
+			AND r.date BETWEEN %(from)s AND %(to)s
+			{conds}
+		""",
+		params,
+		as_dict=True,
+	)
+	return result[0].count if result else 0
+
+
+def get_rollup_stage_counts(from_date, to_date, user=""):
+	"""
+	Get the number of status changes into each stage for deals created in the range,
+	excluding lost deals, ordered by stage position.
+	"""
+	conds = ""
+	params = {"from": from_date, "to": to_date}
+
+	if user:
+		conds += " AND r.owner = %(user)s"
+		params["user"] = user
+
+	result = frappe.db.sql(
+		f"""
+		SELECT
+			r.stage AS stage,
+			CAST(SUM(r.count) AS SIGNED) AS count
+		FROM `{STAGE_ROLLUP_TABLE}` r
+		WHERE r.counted = 1
+			AND r.date BETWEEN %(from)s AND %(to)s
+			AND {get_status_condition("r.stage")}
+			{conds}
+		GROUP BY r.stage
+		HAVING count > 0
+		""",
+		params,
+		as_dict=True,
+	)
+
+	statuses = get_deal_status_map()
+	return sorted(result, key=lambda row: statuses[row.stage].position)
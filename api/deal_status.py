@@ -0,0 +1,75 @@
+import frappe
+from frappe.utils.caching import request_cache
+
+from crm.api.replica import on_primary
+
+# Process wide cache of CRM Deal Status, so queries can filter deals with
+# `d.status IN (...)` instead of joining `tabCRM Deal Status` to test its type.
+#
+# Every worker keeps the statuses of each site in memory along with the version they were
+# loaded at. Saving or deleting a status bumps the version in redis, which makes every
+# worker load the statuses again on their next use.
+
+STATUS_VERSION_KEY = "crm_deal_status_version"
+
+# site -> (version, {name: {"type": ..., "position": ...}})
+_status_maps = {}
+
+
+def get_deal_status_map():
+	"""
+	Get {status: {"type": ..., "position": ...}} of every CRM Deal Status, ordered by position.
+	"""
+	version = get_status_version()
+	cached = _status_maps.get(frappe.local.site)
+	if cached and cached[0] == version:
+		return cached[1]
+
+	# the map is kept under `version` until the next status change, never load it from a lagging replica
+	with on_primary():
+		rows = frappe.get_all("CRM Deal Status", fields=["name", "type", "position"], order_by="position asc")
+
+	statuses = {status.name: frappe._dict(type=status.type, position=status.position or 0) for status in rows}
+	_status_maps[frappe.local.site] = (version, statuses)
+	return statuses
+
+
+@request_cache
+def get_status_version():
+	return frappe.cache.get_value(STATUS_VERSION_KEY) or 0
+
+
+def get_status_type(status):
+	status = get_deal_status_map().get(status)
+	return status.type if status else None
+
+
+def get_statuses(types=None, exclude_types=None):
+	"""
+	Get the statuses with one of `types`, or with a type that is not one of `exclude_types`, like
+	`s.type IN (...)` and `s.type NOT IN (...)` would (statuses without a type match neither).
+	Without either, every status is returned, like a plain join would.
+	"""
+	statuses = get_deal_status_map()
+	if types:
+		return [name for name, status in statuses.items() if status.type in types]
+	if exclude_types:
+		return [name for name, status in statuses.items() if status.type and status.type not in exclude_types]
+	return list(statuses)
+
+
+def get_status_condition(column, types=None, exclude_types=None):
+	"""
+	Get an SQL condition that `column` is one of the matching statuses (see get_statuses).
+	"""
+	statuses = get_statuses(types, exclude_types)
+	if not statuses:
+		return "1 = 0"
+	return f"{column} IN ({', '.join(frappe.db.escape(status) for status in statuses)})"
+
+
+def on_deal_status_change(doc, method):
+	# bump after commit, a worker reloading in between would cache the old statuses under the new version
+	frappe.db.after_commit.add(
+		lambda: frappe.cache.set_value(STATUS_VERSION_KEY, frappe.generate_hash(length=10))
+	)
@@ -1,3 +1,4 @@
+import base64
 import json
 
 import frappe
@@ -9,8 +10,10 @@ from frappe.model.document import get_controller
 from frappe.utils import make_filter_tuple
 from pypika import Criterion
 
-from crm.api.views import get_views
-from crm.fcrm.doctype.crm_form_script.crm_form_script import get_form_script
+from crm.api.activity_counts import add_activity_counts, get_activity_counts
+from crm.api.list_count import get_list_total_count
+from crm.api.list_meta import STD_FIELDS, get_list_meta
+from crm.api.replica import replica_read
 from crm.utils import get_dynamic_linked_docs, get_linked_docs, is_frappe_version
 
 COUNT_NAME = (
@@ -280,6 +283,7 @@ def update_in_standard_filter(fieldname, doctype, value):
 
 
 @frappe.whitelist()
+@replica_read
 def get_data(
 	doctype: str,
 	filters: dict,
@@ -294,6 +298,8 @@ def get_data(
 	kanban_fields=None,
 	view=None,
 	default_filters=None,
+	cursor=None,
+	meta_version=None,
 ):
 	custom_view = False
 	filters = frappe._dict(filters)
@@ -324,6 +330,7 @@ def get_data(
 
 	is_default = True
 	data = []
+	next_cursor = None
 	_list = get_controller(doctype)
 	default_rows = []
 	if hasattr(_list, "default_list_data"):
@@ -381,17 +388,37 @@ def get_data(
 		if group_by_field and group_by_field not in rows:
 			rows.append(group_by_field)
 
-		data = (
-			frappe.get_list(
+		# with a sort on plain columns, pages can continue from the last row of the previous one
+		keyset_order = get_keyset_order(doctype, order_by)
+		if keyset_order:
+			fields = list(dict.fromkeys([*rows, *(column for column, _direction in keyset_order)]))
+			after = decode_cursor(cursor, keyset_order) if cursor else None
+			if after is not None:
+				data = get_page_after(doctype, fields, filters, keyset_order, after, page_length)
+			else:
+				data = frappe.get_list(
+					doctype,
+					fields=fields,
+					filters=filters,
+					order_by=", ".join(f"{column} {direction}" for column, direction in keyset_order),
+					page_length=page_length,
+				)
+
+			if data and len(data) >= frappe.utils.cint(page_length):
+				next_cursor = encode_cursor(keyset_order, data[-1])
+			for row in data:
+				for field in set(fields) - set(rows):
+					row.pop(field, None)
+		else:
+			data = frappe.get_list(
 				doctype,
 				fields=rows,
 				filters=filters,
 				order_by=order_by,
 				page_length=page_length,
 			)
-			or []
-		)
-		data = parse_list_data(data, doctype)
+
+		data = parse_list_data(data or [], doctype)
 
 	if view_type == "kanban":
 		if not rows:
@@ -425,6 +452,9 @@ def get_data(
 			if field not in rows:
 				rows.append(field)
 
+		# counts and rows of every column in two queries, when the columns allow it
+		grouped = get_grouped_kanban_data(doctype, rows, filters, order_by, column_field, kanban_columns)
+
 		for kc in kanban_columns:
 			# Start with base filters
 			column_filters = []
@@ -448,6 +478,8 @@ def get_data(
 					column_data = get_records_based_on_order(
 						doctype, rows, column_filters, page_length, order
 					)
+				elif grouped and kc.get("name"):
+					column_data = grouped.rows.get(kc.get("name"), [])
 				else:
 					column_data = frappe.get_list(
 						doctype,
@@ -457,11 +489,14 @@ def get_data(
 						page_length=page_length,
 					)
 
-				all_count = frappe.get_list(
-					doctype,
-					filters=column_filters,
-					fields=[COUNT_NAME],
-				)[0].total_count
+				if grouped and kc.get("name"):
+					all_count = grouped.counts.get(kc.get("name"), 0)
+				else:
+					all_count = frappe.get_list(
+						doctype,
+						filters=column_filters,
+						fields=[COUNT_NAME],
+					)[0].total_count
 
 				kc["all_count"] = all_count
 				kc["count"] = len(column_data)
@@ -474,40 +509,12 @@ def get_data(
 
 			data.append({"column": kc, "fields": kanban_fields, "data": column_data})
 
-	fields = frappe.get_meta(doctype).fields
-	fields = [field for field in fields if field.fieldtype not in no_value_fields]
-	fields = [
-		{
-			"label": _(field.label),
-			"fieldtype": field.fieldtype,
-			"fieldname": field.fieldname,
-			"options": field.options,
-		}
-		for field in fields
-		if field.label and field.fieldname
-	]
-
-	std_fields = [
-		{"label": "Name", "fieldtype": "Data", "fieldname": "name"},
-		{"label": "Created on", "fieldtype": "Datetime", "fieldname": "creation"},
-		{"label": "Last modified", "fieldtype": "Datetime", "fieldname": "modified"},
-		{
-			"label": "Modified by",
-			"fieldtype": "Link",
-			"fieldname": "modified_by",
-			"options": "User",
-		},
-		{"label": "Assigned to", "fieldtype": "Text", "fieldname": "_assign"},
-		{"label": "Owner", "fieldtype": "Link", "fieldname": "owner", "options": "User"},
-		{"label": "Like", "fieldtype": "Data", "fieldname": "_liked_by"},
-	]
+	list_meta = get_list_meta(doctype)
+	fields = list_meta.fields
 
-	for field in std_fields:
+	for field in STD_FIELDS:
 		if field.get("fieldname") not in rows:
 			rows.append(field.get("fieldname"))
-		if field not in fields:
-			field["label"] = _(field["label"])
-			fields.append(field)
 
 	if not is_default and custom_view_name:
 		is_default = frappe.db.get_value("CRM View Settings", custom_view_name, "load_default_columns")
@@ -546,7 +553,9 @@ def get_data(
 					"options": get_options(field.get("fieldtype"), field.get("options")),
 				}
 
-	return {
+	total_count = get_list_total_count(doctype, filters)
+
+	response = {
 		"data": data,
 		"columns": columns,
 		"rows": rows,
@@ -559,18 +568,30 @@ def get_data(
 		"page_length": page_length,
 		"page_length_count": page_length_count,
 		"is_default": is_default,
-		"views": get_views(doctype),
-		"total_count": frappe.get_list(doctype, filters=filters, fields=[COUNT_NAME])[0].total_count,
+		"views": list_meta.views,
+		"total_count": total_count.value,
+		"total_count_lower_bound_only": total_count.lower_bound_only,
+		"total_count_lower_bound": total_count.lower_bound,
 		"row_count": len(data),
-		"form_script": get_form_script(doctype),
-		"list_script": get_form_script(doctype, "List"),
+		"next_cursor": next_cursor,
+		"form_script": list_meta.form_script,
+		"list_script": list_meta.list_script,
 		"view_type": view_type,
+		"meta_version": list_meta.version,
 	}
 
+	# the client already has the static part of the response
+	if meta_version and meta_version == list_meta.version:
+		response.update(fields=None, views=None, form_script=None, list_script=None)
+
+	return response
+
 
 def parse_list_data(data, doctype):
 	_list = get_controller(doctype)
 	if hasattr(_list, "parse_list_data"):
+		# controllers call getCounts per row, count the whole page at once up front
+		add_activity_counts(data, doctype)
 		data = _list.parse_list_data(data)
 	return data
 
@@ -584,6 +605,178 @@ def convert_filter_to_tuple(doctype, filters):
 	return filters
 
 
+def get_grouped_kanban_data(doctype, rows, filters, order_by, column_field, kanban_columns):
+	"""
+	Get the record count of every kanban column with one query grouped by `column_field`, and
+	the first `page_length` rows of every column without a manual order with one windowed query.
+
+	Returns {"counts": {column: count}, "rows": {column: [row, ...]}}, or None if the columns
+	or the sort order can not be handled this way and every column is fetched on its own.
+	"""
+	names = [kc.get("name") for kc in kanban_columns if kc.get("name") and not kc.get("delete")]
+	window_order = get_window_order(doctype, order_by)
+	if not column_field or not names or window_order is None:
+		return None
+
+	window_order, order_columns = window_order
+	filters = convert_filter_to_tuple(doctype, filters)
+	filters.append([doctype, column_field, "in", names])
+
+	counts = {
+		row[column_field]: row.total_count
+		for row in frappe.get_list(
+			doctype,
+			filters=filters,
+			fields=[column_field, COUNT_NAME],
+			group_by=column_field,
+			order_by="",
+		)
+	}
+
+	page_lengths = {
+		kc.get("name"): frappe.utils.cint(kc.get("page_length", 20))
+		for kc in kanban_columns
+		if kc.get("name") in names and not kc.get("order")
+	}
+	grouped_rows = {}
+	if page_lengths:
+		fields = list(dict.fromkeys([*rows, column_field, *order_columns]))
+		base = frappe.get_list(doctype, fields=fields, filters=filters, order_by="", run=False)
+		limits = " OR ".join(
+			f"(ranked.`{column_field}` = {frappe.db.escape(name, percent=False)} AND ranked.`_kanban_rank` <= {page_length})"
+			for name, page_length in page_lengths.items()
+		)
+
+		# the base query has its values inlined already, run it without parameters
+		for row in frappe.db.sql(
+			f"""
+			SELECT * FROM (
+				SELECT
+					base.*,
+					ROW_NUMBER() OVER (PARTITION BY base.`{column_field}` ORDER BY {window_order}) AS `_kanban_rank`
+				FROM ({base}) base
+			) ranked
+			WHERE {limits}
+			ORDER BY ranked.`_kanban_rank`
+			""",
+			as_dict=True,
+		):
+			column = row[column_field]
+			grouped_rows.setdefault(column, []).append(
+				frappe._dict({field: value for field, value in row.items() if field in rows})
+			)
+
+	return frappe._dict(counts=counts, rows=grouped_rows)
+
+
+def get_window_order(doctype, order_by):
+	"""
+	Translate a list `order_by` ("modified desc, name asc") into the ORDER BY of a window over the
+	base query, along with the columns it needs. Returns None for anything but plain columns.
+	"""
+	order = parse_order_by(doctype, order_by)
+	if order is None:
+		return None
+
+	return ", ".join(f"base.`{column}` {direction}" for column, direction in order), [c for c, _d in order]
+
+
+def parse_order_by(doctype, order_by):
+	"""
+	Parse a list `order_by` into [(column, direction)], or None if it sorts on anything but plain
+	columns of the doctype. Without an `order_by` the doctype's default sort is used.
+	"""
+	meta = frappe.get_meta(doctype)
+	valid_columns = set(meta.get_valid_columns())
+
+	order = []
+	for part in (order_by or f"{meta.sort_field or 'creation'} {meta.sort_order or 'desc'}").split(","):
+		tokens = part.split()
+		if not tokens or len(tokens) > 2:
+			return None
+
+		column = tokens[0].split(".")[-1].strip("`")
+		direction = tokens[1].lower() if len(tokens) == 2 else "asc"
+		if column not in valid_columns or direction not in ("asc", "desc"):
+			return None
+
+		order.append((column, direction))
+
+	return order
+
+
+def get_keyset_order(doctype, order_by):
+	"""
+	Get the sort of a list as [(column, direction)] with `name` added as the last tie breaker,
+	so every row has a unique position to continue from. None if the sort is not on plain columns.
+	"""
+	order = parse_order_by(doctype, order_by)
+	if order and "name" not in (column for column, _direction in order):
+		order.append(("name", order[-1][1]))
+	return order
+
+
+def encode_cursor(order, row):
+	cursor = {"order": order, "values": [row.get(column) for column, _direction in order]}
+	return base64.urlsafe_b64encode(frappe.as_json(cursor, indent=None).encode()).decode()
+
+
+def decode_cursor(cursor, order):
+	"""
+	Get the sort values a cursor continues after, or None if it is invalid or was made for another sort.
+	"""
+	try:
+		cursor = json.loads(base64.urlsafe_b64decode(cursor))
+	except (ValueError, TypeError):
+		return None
+
+	if not isinstance(cursor, dict) or cursor.get("order") != [list(part) for part in order]:
+		return None
+
+	values = cursor.get("values")
+	return values if isinstance(values, list) and len(values) == len(order) else None
+
+
+def get_page_after(doctype, fields, filters, order, after, page_length):
+	"""
+	Get the `page_length` rows sorted after the `after` sort values, seeking to them instead of
+	skipping every row before them.
+	"""
+	# NULLs sort first ascending and last descending. The query runs without parameters, so
+	# values are escaped without doubling their % signs
+	def is_equal(column, value):
+		if value is None:
+			return f"base.`{column}` IS NULL"
+		return f"base.`{column}` = {frappe.db.escape(str(value), percent=False)}"
+
+	def is_after(column, direction, value):
+		if value is None:
+			return f"base.`{column}` IS NOT NULL" if direction == "asc" else "1 = 0"
+		value = frappe.db.escape(str(value), percent=False)
+		if direction == "asc":
+			return f"base.`{column}` > {value}"
+		return f"(base.`{column}` < {value} OR base.`{column}` IS NULL)"
+
+	conditions = []
+	for i, (column, direction) in enumerate(order):
+		equal = [is_equal(c, value) for (c, _d), value in zip(order[:i], after[:i])]
+		conditions.append(" AND ".join([*equal, is_after(column, direction, after[i])]))
+
+	base = frappe.get_list(doctype, fields=fields, filters=filters, order_by="", run=False)
+
+	# the base query has its values inlined already, run it without parameters
+	return frappe.db.sql(
+		f"""
+		SELECT base.*
+		FROM ({base}) base
+		WHERE {" OR ".join(f"({condition})" for condition in conditions)}
+		ORDER BY {", ".join(f"base.`{column}` {direction}" for column, direction in order)}
+		LIMIT {frappe.utils.cint(page_length)}
+		""",
+		as_dict=True,
+	)
+
+
 def get_records_based_on_order(doctype, rows, filters, page_length, order):
 	records = []
 	filters = convert_filter_to_tuple(doctype, filters)
@@ -721,35 +914,14 @@ def get_fields(doctype: str, allow_all_fieldtypes: bool = False):
 
 
 def getCounts(d, doctype):
-	d["_email_count"] = (
-		frappe.db.count(
-			"Communication",
-			filters={
-				"reference_doctype": doctype,
-				"reference_name": d.get("name"),
-				"communication_type": "Communication",
-			},
-		)
-		or 0
-	)
-	d["_email_count"] = d["_email_count"] + frappe.db.count(
-		"Communication",
-		filters={
-			"reference_doctype": doctype,
-			"reference_name": d.get("name"),
-			"communication_type": "Automated Message",
-		},
-	)
-	d["_comment_count"] = frappe.db.count(
-		"Comment",
-		filters={"reference_doctype": doctype, "reference_name": d.get("name"), "comment_type": "Comment"},
-	)
-	d["_task_count"] = frappe.db.count(
-		"CRM Task", filters={"reference_doctype": doctype, "reference_docname": d.get("name")}
-	)
-	d["_note_count"] = frappe.db.count(
-		"FCRM Note", filters={"reference_doctype": doctype, "reference_docname": d.get("name")}
-	)
+	"""
+	Set the activity counters of a list row, from the counts taken for its whole page by
+	parse_list_data when available.
+	"""
+	counts = (frappe.flags.activity_counts or {}).get((doctype, d.get("name")))
+	if counts is None:
+		counts = get_activity_counts(doctype, [d.get("name")])[d.get("name")]
+	d.update(counts)
 	return d
 
 
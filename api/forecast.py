@@ -0,0 +1,306 @@
+import threading
+import time
+
+import frappe
+from frappe import _
+
+from crm.api.deal_status import get_deal_status_map
+from crm.api.replica import on_primary
+from crm.utils import sales_user_only
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# Revenue forecasting over an in-memory, columnar snapshot of CRM Deal.
+#
+# Every worker process keeps one snapshot per site holding the deals that close in the
+# forecast window as NumPy arrays. Before each use the snapshot picks up deals modified
+# or deleted since its last refresh, going REFRESH_OVERLAP seconds further back for
+# transactions that committed after the refresh with an earlier modified timestamp. It is
+# reloaded from scratch once it is older than SNAPSHOT_MAX_AGE (this also catches writes
+# made with update_modified=False).
+#
+# NumPy is optional, `is_forecast_engine_available` tells callers whether to fall back to SQL.
+
+FORECAST_MONTHS = 12
+SNAPSHOT_MAX_AGE = 60 * 60
+REFRESH_OVERLAP = 5 * 60
+PROBABILITY_BUCKETS = [(0, 25), (25, 50), (50, 75), (75, 100)]
+
+SNAPSHOT_FIELDS = [
+	"name",
+	"expected_closure_date",
+	"expected_deal_value",
+	"deal_value",
+	"probability",
+	"exchange_rate",
+	"status",
+	"deal_owner",
+	"modified",
+]
+
+_snapshots = {}
+_lock = threading.RLock()
+
+
+def is_forecast_engine_available():
+	return np is not None
+
+
+class DealSnapshot:
+	def __init__(self, cutoff):
+		self.cutoff = np.datetime64(cutoff, "D")
+		self.loaded_at = time.monotonic()
+		self.refreshed_at = None
+		self.index = {}
+		self.statuses, self.owners = Codes(), Codes()
+
+		self.closure_date = np.empty(0, dtype="datetime64[D]")
+		self.expected_deal_value = np.empty(0)
+		self.deal_value = np.empty(0)
+		self.probability = np.empty(0)
+		self.exchange_rate = np.empty(0)
+		self.status = np.empty(0, dtype=np.int32)
+		self.owner = np.empty(0, dtype=np.int32)
+		self.valid = np.empty(0, dtype=bool)
+
+	def load(self):
+		self.refreshed_at = frappe.utils.now_datetime()
+		self.upsert(
+			frappe.get_all(
+				"CRM Deal",
+				filters={"expected_closure_date": (">=", str(self.cutoff))},
+				fields=SNAPSHOT_FIELDS,
+			)
+		)
+
+	def refresh(self):
+		since, self.refreshed_at = self.refreshed_at, frappe.utils.now_datetime()
+		# rows read again are overwritten in place, the overlap only costs a few reads
+		since = frappe.utils.add_to_date(since, seconds=-REFRESH_OVERLAP)
+
+		self.upsert(frappe.get_all("CRM Deal", filters={"modified": (">=", since)}, fields=SNAPSHOT_FIELDS))
+
+		deleted = frappe.get_all(
+			"Deleted Document",
+			filters={"deleted_doctype": "CRM Deal", "creation": (">=", since)},
+			pluck="deleted_name",
+		)
+		for name in deleted:
+			if name in self.index:
+				self.valid[self.index[name]] = False
+
+	def upsert(self, rows):
+		new_rows = []
+		for row in rows:
+			in_window = bool(row.expected_closure_date) and (
+				np.datetime64(row.expected_closure_date, "D") >= self.cutoff
+			)
+			if row.name in self.index:
+				position = self.index[row.name]
+				if in_window:
+					self.set_row(position, row)
+				self.valid[position] = in_window
+			elif in_window:
+				new_rows.append(row)
+
+		if not new_rows:
+			return
+
+		start = len(self.valid)
+		for i, row in enumerate(new_rows):
+			self.index[row.name] = start + i
+
+		closure_dates = np.array([row.expected_closure_date for row in new_rows], dtype="datetime64[D]")
+		exchange_rates = [1 if row.exchange_rate is None else to_float(row.exchange_rate) for row in new_rows]
+
+		self.closure_date = np.concatenate([self.closure_date, closure_dates])
+		self.expected_deal_value = np.concatenate(
+			[self.expected_deal_value, [to_float(row.expected_deal_value) for row in new_rows]]
+		)
+		self.deal_value = np.concatenate([self.deal_value, [to_float(row.deal_value) for row in new_rows]])
+		self.probability = np.concatenate(
+			[self.probability, [to_float(row.probability) for row in new_rows]]
+		)
+		self.exchange_rate = np.concatenate([self.exchange_rate, exchange_rates])
+		self.status = np.concatenate(
+			[self.status, np.array([self.statuses.code(row.status) for row in new_rows], dtype=np.int32)]
+		)
+		self.owner = np.concatenate(
+			[self.owner, np.array([self.owners.code(row.deal_owner) for row in new_rows], dtype=np.int32)]
+		)
+		self.valid = np.concatenate([self.valid, np.ones(len(new_rows), dtype=bool)])
+
+	def set_row(self, position, row):
+		self.closure_date[position] = np.datetime64(row.expected_closure_date, "D")
+		self.expected_deal_value[position] = to_float(row.expected_deal_value)
+		self.deal_value[position] = to_float(row.deal_value)
+		self.probability[position] = to_float(row.probability)
+		self.exchange_rate[position] = 1 if row.exchange_rate is None else to_float(row.exchange_rate)
+		self.status[position] = self.statuses.code(row.status)
+		self.owner[position] = self.owners.code(row.deal_owner)
+
+	def get_status_types(self):
+		"""
+		Get the current type of every deal status in the snapshot, "" for statuses without a type
+		and unknown statuses.
+		"""
+		statuses = get_deal_status_map()
+		types = [statuses[status].type or "" if status in statuses else "" for status in self.statuses.values]
+		return np.array(types or [""])[self.status]
+
+	def get_mask(self, user=""):
+		"""
+		Get the deals in the forecast window with a status that exists, like the SQL forecast's
+		`d.status IN (...)` does. Statuses without a type are included.
+		"""
+		statuses = get_deal_status_map()
+		known = np.array([status in statuses for status in self.statuses.values] or [False])
+
+		cutoff = np.datetime64(get_forecast_cutoff(), "D")
+		mask = self.valid & (self.closure_date >= cutoff) & known[self.status]
+		if user:
+			mask &= self.owner == self.owners.get(user)
+		return mask
+
+
+class Codes:
+	"""
+	Maps repeated string values (statuses, owners) to small integer codes.
+	"""
+
+	def __init__(self):
+		self.values = []
+		self._codes = {}
+
+	def code(self, value):
+		value = value or ""
+		if value not in self._codes:
+			self._codes[value] = len(self.values)
+			self.values.append(value)
+		return self._codes[value]
+
+	def get(self, value):
+		return self._codes.get(value or "", -1)
+
+
+def to_float(value):
+	return float(value or 0)
+
+
+def get_forecast_cutoff():
+	return frappe.utils.add_months(frappe.utils.nowdate(), -FORECAST_MONTHS)
+
+
+def get_deal_snapshot():
+	"""
+	Get the refreshed deal snapshot of the current site. Callers must hold `_lock` while they read it.
+	Refreshes read from the primary, rows a lagging replica has not seen yet would never be picked up.
+	"""
+	with _lock, on_primary():
+		snapshot = _snapshots.get(frappe.local.site)
+		cutoff = frappe.utils.getdate(get_forecast_cutoff())
+
+		if (
+			not snapshot
+			or time.monotonic() - snapshot.loaded_at > SNAPSHOT_MAX_AGE
+			or np.datetime64(cutoff, "D") < snapshot.cutoff
+		):
+			snapshot = DealSnapshot(cutoff)
+			snapshot.load()
+			_snapshots[frappe.local.site] = snapshot
+		else:
+			snapshot.refresh()
+
+		return snapshot
+
+
+def get_monthly_forecast(user=""):
+	"""
+	Get forecasted and actual revenue per expected closure month.
+	[
+		{"month": "2024-05", "forecasted": 1200000.0, "actual": 980000.0},
+		...
+	]
+	"""
+	with _lock:
+		return compute_monthly_forecast(get_deal_snapshot(), user)
+
+
+def compute_monthly_forecast(snapshot, user="", probability=None):
+	"""
+	Lost deals are forecasted at their full expected value, others at expected value times
+	probability (or the given `probability` array). Actual revenue is the value of won deals.
+	"""
+	status_types = snapshot.get_status_types()
+	mask = snapshot.get_mask(user)
+
+	if probability is None:
+		probability = snapshot.probability
+
+	value = snapshot.expected_deal_value * snapshot.exchange_rate
+	forecasted = np.where(status_types == "Lost", value, value * probability / 100)
+	actual = np.where(status_types == "Won", snapshot.deal_value * snapshot.exchange_rate, 0)
+
+	months, inverse = np.unique(snapshot.closure_date[mask].astype("datetime64[M]"), return_inverse=True)
+	forecasted = np.bincount(inverse, weights=forecasted[mask], minlength=len(months))
+	actual = np.bincount(inverse, weights=actual[mask], minlength=len(months))
+
+	return [
+		frappe._dict(month=str(month), forecasted=float(f), actual=float(a))
+		for month, f, a in zip(months, forecasted, actual)
+	]
+
+
+def get_probability_buckets(probability):
+	return np.digitize(probability, [high for _low, high in PROBABILITY_BUCKETS[:-1]])
+
+
+@frappe.whitelist()
+@sales_user_only
+def get_forecast_scenario(user="", bucket_probabilities=None):
+	"""
+	Get the revenue forecast with the probability of every deal in a bucket replaced by the
+	probability chosen for that bucket, e.g. {"0-25": 10, "75-100": 90}. Buckets that are not
+	given keep each deal's own probability.
+	"""
+	if not is_forecast_engine_available():
+		frappe.throw(_("Forecast scenarios need NumPy to be installed"))
+
+	roles = frappe.get_roles(frappe.session.user)
+	if "Sales User" in roles and not ("Sales Manager" in roles or "System Manager" in roles):
+		user = frappe.session.user
+
+	bucket_probabilities = frappe.parse_json(bucket_probabilities or "{}")
+
+	with _lock:
+		snapshot = get_deal_snapshot()
+		status_types = snapshot.get_status_types()
+		mask = snapshot.get_mask(user)
+		is_open = mask & (status_types != "Won") & (status_types != "Lost")
+
+		buckets = get_probability_buckets(snapshot.probability)
+		probability = snapshot.probability.copy()
+		for i, (low, high) in enumerate(PROBABILITY_BUCKETS):
+			value = bucket_probabilities.get(f"{low}-{high}")
+			if value is not None:
+				probability[buckets == i] = frappe.utils.flt(value)
+
+		value = snapshot.expected_deal_value * snapshot.exchange_rate
+		weighted = value * probability / 100
+
+		return {
+			"data": compute_monthly_forecast(snapshot, user, probability),
+			"weighted_pipeline": float(weighted[is_open].sum()),
+			"buckets": [
+				{
+					"bucket": f"{low}-{high}",
+					"deals": int((is_open & (buckets == i)).sum()),
+					"pipeline": float(value[is_open & (buckets == i)].sum()),
+					"weighted": float(weighted[is_open & (buckets == i)].sum()),
+				}
+				for i, (low, high) in enumerate(PROBABILITY_BUCKETS)
+			],
+		}
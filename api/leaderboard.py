@@ -0,0 +1,281 @@
+import heapq
+from itertools import groupby
+from operator import itemgetter
+
+import frappe
+import redis
+from frappe.utils import add_days, flt, get_first_day, get_last_day, getdate
+
+from crm.api.dashboard_rollup import ROLLUP_TABLE, is_dashboard_rollup_ready
+from crm.api.replica import on_primary, replica_read
+from crm.utils import sales_user_only
+
+# Per-salesperson deal leaderboard.
+#
+# Deal counts and value per owner and creation date are kept in redis, one hash per month
+# (`crm_deal_leaderboard::2024-05`) with a `{day}|deals|{owner}` and a `{day}|value|{owner}`
+# field per day and owner. A month is loaded with a single grouped query (from the dashboard
+# rollup when it is ready, else from CRM Deal) the first time it is read. Once a deal write is
+# committed, the difference between the deal's old and new count and value is added to the
+# fields of its day and owner with HINCRBY / HINCRBYFLOAT, in months that are loaded.
+#
+# A write committed while its month is being loaded can be missed, so every month expires
+# LEADERBOARD_TTL seconds after it was loaded and is then counted again.
+#
+# Top-k queries merge the sorted days of the range with a heap, sum the rows of every owner
+# and pick the leaders with another heap. Full names come from a cached user directory.
+
+LEADERBOARD_KEY = "crm_deal_leaderboard"
+LOADED_FIELD = "loaded"
+LEADERBOARD_TTL = 24 * 60 * 60
+USER_DIRECTORY_KEY = "crm_user_directory"
+
+
+@frappe.whitelist()
+@sales_user_only
+@replica_read
+def get_leaderboard(from_date="", to_date="", limit=10, order_by="deals"):
+	"""
+	Get the top `limit` salespeople by number of deals (or deal value) created in the range.
+	[
+		{ salesperson: 'John Smith', user: 'john@example.com', deals: 45, value: 2300000 },
+		...
+	]
+	"""
+	if not from_date or not to_date:
+		from_date = get_first_day(from_date or frappe.utils.nowdate())
+		to_date = get_last_day(to_date or frappe.utils.nowdate())
+
+	return get_top_salespeople(from_date, to_date, limit=frappe.utils.cint(limit), order_by=order_by)
+
+
+def get_top_salespeople(from_date, to_date, user="", limit=None, order_by="deals"):
+	"""
+	Get salespeople ranked by deals (then value) or value (then deals), all of them if no limit is given.
+	"""
+	totals = merge_days(get_days(from_date, to_date), user)
+
+	key = itemgetter(1, 2) if order_by == "deals" else itemgetter(2, 1)
+	if limit:
+		leaders = heapq.nlargest(limit, totals, key=key)
+	else:
+		leaders = sorted(totals, key=key, reverse=True)
+
+	users = get_user_directory()
+	return [
+		{
+			"salesperson": users.get(owner) or owner or None,
+			"user": owner or None,
+			"deals": deals,
+			"value": value,
+		}
+		for owner, deals, value in leaders
+	]
+
+
+def merge_days(days, user=""):
+	"""
+	Merge the owner-sorted rows of every day into one (owner, deals, value) row per owner.
+	"""
+	rows = heapq.merge(*days, key=itemgetter(0))
+	if user:
+		rows = (row for row in rows if row[0] == user)
+
+	for owner, owner_rows in groupby(rows, key=itemgetter(0)):
+		deals = value = 0
+		for _owner, day_deals, day_value in owner_rows:
+			deals += day_deals
+			value += day_value
+		yield owner, deals, value
+
+
+def get_days(from_date, to_date):
+	"""
+	Get the rows of every day in the range that has deals, loading uncached months.
+	"""
+	from_date, to_date = getdate(from_date), getdate(to_date)
+
+	months = []
+	month = get_first_day(from_date)
+	while month <= to_date:
+		months.append(month)
+		month = add_days(get_last_day(month), 1)
+
+	cached = {month: get_cached_month(month) for month in months}
+	missing = [month for month, days in cached.items() if days is None]
+	if missing:
+		cached.update(load_months(missing))
+
+	start, end = str(from_date), str(to_date)
+	return [rows for days in cached.values() for day, rows in days.items() if start <= day <= end]
+
+
+def get_cached_month(month):
+	"""
+	Get {day: [(owner, deals, value), ...]} of a loaded month, with every day's rows sorted by
+	owner, or None if the month is not loaded.
+	"""
+	# the fields hold plain counters, read them past the wrapper's unpickling hgetall
+	fields = redis.Redis.hgetall(frappe.cache, get_month_cache_key(month))
+	if LOADED_FIELD.encode() not in fields:
+		return None
+
+	totals = {}
+	for field, amount in fields.items():
+		field = frappe.safe_decode(field)
+		if field == LOADED_FIELD:
+			continue
+		day, kind, owner = field.split("|", 2)
+		totals.setdefault((day, owner), {"deals": 0, "value": 0.0})[kind] = amount
+
+	days = {}
+	for (day, owner), total in totals.items():
+		deals = frappe.utils.cint(total["deals"])
+		if deals > 0:
+			days.setdefault(day, []).append((owner, deals, flt(total["value"])))
+
+	# heapq.merge needs every day in python's string order
+	for day_rows in days.values():
+		day_rows.sort(key=itemgetter(0))
+	return days
+
+
+def load_months(months):
+	"""
+	Count deals per day and owner for the given months and cache them.
+	"""
+	params = {"from": min(months), "to": get_last_day(max(months))}
+
+	# months are cached until a deal in them changes, so never load them from a lagging replica
+	with on_primary():
+		if is_dashboard_rollup_ready():
+			rows = frappe.db.sql(
+				f"""
+				SELECT
+					DATE_FORMAT(r.date, '%%Y-%%m-%%d') AS day,
+					r.owner AS owner,
+					CAST(SUM(r.count) AS SIGNED) AS deals,
+					SUM(r.value) AS value
+				FROM `{ROLLUP_TABLE}` r
+				WHERE r.reference_doctype = 'CRM Deal'
+					AND r.date BETWEEN %(from)s AND %(to)s
+				GROUP BY r.date, r.owner
+				""",
+				params,
+				as_dict=True,
+			)
+		else:
+			rows = frappe.db.sql(
+				"""
+				SELECT
+					DATE_FORMAT(DATE(d.creation), '%%Y-%%m-%%d') AS day,
+					IFNULL(d.deal_owner, '') AS owner,
+					COUNT(*) AS deals,
+					SUM(COALESCE(d.deal_value, 0) * IFNULL(d.exchange_rate, 1)) AS value
+				FROM `tabCRM Deal` AS d
+				WHERE d.creation >= %(from)s AND d.creation < DATE_ADD(%(to)s, INTERVAL 1 DAY)
+				GROUP BY DATE(d.creation), IFNULL(d.deal_owner, '')
+				""",
+				params,
+				as_dict=True,
+			)
+
+	loaded = {month: {} for month in months}
+	for row in rows:
+		# the query also covers cached months that lie between the missing ones, skip those
+		month = get_first_day(row.day)
+		if month in loaded:
+			loaded[month].setdefault(row.day, []).append((row.owner, row.deals, flt(row.value)))
+
+	pipeline = frappe.cache.pipeline()
+	for month, days in loaded.items():
+		fields = {LOADED_FIELD: 1}
+		for day, day_rows in days.items():
+			# heapq.merge needs every day in python's string order, not the database collation's
+			day_rows.sort(key=itemgetter(0))
+			for owner, deals, value in day_rows:
+				fields[f"{day}|deals|{owner}"] = deals
+				fields[f"{day}|value|{owner}"] = value
+
+		key = get_month_cache_key(month)
+		pipeline.delete(key)
+		pipeline.hset(key, mapping=fields)
+		pipeline.expire(key, LEADERBOARD_TTL)
+	pipeline.execute()
+
+	return loaded
+
+
+def get_month_key(date):
+	return str(getdate(date))[:7]
+
+
+def get_month_cache_key(date):
+	return frappe.cache.make_key(f"{LEADERBOARD_KEY}::{get_month_key(date)}")
+
+
+def clear_leaderboard():
+	frappe.cache.delete_keys(f"{LEADERBOARD_KEY}::")
+
+
+def on_deal_change(doc, method):
+	if method == "on_trash":
+		old, new = get_deal_contribution(doc), None
+	else:
+		doc_before_save = doc.get_doc_before_save()
+		old = get_deal_contribution(doc_before_save) if doc_before_save else None
+		new = get_deal_contribution(doc)
+
+	deltas = {}
+	for contribution, sign in ((old, -1), (new, 1)):
+		if contribution:
+			day, owner, value = contribution
+			delta = deltas.setdefault((day, owner), [0, 0.0])
+			delta[0] += sign
+			delta[1] += sign * value
+
+	deltas = {key: delta for key, delta in deltas.items() if delta != [0, 0.0]}
+	if deltas:
+		# a rolled back write must not change the counts
+		frappe.db.after_commit.add(lambda: apply_deltas(deltas))
+
+
+def get_deal_contribution(doc):
+	"""
+	Get (day, owner, value) a deal adds to the leaderboard, like load_months counts it.
+	"""
+	if not doc.creation:
+		return None
+	value = flt(doc.deal_value) * (1 if doc.exchange_rate is None else flt(doc.exchange_rate))
+	return str(getdate(doc.creation)), doc.deal_owner or "", value
+
+
+def apply_deltas(deltas):
+	"""
+	Add {(day, owner): [deals, value]} to the months that are loaded, months that are not
+	loaded count the deal when they are.
+	"""
+	pipeline = frappe.cache.pipeline()
+	for (day, owner), (deals, value) in deltas.items():
+		key = get_month_cache_key(day)
+		if not frappe.cache.hexists(key, LOADED_FIELD):
+			continue
+		if deals:
+			pipeline.hincrby(key, f"{day}|deals|{owner}", deals)
+		if value:
+			pipeline.hincrbyfloat(key, f"{day}|value|{owner}", value)
+	pipeline.execute()
+
+
+def get_user_directory():
+	"""
+	Get a cached map of user to full name.
+	"""
+	return frappe.cache.get_value(
+		USER_DIRECTORY_KEY,
+		generator=lambda: dict(frappe.get_all("User", fields=["name", "full_name"], as_list=True)),
+	)
+
+
+def on_user_change(doc, method):
+	frappe.cache.delete_value(USER_DIRECTORY_KEY)
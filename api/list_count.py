@@ -0,0 +1,82 @@
+import hashlib
+
+import frappe
+
+from crm.api.approximate_count import count_capped, estimate_count, is_approximate_count_enabled
+from crm.api.replica import is_on_replica
+
+# Cached total counts of list views.
+#
+# The total of a list is cached per count query, which holds the doctype, the filters and the
+# permission conditions of the user, so users with the same permissions share their counts and
+# a change of sort order or page length never counts again. Inserting or deleting a record of a
+# doctype drops every cached count of it; the counts are kept `crm_list_count_ttl` seconds at
+# most (default 60, 0 disables the cache), which bounds how long edits can leave them stale.
+#
+# Counts taken on the replica are not cached, a lagging replica could cache a count the last
+# insert or delete has just dropped.
+#
+# Doc events (crm/hooks.py): `after_insert` and `on_trash` of every doctype in LIST_DOCTYPES.
+# Lists of other doctypes rely on the TTL alone.
+#
+# With `crm_list_count_cap` (site config) set, lists are counted up to that many rows only and
+# larger lists come back as capped counts ("10,000+"). Very large tables in approximate count
+# mode are estimated instead, see approximate_count.
+
+COUNT_VERSION_KEY = "crm_list_count_version"
+DEFAULT_TTL = 60
+
+# doctypes whose list views are served by get_data
+LIST_DOCTYPES = (
+	"CRM Lead",
+	"CRM Deal",
+	"Contact",
+	"CRM Organization",
+	"CRM Task",
+	"FCRM Note",
+	"CRM Call Log",
+	"CRM Notification",
+)
+
+
+def get_list_total_count(doctype, filters):
+	"""
+	Get the total count of a list as {"value": ..., "lower_bound_only": bool, "lower_bound": ...}.
+	"""
+	query = str(frappe.get_list(doctype, filters=filters, fields=["name"], order_by="", run=False))
+
+	ttl = frappe.utils.cint(frappe.conf.get("crm_list_count_ttl", DEFAULT_TTL))
+	key = get_count_key(doctype, query)
+	if ttl and (count := frappe.cache.get_value(key)):
+		return frappe._dict(count)
+
+	# the query has its values inlined already, run it without parameters
+	if is_approximate_count_enabled(doctype):
+		count = estimate_count(query)
+	elif cap := frappe.utils.cint(frappe.conf.get("crm_list_count_cap")):
+		count = count_capped(query, cap)
+	else:
+		count = frappe._dict(
+			value=frappe.db.sql(f"SELECT COUNT(*) FROM ({query}) AS counted")[0][0],
+			lower_bound_only=False,
+			lower_bound=None,
+		)
+
+	if ttl and not is_on_replica():
+		frappe.cache.set_value(key, count, expires_in_sec=ttl)
+	return count
+
+
+def get_count_key(doctype, query):
+	version = frappe.cache.hget(COUNT_VERSION_KEY, doctype) or 0
+	return f"crm_list_count::{doctype}::{version}::{hashlib.sha1(query.encode()).hexdigest()}"
+
+
+def on_insert_or_trash(doc, method):
+	if doc.doctype not in LIST_DOCTYPES:
+		return
+
+	# bump after commit, a count taken in between would be cached under the new version
+	frappe.db.after_commit.add(
+		lambda: frappe.cache.hset(COUNT_VERSION_KEY, doc.doctype, frappe.generate_hash(length=10))
+	)
@@ -0,0 +1,110 @@
+import hashlib
+
+import frappe
+from frappe import _
+from frappe.model import no_value_fields
+
+from crm.api.replica import on_primary
+from crm.api.views import get_views
+from crm.fcrm.doctype.crm_form_script.crm_form_script import get_form_script
+
+# Cached static part of list view responses: the filterable fields with their translated labels,
+# the form and list scripts, and the saved views. None of it depends on the filters.
+#
+# Fields and scripts are cached per (doctype, language, role set), views per (doctype, user),
+# both for META_TTL seconds at most. Committing a change to a DocType, Custom Field, Property
+# Setter, CRM View Settings or CRM Form Script bumps the version of the doctype it belongs to,
+# which drops both. Both are built on the primary, so a lagging replica can never cache the
+# meta of an old version under the new one.
+#
+# Every response carries a `meta_version` token. Clients sending it back get the static keys
+# as None while the token is still current.
+
+META_VERSION_KEY = "crm_list_meta_version"
+META_TTL = 60 * 60
+
+STD_FIELDS = [
+	{"label": "Name", "fieldtype": "Data", "fieldname": "name"},
+	{"label": "Created on", "fieldtype": "Datetime", "fieldname": "creation"},
+	{"label": "Last modified", "fieldtype": "Datetime", "fieldname": "modified"},
+	{
+		"label": "Modified by",
+		"fieldtype": "Link",
+		"fieldname": "modified_by",
+		"options": "User",
+	},
+	{"label": "Assigned to", "fieldtype": "Text", "fieldname": "_assign"},
+	{"label": "Owner", "fieldtype": "Link", "fieldname": "owner", "options": "User"},
+	{"label": "Like", "fieldtype": "Data", "fieldname": "_liked_by"},
+]
+
+# doctype of a changed record -> field holding the doctype whose list meta it changes
+META_SOURCES = {
+	"DocType": "name",
+	"Custom Field": "dt",
+	"Property Setter": "doc_type",
+	"CRM View Settings": "dt",
+	"CRM Form Script": "dt",
+}
+
+
+def get_list_meta(doctype):
+	"""
+	Get {"version", "fields", "views", "form_script", "list_script"} of a doctype's list view.
+	"""
+	version = frappe.cache.hget(META_VERSION_KEY, doctype) or 0
+	roles = hashlib.sha1("\n".join(sorted(frappe.get_roles())).encode()).hexdigest()[:16]
+
+	static_key = f"crm_list_meta::{doctype}::{version}::{frappe.local.lang}::{roles}"
+	views_key = f"crm_list_views::{doctype}::{version}::{frappe.session.user}"
+
+	meta = get_cached(static_key, lambda: build_list_meta(doctype))
+	views = get_cached(views_key, lambda: get_views(doctype))
+
+	return frappe._dict(
+		version=hashlib.sha1(f"{static_key}\n{views_key}".encode()).hexdigest()[:16],
+		views=views,
+		**meta,
+	)
+
+
+def get_cached(key, generator):
+	value = frappe.cache.get_value(key)
+	if value is None:
+		with on_primary():
+			value = generator()
+		frappe.cache.set_value(key, value, expires_in_sec=META_TTL)
+	return value
+
+
+def build_list_meta(doctype):
+	fields = [
+		{
+			"label": _(field.label),
+			"fieldtype": field.fieldtype,
+			"fieldname": field.fieldname,
+			"options": field.options,
+		}
+		for field in frappe.get_meta(doctype).fields
+		if field.fieldtype not in no_value_fields and field.label and field.fieldname
+	]
+
+	for field in STD_FIELDS:
+		if field not in fields:
+			fields.append({**field, "label": _(field["label"])})
+
+	return {
+		"fields": fields,
+		"form_script": get_form_script(doctype),
+		"list_script": get_form_script(doctype, "List"),
+	}
+
+
+def on_change(doc, method):
+	# bump after commit, meta built in between would be cached under the new version
+	fieldname = META_SOURCES.get(doc.doctype)
+	if fieldname and doc.get(fieldname):
+		doctype = doc.get(fieldname)
+		frappe.db.after_commit.add(
+			lambda: frappe.cache.hset(META_VERSION_KEY, doctype, frappe.generate_hash(length=10))
+		)
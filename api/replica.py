@@ -0,0 +1,168 @@
+import functools
+import time
+from contextlib import contextmanager
+
+import frappe
+from pymysql.constants import CR
+from pymysql.err import InterfaceError, OperationalError
+
+# Routes read-only reporting endpoints (dashboard charts, list and kanban data) to a read replica
+# so heavy reads do not compete with lead and deal writes on the primary.
+#
+# The replica connection uses frappe's own replica settings (`replica_host`, `replica_db_port`,
+# `different_credentials_for_replica`). Site config:
+# - `crm_read_from_replica`: turn routing on
+# - `crm_replica_max_lag`: seconds the replica may lag behind the primary (default 30, -1 skips the
+#   check for database users without the privilege to run SHOW SLAVE STATUS)
+# - `crm_replica_retry_after`: seconds to stay on the primary after the replica failed (default 60)
+#
+# Replica health is checked at most every REPLICA_CHECK_INTERVAL seconds per worker process.
+# Whenever the replica is unreachable or too far behind, requests run on the primary. A request
+# that loses its replica connection midway is marked unhealthy and run again on the primary.
+
+DEFAULT_MAX_LAG = 30
+DEFAULT_RETRY_AFTER = 60
+REPLICA_CHECK_INTERVAL = 5
+
+CONNECTION_ERRORS = (CR.CR_CONNECTION_ERROR, CR.CR_CONN_HOST_ERROR, CR.CR_SERVER_GONE_ERROR, CR.CR_SERVER_LOST)
+
+# site -> (checked_at, healthy)
+_replica_status = {}
+
+
+def replica_read(fn):
+	"""
+	Run the decorated read-only function on the replica when it is enabled and healthy.
+	"""
+
+	@functools.wraps(fn)
+	def wrapper(*args, **kwargs):
+		if not connect_replica():
+			return fn(*args, **kwargs)
+
+		try:
+			return fn(*args, **kwargs)
+		except Exception as e:
+			if not is_connection_error(e):
+				raise
+			_replica_status[frappe.local.site] = (time.monotonic(), False)
+			log_replica_error()
+		finally:
+			disconnect_replica()
+
+		# only reads ran on the replica, running the function again on the primary is safe
+		return fn(*args, **kwargs)
+
+	return wrapper
+
+
+def is_connection_error(e):
+	return isinstance(e, InterfaceError) or (
+		isinstance(e, OperationalError) and bool(e.args) and e.args[0] in CONNECTION_ERRORS
+	)
+
+
+def is_replica_enabled():
+	return bool(frappe.conf.get("crm_read_from_replica") and frappe.conf.get("replica_host"))
+
+
+def connect_replica():
+	"""
+	Swap `frappe.db` for a replica connection. Returns False, leaving the primary in place, if the
+	replica is disabled, unhealthy or already in use.
+	"""
+	if not is_replica_enabled() or getattr(frappe.local, "primary_db", None):
+		return False
+
+	checked_at, healthy = _replica_status.get(frappe.local.site, (0, True))
+	interval = REPLICA_CHECK_INTERVAL if healthy else get_retry_after()
+	if not healthy and time.monotonic() - checked_at < interval:
+		return False
+
+	if not frappe.connect_replica():
+		return False
+
+	if time.monotonic() - checked_at >= interval:
+		healthy = check_replica()
+		_replica_status[frappe.local.site] = (time.monotonic(), healthy)
+		if not healthy:
+			disconnect_replica()
+			return False
+
+	return True
+
+
+def disconnect_replica():
+	primary_db = getattr(frappe.local, "primary_db", None)
+	if not primary_db:
+		return
+
+	try:
+		frappe.local.db.close()
+	except Exception:
+		# a connection lost midway cannot be closed again
+		pass
+	finally:
+		# frappe.connect_replica refuses to connect again while these are set
+		frappe.local.db = primary_db
+		del frappe.local.primary_db
+		del frappe.local.replica_db
+
+
+def check_replica():
+	"""
+	Check that the replica answers and does not lag more than `crm_replica_max_lag` seconds.
+	"""
+	max_lag = frappe.utils.cint(frappe.conf.get("crm_replica_max_lag", DEFAULT_MAX_LAG))
+
+	try:
+		if max_lag < 0:
+			frappe.db.sql("SELECT 1")
+			return True
+
+		status = frappe.db.sql("SHOW SLAVE STATUS", as_dict=True)
+	except Exception:
+		log_replica_error()
+		return False
+
+	# no status means the server is not replicating, NULL lag means replication has stopped
+	lag = status[0].get("Seconds_Behind_Master") if status else None
+	return lag is not None and lag <= max_lag
+
+
+def log_replica_error():
+	# log on the primary, and never let a failed log keep a request from falling back to it
+	try:
+		with on_primary():
+			frappe.log_error(title="CRM read replica unavailable")
+	except Exception:
+		pass
+
+
+def is_on_replica():
+	"""
+	Check whether `frappe.db` is the replica, e.g. to keep what it reads out of shared caches.
+	"""
+	primary_db = getattr(frappe.local, "primary_db", None)
+	return bool(primary_db) and frappe.local.db is not primary_db
+
+
+def get_retry_after():
+	return frappe.utils.cint(frappe.conf.get("crm_replica_retry_after", DEFAULT_RETRY_AFTER))
+
+
+@contextmanager
+def on_primary():
+	"""
+	Run a block on the primary from within a replica read, for writes or for reads that must not be stale.
+	"""
+	primary_db = getattr(frappe.local, "primary_db", None)
+	if not primary_db:
+		yield
+		return
+
+	replica_db, frappe.local.db = frappe.local.db, primary_db
+	try:
+		yield
+	finally:
+		frappe.local.db = replica_db
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from crm.api import analytics_store
+from crm.api.analytics_store import STORE_TABLES, export_table, get_store_forecast, get_store_trend
+
+STATUSES = {
+	None: ["Qualification", "Negotiation", "Won", "Lost"],
+	("Won",): ["Won"],
+	("Lost",): ["Lost"],
+}
+
+FIXTURE = {
+	"deals": [
+		# name, creation, deal_owner, status, expected_closure_date, expected_deal_value, deal_value, probability, exchange_rate
+		["D-1", "2024-05-01 10:00:00", "a@example.com", "Won", "2024-05-20", 1000, 900, 100, 1],
+		["D-2", "2024-05-01 11:00:00", "b@example.com", "Negotiation", "2024-05-25", 2000, "", 50, 2],
+		["D-3", "2024-05-02 09:00:00", "a@example.com", "Lost", "2024-06-10", 500, "", 10, ""],
+		["D-4", "2024-05-02 12:00:00", "a@example.com", "Removed", "2024-06-15", 700, "", 50, 1],
+	],
+	"leads": [
+		# name, creation, lead_owner, status, source, territory
+		["L-1", "2024-05-01 08:00:00", "a@example.com", "New", "", ""],
+		["L-2", "2024-05-02 08:00:00", "b@example.com", "New", "", ""],
+	],
+	"status_changes": [],
+}
+
+
+class TestAnalyticsStore(unittest.TestCase):
+	"""
+	Runs the store queries against a small Parquet copy of the deal and lead tables.
+	"""
+
+	@classmethod
+	def setUpClass(cls):
+		if analytics_store.duckdb is None:
+			raise unittest.SkipTest("duckdb is not installed")
+
+		cls.path = tempfile.mkdtemp()
+		for table, meta in STORE_TABLES.items():
+			export_table(os.path.join(cls.path, f"{table}.parquet"), meta, rows=FIXTURE[table])
+			export_table(os.path.join(cls.path, f"{table}_delta.parquet"), meta, delta=True, rows=[])
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.path, ignore_errors=True)
+
+	def setUp(self):
+		for target, side_effect in (
+			("get_store_path", lambda *parts: os.path.join(self.path, *parts)),
+			("get_statuses", lambda types=None: STATUSES[tuple(types) if types else None]),
+		):
+			patcher = patch.object(analytics_store, target, side_effect=side_effect)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def test_store_trend(self):
+		self.assertEqual(
+			[(row.date, row.leads, row.deals, row.won_deals) for row in get_store_trend("2024-05-01", "2024-05-31")],
+			[("2024-05-01", 1, 2, 1), ("2024-05-02", 1, 1, 0)],
+		)
+
+		rows = get_store_trend("2024-05-01", "2024-05-31", "a@example.com")
+		self.assertEqual([(row.date, row.leads, row.deals) for row in rows], [("2024-05-01", 1, 1), ("2024-05-02", 0, 1)])
+
+	def test_store_forecast(self):
+		rows = get_store_forecast("2024-05-01", "2024-06-30")
+		self.assertEqual([row.month for row in rows], ["2024-05", "2024-06"])
+		# the won deal at its probability plus the open one in its own currency
+		self.assertAlmostEqual(rows[0].forecasted, 1000 + 2000 * 0.5 * 2)
+		self.assertAlmostEqual(rows[0].actual, 900)
+		# lost deals are forecasted at their full value, unknown statuses are left out
+		self.assertAlmostEqual(rows[1].forecasted, 500)
+		self.assertAlmostEqual(rows[1].actual, 0)
+
+		rows = get_store_forecast("2024-05-01", "2024-06-30", "b@example.com")
+		self.assertEqual([(row.month, row.forecasted) for row in rows], [("2024-05", 2000.0)])
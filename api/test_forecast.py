@@ -0,0 +1,104 @@
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_months, flt, get_first_day, nowdate
+
+from crm.api import forecast
+from crm.api.dashboard import get_forecasted_revenue
+from crm.api.deal_status import STATUS_VERSION_KEY
+
+OWNER = "forecast-test@example.com"
+
+# status -> type, "" for a status without a type
+STATUSES = {
+	"Test Forecast Open": "Open",
+	"Test Forecast Untyped": "",
+	"Test Forecast Won": "Won",
+	"Test Forecast Lost": "Lost",
+}
+
+
+class TestForecast(FrappeTestCase):
+	"""
+	Compares the NumPy forecast with the SQL one over the same deals.
+	"""
+
+	@classmethod
+	def setUpClass(cls):
+		if not forecast.is_forecast_engine_available():
+			raise unittest.SkipTest("NumPy is not installed")
+
+		super().setUpClass()
+
+		for position, (status, status_type) in enumerate(STATUSES.items(), 100):
+			frappe.get_doc(
+				{
+					"doctype": "CRM Deal Status",
+					"name": status,
+					"deal_status": status,
+					"type": status_type or None,
+					"position": position,
+				}
+			).db_insert()
+		frappe.cache.set_value(STATUS_VERSION_KEY, frappe.generate_hash(length=10))
+
+		month = get_first_day(nowdate())
+		deals = [
+			# status, months from now, expected deal value, deal value, probability, exchange rate
+			("Test Forecast Open", 0, 1000, None, 50, 1),
+			("Test Forecast Untyped", 0, 400, None, 25, 2),
+			("Test Forecast Won", -1, 2000, 1800, 100, 1),
+			("Test Forecast Lost", 1, 700, None, 10, None),
+			("Test Forecast Removed", 1, 900, None, 50, 1),
+			("Test Forecast Untyped", 2, 300, None, 100, 1),
+		]
+		for i, (status, months, expected_deal_value, deal_value, probability, exchange_rate) in enumerate(deals):
+			frappe.get_doc(
+				{
+					"doctype": "CRM Deal",
+					"name": f"TEST-FORECAST-{i}",
+					"deal_owner": OWNER,
+					"status": status,
+					"expected_closure_date": add_months(month, months),
+					"expected_deal_value": expected_deal_value,
+					"deal_value": deal_value,
+					"probability": probability,
+					"exchange_rate": exchange_rate,
+				}
+			).db_insert()
+
+	@classmethod
+	def tearDownClass(cls):
+		frappe.cache.set_value(STATUS_VERSION_KEY, frappe.generate_hash(length=10))
+		super().tearDownClass()
+
+	def setUp(self):
+		forecast._snapshots.pop(frappe.local.site, None)
+
+	def get_forecast(self, engine):
+		with patch("crm.api.dashboard.is_forecast_engine_available", return_value=engine):
+			return [
+				(row["month"], flt(row["forecasted"]), flt(row["actual"]))
+				for row in get_forecasted_revenue(user=OWNER)["data"]
+			]
+
+	def test_engine_matches_sql(self):
+		expected = self.get_forecast(engine=False)
+		result = self.get_forecast(engine=True)
+
+		self.assertEqual([month for month, *_values in result], [month for month, *_values in expected])
+		for (_month, forecasted, actual), (_month, expected_forecasted, expected_actual) in zip(result, expected):
+			self.assertAlmostEqual(forecasted, expected_forecasted)
+			self.assertAlmostEqual(actual, expected_actual)
+
+	def test_untyped_statuses_are_forecasted(self):
+		month = get_first_day(nowdate())
+		result = {row[0]: row[1] for row in self.get_forecast(engine=True)}
+
+		# the open deal at 50% plus the untyped one at 25% in its own currency
+		self.assertAlmostEqual(result[str(month)], 1000 * 0.5 + 400 * 0.25 * 2)
+		self.assertAlmostEqual(result[str(add_months(month, 2))], 300)
+		# lost deals at their full value, deals with a status that does not exist are left out
+		self.assertAlmostEqual(result[str(add_months(month, 1))], 700)
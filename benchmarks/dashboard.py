@@ -0,0 +1,277 @@
+"""
+Benchmarks for crm.api.dashboard.
+
+Seed a site with synthetic CRM data, time every dashboard chart and get_dashboard, then clean up:
+
+	bench --site <site> execute crm.benchmarks.dashboard.seed --kwargs "{'leads': 100000, 'deals': 50000}"
+	bench --site <site> execute crm.benchmarks.dashboard.run --kwargs "{'iterations': 20, 'output': 'bench.json'}"
+	bench --site <site> execute crm.benchmarks.dashboard.cleanup
+
+Run it against a local database only, every seeded record is named with the BENCH- prefix.
+"""
+
+import json
+import random
+import time
+
+import frappe
+from frappe.utils import add_days, add_to_date, now_datetime
+
+from crm.api.cohort import is_cohort_table_ready, rebuild_cohort_table
+from crm.api.dashboard_charts import CHARTS
+from crm.api.dashboard_profiler import QueryRecorder, percentile
+from crm.api.dashboard_rollup import is_dashboard_rollup_ready, rebuild_dashboard_rollup
+from crm.api.leaderboard import clear_leaderboard
+
+PREFIX = "BENCH-"
+CHUNK_SIZE = 10_000
+LEAD_SOURCES = ["Website", "Referral", "Cold Call", "Advertisement", "Campaign", "Exhibition"]
+LOST_REASONS = ["Price too high", "Competitor won", "No budget", "No response", "Other"]
+
+
+def seed(leads=10_000, deals=5_000, status_changes=3, users=20, territories=10, days=365, random_seed=0):
+	"""
+	Bulk insert synthetic users, territories, leads, deals and deal status change logs.
+	The dashboard rollup and leaderboard are rebuilt afterwards, as bulk inserts skip doc events.
+	"""
+	frappe.only_for("System Manager", True)
+	rng = random.Random(random_seed)
+	now = now_datetime()
+
+	user_names = [f"bench-user-{i}@example.com" for i in range(int(users))]
+	territory_names = [f"{PREFIX}Territory {i}" for i in range(int(territories))]
+	lead_statuses = frappe.get_all("CRM Lead Status", pluck="name") or ["New"]
+	deal_statuses = frappe.get_all("CRM Deal Status", fields=["name", "type"], order_by="position asc")
+
+	for source in LEAD_SOURCES:
+		if not frappe.db.exists("CRM Lead Source", source):
+			frappe.get_doc({"doctype": "CRM Lead Source", "source_name": source}).insert(ignore_permissions=True)
+
+	insert(
+		"User",
+		["name", "email", "first_name", "full_name", "enabled", "user_type"],
+		(
+			[name, name, f"Bench User {i}", f"Bench User {i}", 1, "System User"]
+			for i, name in enumerate(user_names)
+			if not frappe.db.exists("User", name)
+		),
+	)
+	insert(
+		"CRM Territory",
+		["name", "territory_name"],
+		([name, name] for name in territory_names if not frappe.db.exists("CRM Territory", name)),
+	)
+
+	def random_creation():
+		return add_to_date(now, days=-rng.randint(0, int(days)), seconds=-rng.randint(0, 86400))
+
+	def lead_rows():
+		for i in range(int(leads)):
+			creation = random_creation()
+			yield [
+				f"{PREFIX}LEAD-{i}",
+				creation,
+				creation,
+				f"Bench {i}",
+				f"Bench {i}",
+				rng.choice(user_names),
+				rng.choice(LEAD_SOURCES),
+				rng.choice(territory_names),
+				rng.choice(lead_statuses),
+			]
+
+	insert(
+		"CRM Lead",
+		["first_name", "lead_name", "lead_owner", "source", "territory", "status"],
+		lead_rows(),
+		standard_fields=True,
+	)
+
+	change_logs = []
+
+	def deal_rows():
+		for i in range(int(deals)):
+			creation = random_creation()
+			position = rng.randrange(len(deal_statuses))
+			status = deal_statuses[position]
+			closed = status.type in ("Won", "Lost")
+			deal_value = rng.randint(1, 500) * 1000
+			name = f"{PREFIX}DEAL-{i}"
+
+			yield [
+				name,
+				creation,
+				creation,
+				rng.choice(user_names),
+				status.name,
+				rng.choice(LEAD_SOURCES),
+				rng.choice(territory_names),
+				deal_value,
+				deal_value,
+				rng.choice([10, 25, 50, 75, 90]),
+				1,
+				add_days(creation, rng.randint(-30, 120)),
+				add_days(creation, rng.randint(1, 90)) if closed else None,
+				f"{PREFIX}LEAD-{rng.randrange(int(leads))}" if leads and rng.random() < 0.6 else None,
+				rng.choice(LOST_REASONS) if status.type == "Lost" else None,
+			]
+
+			for idx in range(min(int(status_changes), position + 1)):
+				change_logs.append(
+					[
+						f"{name}-{idx}",
+						creation,
+						creation,
+						name,
+						"CRM Deal",
+						"status_change_log",
+						idx + 1,
+						deal_statuses[idx - 1].name if idx else "",
+						deal_statuses[idx].name,
+					]
+				)
+
+	insert(
+		"CRM Deal",
+		[
+			"deal_owner",
+			"status",
+			"source",
+			"territory",
+			"deal_value",
+			"expected_deal_value",
+			"probability",
+			"exchange_rate",
+			"expected_closure_date",
+			"closed_date",
+			"lead",
+			"lost_reason",
+		],
+		deal_rows(),
+		standard_fields=True,
+		on_chunk=lambda: flush_change_logs(change_logs),
+	)
+	flush_change_logs(change_logs)
+
+	if is_dashboard_rollup_ready():
+		rebuild_dashboard_rollup()
+	if is_cohort_table_ready():
+		rebuild_cohort_table()
+	clear_leaderboard()
+
+
+def flush_change_logs(change_logs):
+	insert(
+		"CRM Status Change Log",
+		["parent", "parenttype", "parentfield", "idx", "from", "to"],
+		iter(change_logs),
+		standard_fields=True,
+	)
+	change_logs.clear()
+
+
+def insert(doctype, fields, rows, standard_fields=False, on_chunk=None):
+	"""
+	Insert rows in chunks with frappe.db.bulk_insert, committing after every chunk.
+	With `standard_fields` every row starts with name, creation and modified.
+	"""
+	if standard_fields:
+		fields = ["name", "creation", "modified", *fields]
+
+	chunk = []
+	for row in rows:
+		chunk.append(row)
+		if len(chunk) >= CHUNK_SIZE:
+			frappe.db.bulk_insert(doctype, fields, chunk)
+			frappe.db.commit()
+			chunk = []
+			if on_chunk:
+				on_chunk()
+
+	if chunk:
+		frappe.db.bulk_insert(doctype, fields, chunk)
+		frappe.db.commit()
+
+
+def cleanup():
+	"""
+	Delete everything created by `seed`.
+	"""
+	frappe.only_for("System Manager", True)
+
+	frappe.db.sql("DELETE FROM `tabCRM Status Change Log` WHERE parent LIKE %s", f"{PREFIX}%")
+	frappe.db.sql("DELETE FROM `tabCRM Deal` WHERE name LIKE %s", f"{PREFIX}%")
+	frappe.db.sql("DELETE FROM `tabCRM Lead` WHERE name LIKE %s", f"{PREFIX}%")
+	frappe.db.sql("DELETE FROM `tabCRM Territory` WHERE name LIKE %s", f"{PREFIX}%")
+	frappe.db.sql("DELETE FROM `tabUser` WHERE name LIKE %s", "bench-user-%@example.com")
+	frappe.db.commit()
+
+	if is_dashboard_rollup_ready():
+		rebuild_dashboard_rollup()
+	if is_cohort_table_ready():
+		rebuild_cohort_table()
+	clear_leaderboard()
+
+
+def run(iterations=10, from_date=None, to_date=None, user="", output=None):
+	"""
+	Time every dashboard chart and get_dashboard, reporting p50/p95/p99 latency in milliseconds
+	and the number of queries per call. The dashboard cache is bypassed and charts are computed
+	one after the other, so the query counts are those of a single connection.
+	"""
+	from crm.api.dashboard import get_chart_data, get_dashboard
+
+	frappe.only_for("System Manager", True)
+
+	from_date = from_date or frappe.utils.get_first_day(frappe.utils.nowdate())
+	to_date = to_date or frappe.utils.get_last_day(frappe.utils.nowdate())
+	overrides = {"crm_dashboard_cache_ttl": 0, "crm_dashboard_workers": 0}
+	saved = {key: frappe.conf.pop(key) for key in overrides if key in frappe.conf}
+	frappe.conf.update(overrides)
+
+	try:
+		report = {
+			"from_date": str(from_date),
+			"to_date": str(to_date),
+			"user": user,
+			"iterations": int(iterations),
+			"rows": {
+				doctype: frappe.db.count(doctype)
+				for doctype in ["CRM Lead", "CRM Deal", "CRM Status Change Log", "User", "CRM Territory"]
+			},
+			"charts": {},
+		}
+
+		for name in CHARTS:
+			report["charts"][name] = measure(lambda: get_chart_data(name, from_date, to_date, user), iterations)
+
+		report["dashboard"] = measure(lambda: get_dashboard(from_date, to_date, user), iterations)
+	finally:
+		for key in overrides:
+			frappe.conf.pop(key)
+		frappe.conf.update(saved)
+
+	if output:
+		with open(output, "w") as f:
+			json.dump(report, f, indent=1)
+
+	return report
+
+
+def measure(fn, iterations):
+	timings = []
+	queries = []
+	for _i in range(int(iterations)):
+		with QueryRecorder() as recorder:
+			start = time.perf_counter()
+			fn()
+			timings.append((time.perf_counter() - start) * 1000)
+		queries.append(len(recorder.queries))
+
+	return {
+		"p50": percentile(timings, 50),
+		"p95": percentile(timings, 95),
+		"p99": percentile(timings, 99),
+		"mean": sum(timings) / len(timings),
+		"queries": max(queries),
+	}